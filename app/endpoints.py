@@ -1,11 +1,11 @@
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter, BackgroundTasks, HTTPException
 import subprocess
 import os
 import logging
 from datetime import datetime
 import sys
 import uuid
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from scripts.extract_text import TextExtractionProcessor
 from scripts.clustering_analysis import ClusteringAnalysisProcessor
 
@@ -19,7 +19,7 @@ from scripts.replay_screenshots import RenderScreenshotCollector
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-def run_script_safe(script_path: str, script_name: str) -> Dict[str, Any]:
+def run_script_safe(script_path: str, script_name: str, args: Optional[List[str]] = None) -> Dict[str, Any]:
     """Безопасный запуск скрипта в виде отдельного процесса."""
     logger.info(f"Запуск скрипта через subprocess: {script_name}")
     try:
@@ -32,7 +32,7 @@ def run_script_safe(script_path: str, script_name: str) -> Dict[str, Any]:
             timeout_seconds = 2700  # 45 минут для длительных операций
         
         process = subprocess.run(
-            [sys.executable, script_path],
+            [sys.executable, script_path, *(args or [])],
             capture_output=True,
             text=True,
             check=False,
@@ -89,8 +89,11 @@ def run_screenshot_task(task_id: str):
             "end_time": datetime.now().isoformat()
         })
 
-def run_ocr_task(task_id: str):
-    """Функция-обёртка для запуска OCR обработки с отслеживанием."""
+def run_ocr_task(task_id: str, reclean: bool = False):
+    """Функция-обёртка для запуска OCR обработки с отслеживанием.
+
+    reclean=True - перечистка из сохраненного сырого текста без повторного OCR.
+    """
     logger.info(f"🔤 Запуск задачи OCR обработки, ID: {task_id}")
     task_statuses[task_id].update({
         "status": "running",
@@ -108,7 +111,7 @@ def run_ocr_task(task_id: str):
 
     try:
         processor = TextExtractionProcessor(status_callback=status_callback)
-        result = processor.run()
+        result = processor.reclean() if reclean else processor.run()
         
         task_statuses[task_id].update({
             "status": "completed",
@@ -127,8 +130,11 @@ def run_ocr_task(task_id: str):
             "end_time": datetime.now().isoformat()
         })
 
-def run_clustering_task(task_id: str):
-    """Функция-обёртка для запуска кластеризации с отслеживанием."""
+def run_clustering_task(task_id: str, refit: bool = False):
+    """Функция-обёртка для запуска кластеризации с отслеживанием.
+
+    refit=True - переобучение модели на выборке и переразметка всех строк.
+    """
     logger.info(f"🎯 Запуск задачи кластеризации, ID: {task_id}")
     task_statuses[task_id].update({
         "status": "running",
@@ -146,7 +152,7 @@ def run_clustering_task(task_id: str):
 
     try:
         processor = ClusteringAnalysisProcessor(status_callback=status_callback)
-        result = processor.run()
+        result = processor.refit() if refit else processor.run()
         
         task_statuses[task_id].update({
             "status": "completed",
@@ -194,6 +200,19 @@ async def run_collect_links(background_tasks: BackgroundTasks):
     background_tasks.add_task(run_script_safe, script_path, "Collect Links")
     return {"message": "Скрипт 'Collect Links' добавлен в очередь выполнения."}
 
+@router.post("/scripts/collect-links/backfill", summary="🔗 Пересбор ссылок за период", tags=["🔧 Scripts Management"])
+async def run_collect_links_backfill(date_from: str, background_tasks: BackgroundTasks, date_to: Optional[str] = None):
+    """Пересбор ссылок за дни date_from..date_to (YYYY-MM-DD) параллельными шардами без сдвига отметки
+    инкрементального сбора; повторный вызов продолжает прерванный пересбор с невыполненных шардов."""
+    try:
+        for value in filter(None, [date_from, date_to]):
+            datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Даты должны быть в формате YYYY-MM-DD")
+    args = ["backfill", date_from] + ([date_to] if date_to else [])
+    background_tasks.add_task(run_script_safe, "scripts/collect_links.py", "Collect Links Backfill", args)
+    return {"message": f"Пересбор ссылок за {date_from} - {date_to or date_from} добавлен в очередь выполнения."}
+
 @router.post("/scripts/extract-text", summary="📝 Извлечение текста OCR", tags=["🔧 Scripts Management"])
 async def run_text_extraction_tracked(background_tasks: BackgroundTasks):
     """Запускает OCR обработку архивов в фоне и возвращает ID задачи для отслеживания."""
@@ -212,6 +231,24 @@ async def run_text_extraction_tracked(background_tasks: BackgroundTasks):
         "status_url": f"/api/task-status/{task_id}"
     }
 
+@router.post("/scripts/extract-text/reclean", summary="🧹 Перечистка OCR текста без повторного OCR", tags=["🔧 Scripts Management"])
+async def run_text_reclean_tracked(background_tasks: BackgroundTasks):
+    """Перевыводит очищенные поля и userinfo из сохраненного сырого OCR текста и возвращает ID задачи."""
+    task_id = str(uuid.uuid4())
+    task_statuses[task_id] = {
+        "status": "queued", 
+        "details": "Задача перечистки OCR текста добавлена в очередь",
+        "start_time": datetime.now().isoformat()
+    }
+    
+    background_tasks.add_task(run_ocr_task, task_id, True)
+    
+    return {
+        "message": "Задача по перечистке OCR текста запущена. Используйте ID для отслеживания статуса.",
+        "task_id": task_id,
+        "status_url": f"/api/task-status/{task_id}"
+    }
+
 @router.post("/scripts/clustering", summary="🎯 Кластеризация и анализ", tags=["🔧 Scripts Management"])
 async def run_clustering_analysis_tracked(background_tasks: BackgroundTasks):
     """Запускает кластеризацию и анализ данных в фоне и возвращает ID задачи для отслеживания."""
@@ -228,4 +265,22 @@ async def run_clustering_analysis_tracked(background_tasks: BackgroundTasks):
         "message": "Задача по кластеризации и анализу запущена. Используйте ID для отслеживания статуса.",
         "task_id": task_id,
         "status_url": f"/api/task-status/{task_id}"
-    }
\ No newline at end of file
+    }
+
+@router.post("/scripts/clustering/refit", summary="🔁 Переобучение модели кластеризации", tags=["🔧 Scripts Management"])
+async def run_clustering_refit_tracked(background_tasks: BackgroundTasks):
+    """Переобучает модель кластеризации на выборке, переразмечает все строки и возвращает ID задачи."""
+    task_id = str(uuid.uuid4())
+    task_statuses[task_id] = {
+        "status": "queued", 
+        "details": "Задача переобучения модели кластеризации добавлена в очередь",
+        "start_time": datetime.now().isoformat()
+    }
+    
+    background_tasks.add_task(run_clustering_task, task_id, True)
+    
+    return {
+        "message": "Задача по переобучению модели кластеризации запущена. Используйте ID для отслеживания статуса.",
+        "task_id": task_id,
+        "status_url": f"/api/task-status/{task_id}"
+    }
@@ -0,0 +1,132 @@
+"""Проверка и бенчмарк векторизованного извлечения признаков кластеризации.
+
+1. Генерирует воспроизводимый (seed) синтетический набор сессий из фраз с ключевыми
+   словами, мусора и пустых значений.
+2. Сверяет колоночные методы ClusteringAnalysisProcessor (extract_features_vectorized,
+   smart_categorize_vectorized, extract_sentiment_vectorized, has_problem_vectorized,
+   detect_problem_source_vectorized) с построчными эталонами.
+3. Замеряет время: iterrows / apply(axis=1) против одного колоночного прохода.
+
+Запуск: python benchmarks/clustering_features.py [--rows 20000] [--seed 42]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.clustering_analysis import (
+    ClusteringAnalysisProcessor, FEATURE_KEYWORDS, KEYWORD_FEATURES, NUMERIC_FEATURES,
+    NEGATIVE_ACTIONS, PROBLEM_INDICATORS, PROBLEM_SOURCE_KEYWORDS,
+)
+
+FILLER = [
+    'the user opened the main page', 'scrolled through the list', 'session ended quickly',
+    'Highlights', 'clicked several times', 'returned later', 'Пользователь открыл раздел',
+]
+SENTIMENTS = ['Positive', 'negative', 'Neutral', 'mixed feelings', 'The user felt positive', '', None]
+SESSION_LENGTHS = ['1h 5m', '12m 3s', '45s', '3m', '', None, '2h']
+EVENT_TOTALS = ['0', '1', '7', 'abc', '', None, 3, '12.5']
+
+
+def build_fixture(rows, seed):
+    rng = random.Random(seed)
+    vocabulary = [w for words in FEATURE_KEYWORDS.values() for w in words]
+    vocabulary += PROBLEM_INDICATORS + NEGATIVE_ACTIONS + ['download']
+    vocabulary += [w for _, words in PROBLEM_SOURCE_KEYWORDS for w in words]
+
+    def phrase():
+        if rng.random() < 0.05:
+            return rng.choice([None, '', 'null'])
+        words = rng.sample(FILLER, 2) + [rng.choice(vocabulary).upper() if rng.random() < 0.2 else rng.choice(vocabulary)
+                                         for _ in range(rng.randint(0, 4))]
+        rng.shuffle(words)
+        return ' '.join(words)
+
+    return pd.DataFrame({
+        'session_id': [f's{i}' for i in range(rows)],
+        'summary': [phrase() for _ in range(rows)],
+        'actions': [phrase() for _ in range(rows)],
+        'sentiment': [rng.choice(SENTIMENTS) for _ in range(rows)],
+        'sentiment_label': [rng.choice(['negative', 'positive', 'neutral', '', None]) for _ in range(rows)],
+        'session_length': [rng.choice(SESSION_LENGTHS) for _ in range(rows)],
+        'event_total': [rng.choice(EVENT_TOTALS) for _ in range(rows)],
+    })
+
+
+def row_wise(processor, df):
+    features_list = [processor.extract_features_advanced(row) for _, row in df.iterrows()]
+    features_df = pd.DataFrame(features_list, index=df.index)[KEYWORD_FEATURES + NUMERIC_FEATURES]
+    categories = [processor.smart_categorize(row, features) for (_, row), features in zip(df.iterrows(), features_list)]
+    labelled = df.assign(sentiment_label=df['sentiment'].apply(processor.extract_sentiment))
+    return {
+        'features': features_df,
+        'smart_category': np.array(categories, dtype=object),
+        'sentiment_label': labelled['sentiment_label'].to_numpy(dtype=object),
+        'has_problem': labelled.apply(processor.has_problem_advanced, axis=1).to_numpy(dtype=int),
+        'problem_source': labelled.apply(processor.detect_problem_source_advanced, axis=1).to_numpy(dtype=object),
+    }
+
+
+def vectorized(processor, df):
+    features_df, keyword_matrix, keyword_names = processor.extract_features_vectorized(df)
+    smart_category = processor.smart_categorize_vectorized(df, features_df, keyword_matrix, keyword_names)
+    sentiment_label = processor.extract_sentiment_vectorized(df['sentiment'])
+    return {
+        'features': features_df,
+        'smart_category': smart_category,
+        'sentiment_label': sentiment_label,
+        'has_problem': processor.has_problem_vectorized(sentiment_label, keyword_matrix, keyword_names),
+        'problem_source': processor.detect_problem_source_vectorized(keyword_matrix, keyword_names),
+    }
+
+
+def compare(expected, actual):
+    mismatches = 0
+    for column in KEYWORD_FEATURES + NUMERIC_FEATURES:
+        diff = int((expected['features'][column].to_numpy(dtype=float) != actual['features'][column].to_numpy(dtype=float)).sum())
+        if diff:
+            print(f"❌ {column}: {diff} расхождений")
+        mismatches += diff
+    for key in ['smart_category', 'sentiment_label', 'has_problem', 'problem_source']:
+        diff = int((np.asarray(expected[key]) != np.asarray(actual[key])).sum())
+        if diff:
+            print(f"❌ {key}: {diff} расхождений")
+        mismatches += diff
+    return mismatches
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # Клиенты BigQuery не нужны: проверяются только чистые методы признаков
+    processor = ClusteringAnalysisProcessor.__new__(ClusteringAnalysisProcessor)
+    df = build_fixture(args.rows, args.seed)
+
+    expected, row_time = timed(lambda: row_wise(processor, df))
+    actual, vector_time = timed(lambda: vectorized(processor, df))
+
+    mismatches = compare(expected, actual)
+    if mismatches:
+        print(f"❌ Расхождений с построчной реализацией: {mismatches}")
+        sys.exit(1)
+
+    print(f"✅ {len(df)} сессий: признаки, категории, sentiment и проблемы совпадают")
+    print(f"⏱️ построчно: {row_time:.2f}s  векторизованно: {vector_time:.2f}s  (x{row_time / vector_time:.1f})")
+
+
+if __name__ == '__main__':
+    main()
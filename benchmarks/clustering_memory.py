@@ -0,0 +1,145 @@
+"""Память и время кластеризации: пакетный (плотный KMeans), svd (хэширование + TruncatedSVD, float32)
+и потоковый (разреженный MiniBatchKMeans).
+
+Каждый замер запускается в отдельном процессе, пиковая память - ru_maxrss процесса.
+Синтетические сессии генерируются частями, как страницы результата BigQuery:
+потоковый режим никогда не держит весь набор, пакетный собирает его целиком
+и повторяет cluster_batch (TfidfVectorizer(max_features=1000) + hstack + KMeans на toarray()),
+svd - cluster_batch с CLUSTERING_FEATURES=svd (SvdSessionClusterer).
+
+Пакетный режим на больших объемах не поместится в память (строки x 1014 float64),
+поэтому выше --batch-max-rows для него печатается только оценка размера плотной матрицы.
+Для svd оценка - матрица, на которой работает KMeans (строки x 114 float32).
+
+Перед замерами проверяется потоковое обучение, когда строк меньше числа кластеров.
+
+Запуск: python benchmarks/clustering_memory.py [--rows 10000 100000 1000000] [--chunk-size 50000]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.sparse_clustering import StreamingSessionClusterer, SvdSessionClusterer
+
+VOCABULARY = [
+    'deposit', 'payment', 'balance', 'betting', 'stake', 'odds', 'game', 'stream', 'match', 'login',
+    'register', 'mobile', 'download', 'error', 'failed', 'timeout', 'confused', 'slow', 'loading',
+    'successful', 'completed', 'navigate', 'menu', 'opened', 'clicked', 'casino', 'bonus', 'profile',
+    'withdrawal', 'support', 'chat', 'promo', 'football', 'tennis', 'basketball', 'coupon', 'limit',
+] + [f'token{i}' for i in range(3000)]
+N_NUMERIC = 14
+
+
+def synthetic_chunks(rows, chunk_size, seed=42):
+    """Части (тексты, числовые признаки) с тем же seed - одинаковые данные на каждом проходе"""
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk_size):
+        size = min(chunk_size, rows - start)
+        texts = [' '.join(rng.choices(VOCABULARY, k=rng.randint(15, 40))) for _ in range(size)]
+        numeric = np_rng.integers(0, 2, size=(size, N_NUMERIC)).astype(float)
+        yield texts, numeric
+
+
+def run_batch(rows, chunk_size):
+    from scipy.sparse import hstack
+    from sklearn.cluster import KMeans
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.preprocessing import StandardScaler
+
+    texts, numeric = [], []
+    for chunk_texts, chunk_numeric in synthetic_chunks(rows, chunk_size):
+        texts.extend(chunk_texts)
+        numeric.append(chunk_numeric)
+    text_features = TfidfVectorizer(max_features=1000, min_df=1, max_df=0.8).fit_transform(texts)
+    numeric_features = StandardScaler().fit_transform(np.vstack(numeric))
+    combined_features = hstack([text_features, numeric_features])
+    n_clusters = min(8, rows // 2)
+    return KMeans(n_clusters=n_clusters, random_state=42, n_init=10).fit_predict(combined_features.toarray())
+
+
+def run_svd(rows, chunk_size):
+    texts, numeric = [], []
+    for chunk_texts, chunk_numeric in synthetic_chunks(rows, chunk_size):
+        texts.extend(chunk_texts)
+        numeric.append(chunk_numeric)
+    clusterer = SvdSessionClusterer(n_clusters=min(8, rows // 2))
+    features = clusterer.fit_features(texts, np.vstack(numeric))
+    del texts
+    return clusterer.fit_clusters(features)
+
+
+def run_streaming(rows, chunk_size):
+    clusterer = StreamingSessionClusterer(n_clusters=min(8, rows // 2))
+    for texts, numeric in synthetic_chunks(rows, chunk_size):
+        clusterer.observe(texts, numeric)
+    clusterer.finalize_statistics()
+    for texts, numeric in synthetic_chunks(rows, chunk_size):
+        clusterer.partial_fit(texts, numeric)
+    clusterer.finish_training()
+    labels = [clusterer.predict(texts, numeric) for texts, numeric in synthetic_chunks(rows, chunk_size)]
+    return np.concatenate(labels)
+
+
+def check_few_rows(rows=5, n_clusters=8, chunk_size=2):
+    """Строк (представителей после схлопывания дубликатов) меньше k: обучение по частям
+    не должно оставить MiniBatchKMeans необученным - k уменьшается до числа строк"""
+    clusterer = StreamingSessionClusterer(n_clusters=n_clusters)
+    for texts, numeric in synthetic_chunks(rows, chunk_size):
+        clusterer.observe(texts, numeric)
+    clusterer.finalize_statistics()
+    for texts, numeric in synthetic_chunks(rows, chunk_size):
+        clusterer.partial_fit(texts, numeric)
+    clusterer.finish_training()
+    labels = np.concatenate([clusterer.predict(texts, numeric) for texts, numeric in synthetic_chunks(rows, chunk_size)])
+    assert clusterer.n_clusters == rows and len(labels) == rows
+    print(f"✅ {rows} строк частями по {chunk_size} при k={n_clusters}: обучено с k={clusterer.n_clusters}")
+
+
+def measure(mode, rows, chunk_size):
+    """Запуск в текущем процессе; печатает JSON с временем и пиковой памятью"""
+    start = time.perf_counter()
+    labels = {'batch': run_batch, 'svd': run_svd, 'streaming': run_streaming}[mode](rows, chunk_size)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"seconds": round(elapsed, 1), "peak_mb": round(peak_mb), "clusters": int(len(set(labels)))}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--batch-max-rows', type=int, default=100000)
+    parser.add_argument('--single', choices=['batch', 'svd', 'streaming'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        measure(args.single, args.rows[0], args.chunk_size)
+        return
+
+    check_few_rows()
+    print(f"{'строк':>9} {'режим':<10} {'время, с':>9} {'пик, МБ':>9}")
+    for rows in args.rows:
+        for mode in ['batch', 'svd', 'streaming']:
+            if mode in ('batch', 'svd') and rows > args.batch_max_rows:
+                dense_mb = rows * (1000 + N_NUMERIC) * 8 / 1024 / 1024 if mode == 'batch' else rows * (100 + N_NUMERIC) * 4 / 1024 / 1024
+                print(f"{rows:>9} {mode:<10} {'-':>9} {'-':>9}  (пропущено: матрица для KMeans ~{dense_mb:,.0f} МБ)")
+                continue
+            output = subprocess.run(
+                [sys.executable, __file__, '--single', mode, '--rows', str(rows), '--chunk-size', str(args.chunk_size)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            stats = json.loads(output.strip().splitlines()[-1])
+            print(f"{rows:>9} {mode:<10} {stats['seconds']:>9} {stats['peak_mb']:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Проверка и микро-бенчмарк очистки OCR текста.
+
+1. Сверяет построчный и пакетный API scripts/text_cleaning с эталонным корпусом
+   (fixtures/ocr_cleaners_golden.json снят с прежней реализации clean_* / parse_userinfo_text).
+2. Замеряет время: построчные функции, пакетный API по Series (обертка над ними -
+   время должно совпадать) и проверка "технических" строк списком паттернов
+   vs одной скомпилированной альтернацией (здесь и есть ускорение).
+
+Запуск: python benchmarks/ocr_cleaners.py [--repeat 20]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts import text_cleaning as tc
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ocr_cleaners_golden.json')
+
+ROW_CLEANERS = {
+    'summary': tc.clean_summary,
+    'sentiment': tc.clean_sentiment,
+    'actions': tc.clean_actions,
+}
+
+# Прежний способ проверки строки: список паттернов + any(re.search(...))
+LEGACY_SUMMARY_PATTERNS = [
+    r'^[A-Za-z0-9]{6,20}$', r'^[0-9,.\s<an>]+$', r'^[0-9]+\.$',
+    r'Session Length', r'Device Type', r'Event Total', r'Amplitude AI',
+    r'ReplaySummary', r'Events \+\}', r'Powered by',
+    r'^[0-9]+[hms]\s*[0-9]*\s*(Android|iOS|Windows|Apple iPhone)$',
+    r'^[0-9]+\s+(Russia|France|Spain|Germany)', r'^\d+[hms]\s+\d+$',
+    r'^.*Russia.*<[an]$', r'^.*Android$', r'^.*Windows$', r'^.*Apple iPhone$',
+    r'^Summary\s*$', r'^[A-Z]{2,5}\s*$', r'^\d{1,3}$', r'^[*%+\}\s]+$',
+    r'^Recent\s*v\s*Favorites', r'^Q\s*Search',
+]
+
+
+def check_golden(corpus):
+    mismatches = 0
+    for field, cleaner in ROW_CLEANERS.items():
+        cases = corpus[field]
+        batch = tc.clean_series(pd.Series([c['input'] for c in cases], dtype=object), field)
+        for case, batch_value in zip(cases, batch):
+            if cleaner(case['input']) != case['expected'] or batch_value != case['expected']:
+                mismatches += 1
+        print(f"✅ {field}: {len(cases)} эталонов проверено")
+
+    cases = corpus['userinfo']
+    batch = tc.parse_userinfo_series(pd.Series([c['input'] for c in cases])).to_dict('records')
+    for case, batch_value in zip(cases, batch):
+        if tc.parse_userinfo_text(case['input']) != case['expected'] or batch_value != case['expected']:
+            mismatches += 1
+    print(f"✅ userinfo: {len(cases)} эталонов проверено")
+    return mismatches
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run_benchmark(corpus, repeat):
+    print(f"\n⏱️ Корпус x{repeat}")
+    for field, cleaner in ROW_CLEANERS.items():
+        inputs = [c['input'] for c in corpus[field]] * repeat
+        series = pd.Series(inputs, dtype=object)
+        row_time = timed(lambda: [cleaner(t) for t in inputs])
+        batch_time = timed(lambda: tc.clean_series(series, field))
+        print(f"  {field:<10} построчно: {row_time:.3f}s  пакетно: {batch_time:.3f}s  ({len(inputs)} текстов)")
+
+    inputs = [c['input'] for c in corpus['userinfo']] * repeat
+    row_time = timed(lambda: [tc.parse_userinfo_text(t) for t in inputs])
+    batch_time = timed(lambda: tc.parse_userinfo_series(pd.Series(inputs)))
+    print(f"  {'userinfo':<10} построчно: {row_time:.3f}s  пакетно: {batch_time:.3f}s  ({len(inputs)} текстов)")
+
+    lines = [line.strip() for c in corpus['summary'] if c['input'] for line in c['input'].split('\n') if line.strip()]
+    lines = lines * repeat
+    legacy_time = timed(lambda: [any(re.search(p, line, re.IGNORECASE) for p in LEGACY_SUMMARY_PATTERNS) for line in lines])
+    compiled_time = timed(lambda: [bool(tc.SUMMARY_TECHNICAL_RE.search(line)) for line in lines])
+    print(f"  технические строки summary: any(re.search) {legacy_time:.3f}s  альтернация {compiled_time:.3f}s  ({len(lines)} строк)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with open(GOLDEN_PATH, encoding='utf-8') as f:
+        corpus = json.load(f)
+
+    mismatches = check_golden(corpus)
+    if mismatches:
+        print(f"❌ Расхождений с эталоном: {mismatches}")
+        sys.exit(1)
+
+    run_benchmark(corpus, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
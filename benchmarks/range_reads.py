@@ -0,0 +1,90 @@
+"""Проверка RangeReader на локальном HTTP стенде с поддержкой Range.
+
+Собирает архив сессии (PNG скриншоты + "лишний" крупный файл), раздает его
+локальным HTTP сервером, открывает через RangeReader + zipfile и сверяет PNG
+с оригиналом. Печатает, сколько байт скачано по сравнению с полным архивом.
+
+Запуск: python benchmarks/range_reads.py [--extra-mb 20] [--block-kb 128]
+"""
+import argparse
+import io
+import os
+import re
+import sys
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.range_reader import RangeReader, http_content_length, http_range_fetcher
+
+
+def build_archive(extra_mb):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for name in ['session_userinfo.png', 'session_summary.png', 'session_sentiment.png', 'session_actions.png']:
+            archive.writestr(name, os.urandom(400 * 1024))
+        archive.writestr('metadata.json', b'{"session": "bench"}')
+        if extra_mb:
+            archive.writestr('recording.webm', os.urandom(extra_mb * 1024 * 1024))
+    return buffer.getvalue()
+
+
+def make_handler(payload):
+    class RangeHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(payload)))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+
+        def do_GET(self):
+            match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+            if not match:
+                self.send_response(200)
+                body = payload
+            else:
+                start, end = int(match.group(1)), int(match.group(2))
+                body = payload[start:end + 1]
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{start + len(body) - 1}/{len(payload)}')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return RangeHandler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--extra-mb', type=int, default=20)
+    parser.add_argument('--block-kb', type=int, default=128)
+    args = parser.parse_args()
+
+    payload = build_archive(args.extra_mb)
+    server = HTTPServer(('127.0.0.1', 0), make_handler(payload))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/session.zip'
+
+    try:
+        reader = RangeReader(http_range_fetcher(url), http_content_length(url), block_size=args.block_kb * 1024)
+        archive = zipfile.ZipFile(reader)
+        reference = zipfile.ZipFile(io.BytesIO(payload))
+        for name in archive.namelist():
+            if name.lower().endswith('.png'):
+                assert archive.read(name) == reference.read(name), f"PNG отличается: {name}"
+
+        stats = reader.stats()
+        ratio = stats['bytes_fetched'] / stats['size']
+        print(f"✅ PNG совпадают с оригиналом")
+        print(f"📦 Размер архива: {stats['size'] / 1024 / 1024:.1f} МБ")
+        print(f"⬇️ Скачано: {stats['bytes_fetched'] / 1024 / 1024:.2f} МБ ({ratio:.1%}) за {stats['range_requests']} Range запросов")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
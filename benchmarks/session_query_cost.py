@@ -0,0 +1,160 @@
+"""Стоимость запроса сессий Session Replay: прежний вариант против текущего
+(BigQueryReplayCollector.session_replay_query).
+
+Прежний запрос фильтрует по TIMESTAMP_TRUNC(event_time, DAY), сериализует event_properties
+каждого события через TO_JSON_STRING для LIKE и трех REGEXP_EXTRACT и сортирует результат.
+Текущий фильтрует прямо по event_time, берет ID одним JSON_VALUE, разбирает его после
+группировки и не сортирует.
+
+Для каждого варианта: dry run (байт к обработке), затем реальный запуск без кэша -
+обработано/оплачено байт, slot-ms, время, число сессий. В конце сверяются наборы
+session_replay_id обоих вариантов. Строка "инкремент" - текущий запрос по окну
+инкрементального сбора (последние --incremental-hours часов: сутки + перекрытие), столько
+стоит ежедневный запуск с отметкой. Нужны настоящие credentials BigQuery (как у collect_links).
+
+Запуск: python benchmarks/session_query_cost.py [--days 2] [--end-date YYYY-MM-DD] [--incremental-hours 30] [--dry-run-only]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from google.cloud import bigquery
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.collect_links import BigQueryReplayCollector, settings
+
+LEGACY_QUERY = r"""
+WITH session_data AS (
+    SELECT
+        amplitude_id,
+        REGEXP_EXTRACT(
+            TO_JSON_STRING(event_properties),
+            r'"\[Amplitude\] Session Replay ID":"([^"]+)"'
+        ) AS session_replay_id,
+        REGEXP_EXTRACT(
+            TO_JSON_STRING(event_properties),
+            r'"\[Amplitude\] Session Replay ID":"[^/]+/(\d+)"'
+        ) AS session_start_time_millis,
+        SAFE_CAST(REGEXP_EXTRACT(
+            TO_JSON_STRING(event_properties),
+            r'"\[Amplitude\] Session Replay ID":"[^/]+/\d+/(\d+)"'
+        ) AS INT64) AS session_duration_ms,
+        event_time
+    FROM {table}
+    WHERE
+        TIMESTAMP_TRUNC(event_time, DAY) >= TIMESTAMP("{start_date}")
+        AND TIMESTAMP_TRUNC(event_time, DAY) <= TIMESTAMP("{end_date}")
+        AND TO_JSON_STRING(event_properties) LIKE '%Session Replay ID%'
+),
+
+session_stats AS (
+    SELECT
+        amplitude_id,
+        session_replay_id,
+        session_start_time_millis,
+        session_duration_ms,
+        COALESCE(
+            session_duration_ms,
+            CAST((MAX(UNIX_MILLIS(event_time)) - MIN(UNIX_MILLIS(event_time))) AS INT64)
+        ) AS calculated_duration_ms,
+        COUNT(*) as events_count,
+        MIN(event_time) as first_event,
+        MAX(event_time) as last_event
+    FROM session_data
+    WHERE session_replay_id IS NOT NULL
+        AND session_replay_id != ''
+        AND session_start_time_millis IS NOT NULL
+    GROUP BY amplitude_id, session_replay_id, session_start_time_millis, session_duration_ms
+)
+
+SELECT
+    amplitude_id,
+    session_replay_id,
+    session_start_time_millis,
+    calculated_duration_ms,
+    ROUND(calculated_duration_ms / 1000.0, 1) as duration_seconds,
+    events_count,
+    first_event,
+    last_event,
+    DATE(first_event) as record_date
+FROM session_stats
+WHERE calculated_duration_ms >= {min_duration_ms}
+ORDER BY amplitude_id, calculated_duration_ms DESC
+"""
+
+
+def dry_run_bytes(client, query):
+    job = client.query(query, job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+    return job.total_bytes_processed or 0
+
+
+def execute(client, query):
+    start = time.perf_counter()
+    job = client.query(query, job_config=bigquery.QueryJobConfig(use_query_cache=False))
+    session_ids = {row.session_replay_id for row in job.result()}
+    return {
+        "seconds": round(time.perf_counter() - start, 1),
+        "bytes_processed": job.total_bytes_processed or 0,
+        "bytes_billed": job.total_bytes_billed or 0,
+        "slot_ms": job.slot_millis or 0,
+        "sessions": session_ids,
+    }
+
+
+def gib(value):
+    return f"{value / 1024 ** 3:,.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=settings.DAYS_BACK)
+    parser.add_argument('--end-date', default=None)
+    parser.add_argument('--min-duration', type=int, default=settings.MIN_DURATION_SECONDS)
+    parser.add_argument('--incremental-hours', type=float, default=30)
+    parser.add_argument('--dry-run-only', action='store_true')
+    args = parser.parse_args()
+
+    end_date = datetime.strptime(args.end_date, '%Y-%m-%d').date() if args.end_date else datetime.now().date()
+    start_date = end_date - timedelta(days=args.days)
+
+    collector = BigQueryReplayCollector(
+        credentials_path=settings.GOOGLE_APPLICATION_CREDENTIALS,
+        project_id=settings.BQ_PROJECT_ID,
+        dataset_id='amplitude',
+        table_id=settings.BQ_TABLE_EVENTS,
+        output_dataset_id=settings.BQ_DATASET_ID,
+    )
+    queries = {
+        'прежний': LEGACY_QUERY.format(table=collector.full_table_name, start_date=start_date,
+                                       end_date=end_date, min_duration_ms=args.min_duration * 1000),
+        'текущий': collector.session_replay_query(*collector.day_window(start_date, end_date), args.min_duration),
+    }
+    window_end = min(collector.day_window(end_date, end_date)[1], datetime.now(timezone.utc))
+    queries['инкремент'] = collector.session_replay_query(
+        window_end - timedelta(hours=args.incremental_hours), window_end, args.min_duration)
+
+    print(f"📅 Период: {start_date} - {end_date}, минимальная длительность {args.min_duration} сек")
+    print(f"{'запрос':<10} {'dry run, ГиБ':>13} {'обработано, ГиБ':>16} {'оплачено, ГиБ':>14} {'slot-ms':>12} {'время, с':>9} {'сессий':>8}")
+    results = {}
+    for name, query in queries.items():
+        estimate = dry_run_bytes(collector.client, query)
+        if args.dry_run_only:
+            print(f"{name:<10} {gib(estimate):>13}")
+            continue
+        stats = results[name] = execute(collector.client, query)
+        print(f"{name:<10} {gib(estimate):>13} {gib(stats['bytes_processed']):>16} {gib(stats['bytes_billed']):>14} "
+              f"{stats['slot_ms']:>12,} {stats['seconds']:>9} {len(stats['sessions']):>8}")
+
+    if 'прежний' in results:
+        before, after = results['прежний'], results['текущий']
+        if before['sessions'] == after['sessions']:
+            print("✅ Наборы session_replay_id совпадают")
+        else:
+            print(f"⚠️ Расхождение: только в прежнем {len(before['sessions'] - after['sessions'])}, "
+                  f"только в текущем {len(after['sessions'] - before['sessions'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Callable, Optional
+
+
+class ArchiveCache:
+    """Локальный дисковый кэш архивов сессий из Google Drive.
+
+    Ключ - id файла в Drive + modifiedTime, поэтому перезаписанный архив не будет
+    взят из кэша. Запись атомарная (временный файл + os.replace), объем ограничен
+    max_bytes, при переполнении удаляются архивы, к которым дольше всего не обращались (LRU по mtime).
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _version_tag(modified_time: str) -> str:
+        return hashlib.sha1(modified_time.encode('utf-8')).hexdigest()[:16]
+
+    def _path(self, file_id: str, modified_time: str) -> str:
+        return os.path.join(self.cache_dir, f"{file_id}.{self._version_tag(modified_time)}.zip")
+
+    def get_path(self, file_id: str, modified_time: str) -> Optional[str]:
+        """Путь к архиву в кэше или None; при попадании обновляет время доступа"""
+        path = self._path(file_id, modified_time)
+        with self._lock:
+            try:
+                os.utime(path, None)
+                size = os.path.getsize(path)
+            except OSError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bytes_saved += size
+            return path
+
+    def put(self, file_id: str, modified_time: str, write_to: Callable) -> str:
+        """Скачивает архив через write_to(file_handle) во временный файл и атомарно кладет в кэш"""
+        path = self._path(file_id, modified_time)
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{file_id}.", suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                write_to(fh)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        with self._lock:
+            self.bytes_downloaded += size
+            self._remove_stale_versions(file_id, path)
+            self._evict(keep=path)
+        return path
+
+    def _remove_stale_versions(self, file_id: str, current_path: str):
+        prefix = f"{file_id}."
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(prefix) and name.endswith('.zip') and path != current_path:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def _evict(self, keep: str):
+        """Удаляет самые давно использованные архивы, пока кэш не уложится в лимит"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.zip'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "archive_cache_hits": self.hits,
+            "archive_cache_misses": self.misses,
+            "archive_cache_hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "archive_cache_bytes_saved": self.bytes_saved,
+        }
@@ -0,0 +1,277 @@
+import copy
+import os
+import threading
+
+import pandas as pd
+from google.cloud import bigquery
+
+# С какого объема результата читать через BigQuery Storage Read API (Arrow, параллельные потоки);
+# меньшие результаты быстрее забрать через REST (tabledata.list) без открытия сессии чтения
+STORAGE_MIN_ROWS = int(os.environ.get('BQ_STORAGE_MIN_ROWS', '10000'))
+
+GB = 1024 ** 3
+
+# Раскладка таблиц конвейера (scripts/migrate_tables.py): партиции по дням record_date,
+# кластеризация сначала по колонке состояния, по которой выбирается работа этапа, затем по ID
+PARTITION_COLUMN = 'record_date'
+URL_TABLE_CLUSTERING = ['is_processed', 'session_replay_id']
+TEXT_TABLE_CLUSTERING = ['advanced_cluster', 'session_id']
+
+# Сколько дней назад этапы ищут работу в партиционированных таблицах (0 - вся таблица);
+# записи Session Replay старше срока хранения Amplitude все равно недоступны
+PIPELINE_LOOKBACK_DAYS = int(os.environ.get('PIPELINE_LOOKBACK_DAYS', '90'))
+
+
+class BudgetExceededError(RuntimeError):
+    """Запрос не помещается в бюджет байт этапа или дня"""
+
+
+def format_bytes(value) -> str:
+    if value is None:
+        return "?"
+    if value >= GB:
+        return f"{value / GB:.2f} ГБ"
+    return f"{value / 1024 ** 2:.1f} МБ"
+
+
+def make_storage_client(credentials=None):
+    """BigQueryReadClient, если установлен google-cloud-bigquery-storage; иначе None - чтение через REST"""
+    try:
+        from google.cloud import bigquery_storage
+    except ImportError:
+        return None
+    try:
+        return bigquery_storage.BigQueryReadClient(credentials=credentials)
+    except Exception as e:
+        print(f"⚠️ BigQuery Storage Read API недоступен, читаем через REST: {e}")
+        return None
+
+
+def _budget_bytes(*env_names) -> int:
+    """Бюджет в байтах из первой заданной переменной (значение в ГБ); 0 - без ограничения"""
+    for name in env_names:
+        value = os.environ.get(name)
+        if value:
+            return int(float(value) * GB)
+    return 0
+
+
+class BigQueryReader:
+    """Общий доступ к BigQuery для всех этапов: запуск запросов с оценкой стоимости и чтение результатов.
+
+    Каждый запрос сначала проверяется dry run: оценка байт пишется в лог и сверяется
+    с бюджетом этапа (BQ_STAGE_BUDGET_GB_<STAGE> или BQ_STAGE_BUDGET_GB, на один запуск)
+    и дня (BQ_DAILY_BUDGET_GB, с учетом уже оплаченного сегодня по INFORMATION_SCHEMA.JOBS_BY_USER).
+    Если запрос не помещается, выполняется более дешевый план (fallback), если он есть и помещается,
+    иначе - BudgetExceededError до запуска. Фактически оплаченные байты копятся в cost_report().
+    check_budget=False - без dry run и бюджетов (только учет байт): для дочерних процессов,
+    за которых бюджет проверяет основной процесс, получающий их cost_report() через add_cost().
+
+    Результаты забираются колоночно (Arrow -> DataFrame) без построчного копирования Row -> dict;
+    большие (>= storage_min_rows) - через Storage Read API, маленькие и без пакета
+    google-cloud-bigquery-storage - через REST.
+    """
+
+    def __init__(self, client, storage_client=None, storage_min_rows: int = STORAGE_MIN_ROWS,
+                 stage: str = 'default', log=print, check_budget: bool = True):
+        self.client = client
+        self.storage_client = storage_client
+        self.storage_min_rows = storage_min_rows
+        self.stage = stage
+        self.log = log
+        self.dry_run = check_budget and os.environ.get('BQ_DRY_RUN', 'true').lower() == 'true'
+        self.stage_budget_bytes = _budget_bytes(f"BQ_STAGE_BUDGET_GB_{stage.upper()}", 'BQ_STAGE_BUDGET_GB') if check_budget else 0
+        self.daily_budget_bytes = _budget_bytes('BQ_DAILY_BUDGET_GB') if check_budget else 0
+        self.location = os.environ.get('BQ_LOCATION', 'US')
+        self.bytes_billed = 0
+        self.bytes_processed = 0
+        self.queries = 0
+        self._billed_before_today = None
+        self._tables = {}
+        self._lock = threading.Lock()
+        # Ленивые запросы метаданных (расход за день, tables.get) - один раз на reader, даже из нескольких потоков
+        self._metadata_lock = threading.Lock()
+
+    # --- Стоимость и бюджеты ---
+
+    def estimate_bytes(self, sql: str, job_config=None):
+        """Оценка байт к обработке (dry run, бесплатно); None, если оценить не удалось"""
+        config = copy.deepcopy(job_config) if job_config else bigquery.QueryJobConfig()
+        config.dry_run = True
+        config.use_query_cache = False
+        try:
+            return self.client.query(sql, job_config=config).total_bytes_processed or 0
+        except Exception as e:
+            self.log(f"⚠️ Не удалось оценить стоимость запроса: {e}")
+            return None
+
+    def _billed_today(self) -> int:
+        """Оплачено сегодня всеми запросами пользователя (один запрос к INFORMATION_SCHEMA за запуск;
+        потоки бэкфилла с общим reader ждут его под блокировкой, а не запускают свой)"""
+        with self._metadata_lock:
+            if self._billed_before_today is None:
+                query = f"""
+                SELECT COALESCE(SUM(total_bytes_billed), 0) AS billed
+                FROM `region-{self.location.lower()}`.INFORMATION_SCHEMA.JOBS_BY_USER
+                WHERE creation_time >= TIMESTAMP_TRUNC(CURRENT_TIMESTAMP(), DAY)
+                    AND job_type = 'QUERY' AND statement_type != 'SCRIPT'
+                """
+                try:
+                    self._billed_before_today = next(iter(self.client.query(query).result())).billed
+                except Exception as e:
+                    self.log(f"⚠️ Не удалось получить расход за день, считаем от нуля: {e}")
+                    self._billed_before_today = 0
+        with self._lock:
+            return self._billed_before_today + self.bytes_billed
+
+    def remaining_budget_bytes(self):
+        """Остаток самого строгого из бюджетов (этапа, дня); None - без ограничений"""
+        remaining = []
+        if self.stage_budget_bytes:
+            remaining.append(self.stage_budget_bytes - self.bytes_billed)
+        if self.daily_budget_bytes:
+            remaining.append(self.daily_budget_bytes - self._billed_today())
+        return min(remaining) if remaining else None
+
+    def budget_violation(self, estimate):
+        """Причина, по которой запрос с оценкой estimate не помещается в бюджет, или None"""
+        if not estimate:
+            return None
+        if self.stage_budget_bytes and self.bytes_billed + estimate > self.stage_budget_bytes:
+            return (f"бюджет этапа {self.stage}: {format_bytes(self.bytes_billed)} уже + {format_bytes(estimate)} "
+                    f"> {format_bytes(self.stage_budget_bytes)}")
+        if self.daily_budget_bytes and self._billed_today() + estimate > self.daily_budget_bytes:
+            return (f"дневной бюджет: {format_bytes(self._billed_today())} уже + {format_bytes(estimate)} "
+                    f"> {format_bytes(self.daily_budget_bytes)}")
+        return None
+
+    def fits_budget(self, sql: str, job_config=None) -> bool:
+        return self.budget_violation(self.estimate_bytes(sql, job_config) if self.dry_run else None) is None
+
+    def _check(self, sql, job_config, description):
+        if not self.dry_run:
+            return
+        estimate = self.estimate_bytes(sql, job_config)
+        self.log(f"💰 {description}: оценка {format_bytes(estimate)}")
+        violation = self.budget_violation(estimate)
+        if violation:
+            raise BudgetExceededError(f"{description}: {violation}")
+
+    def _account(self, job):
+        with self._lock:
+            self.queries += 1
+            self.bytes_billed += job.total_bytes_billed or 0
+            self.bytes_processed += job.total_bytes_processed or 0
+
+    def add_cost(self, report: dict):
+        """Учет запросов, выполненных отдельным процессом со своим BigQueryReader (его cost_report())"""
+        with self._lock:
+            self.bytes_billed += report.get('bytes_billed', 0)
+            self.bytes_processed += report.get('bytes_processed', 0)
+            self.queries += report.get('bigquery_queries', 0)
+
+    def cost_report(self) -> dict:
+        return {"bytes_billed": self.bytes_billed, "bytes_processed": self.bytes_processed,
+                "bigquery_queries": self.queries}
+
+    # --- Раскладка таблиц ---
+
+    def _table(self, table_id):
+        """Метаданные таблицы (tables.get, без запроса; кэшируются) или None, если недоступны"""
+        with self._metadata_lock:
+            if table_id not in self._tables:
+                try:
+                    self._tables[table_id] = self.client.get_table(table_id.strip('`'))
+                except Exception:
+                    self._tables[table_id] = None
+            return self._tables[table_id]
+
+    def partition_field(self, table_id):
+        """Колонка партиционирования таблицы или None"""
+        partitioning = getattr(self._table(table_id), 'time_partitioning', None)
+        return partitioning.field if partitioning else None
+
+    def has_column(self, table_id, column) -> bool:
+        """Есть ли колонка в схеме таблицы (например, добавленная позже другим этапом)"""
+        table = self._table(table_id)
+        return table is not None and any(field.name == column for field in table.schema)
+
+    def recent_partitions(self, table_id, alias='', days=PIPELINE_LOOKBACK_DAYS) -> str:
+        """' AND <alias.>record_date >= ...' за последние days дней, если таблица партиционирована
+        по record_date; иначе '' - запрос остается прежним (таблица еще не мигрирована)"""
+        if days <= 0 or self.partition_field(table_id) != PARTITION_COLUMN:
+            return ""
+        column = f"{alias}.{PARTITION_COLUMN}" if alias else PARTITION_COLUMN
+        return f" AND {column} >= DATE_SUB(CURRENT_DATE(), INTERVAL {int(days)} DAY)"
+
+    # --- Запуск запросов ---
+
+    def query(self, sql: str, job_config=None, page_size=None, description: str = 'Запрос', fallback=None):
+        """Запуск запроса с проверкой бюджета: (job, rows). rows.total_rows известен без загрузки данных.
+
+        fallback - (sql, job_config, description) более дешевого плана на случай превышения бюджета.
+        """
+        try:
+            self._check(sql, job_config, description)
+        except BudgetExceededError as e:
+            if fallback is None:
+                raise
+            self.log(f"⬇️ {e} - переходим на более дешевый план")
+            fallback_sql, fallback_config, fallback_description = fallback
+            return self.query(fallback_sql, fallback_config, page_size, fallback_description)
+        job = self.client.query(sql, job_config=job_config)
+        rows = job.result(page_size=page_size)
+        self._account(job)
+        return job, rows
+
+    def run(self, sql: str, job_config=None, description: str = 'Запрос'):
+        """Запуск запроса/DML/скрипта до завершения; возвращает job (num_dml_affected_rows и т.п.)"""
+        return self.query(sql, job_config, description=description)[0]
+
+    # --- Чтение результатов ---
+
+    def _storage_for(self, rows, total_rows=None):
+        total_rows = rows.total_rows if total_rows is None else total_rows
+        if self.storage_client is None or (total_rows or 0) < self.storage_min_rows:
+            return None
+        return self.storage_client
+
+    def uses_storage(self, rows) -> bool:
+        return self._storage_for(rows) is not None
+
+    def to_dataframe(self, rows) -> pd.DataFrame:
+        return rows.to_dataframe(bqstorage_client=self._storage_for(rows), create_bqstorage_client=False)
+
+    def query_dataframe(self, sql: str, job_config=None, description: str = 'Запрос') -> pd.DataFrame:
+        _, rows = self.query(sql, job_config=job_config, description=description)
+        return self.to_dataframe(rows)
+
+    def query_records(self, sql: str, job_config=None, description: str = 'Запрос') -> list:
+        """Результат списком dict (для поштучной обработки сессий/URL): колоночное чтение,
+        NULL -> None, как у dict(Row)"""
+        df = self.query_dataframe(sql, job_config=job_config, description=description)
+        return df.astype(object).where(df.notna(), None).to_dict('records')
+
+    def iter_dataframes(self, table, selected_fields=None, chunk_rows: int = 50000):
+        """Постраничное чтение таблицы (например, job.destination) частями ~chunk_rows строк.
+
+        Storage Read API отдает батчи своего размера, поэтому мелкие батчи склеиваются
+        до chunk_rows - потребителю (partial_fit, разметка) приходят части предсказуемого размера.
+        Чтение готовой таблицы не тарифицируется как запрос. У итератора по TableReference
+        (job.destination) total_rows неизвестен до первой страницы, поэтому число строк для выбора
+        Storage Read API / REST берется из метаданных таблицы.
+        """
+        if getattr(table, 'num_rows', None) is None:
+            table = self.client.get_table(table)
+        rows = self.client.list_rows(table, selected_fields=selected_fields, page_size=chunk_rows)
+        pending, pending_rows = [], 0
+        for frame in rows.to_dataframe_iterable(bqstorage_client=self._storage_for(rows, table.num_rows)):
+            if frame.empty:
+                continue
+            pending.append(frame)
+            pending_rows += len(frame)
+            if pending_rows >= chunk_rows:
+                yield pd.concat(pending, ignore_index=True)
+                pending, pending_rows = [], 0
+        if pending:
+            yield pd.concat(pending, ignore_index=True)
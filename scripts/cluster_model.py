@@ -0,0 +1,131 @@
+import os
+import pickle
+import tempfile
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from scripts.sparse_clustering import nearest_centroid
+
+MODEL_FILENAME = 'model.pkl'
+LATEST_FILENAME = 'LATEST'
+
+
+class ClusterModel:
+    """Версия модели кластеризации: обученный кластеризатор + описания кластеров.
+
+    clusterer - TfidfSessionClusterer, SvdSessionClusterer или StreamingSessionClusterer (transform + kmeans),
+    либо PartitionedSessionClusterer (свой кластеризатор на каждую партицию).
+    baseline_distance - среднее расстояние строки до ближайшего центра на момент обучения,
+    с ним сравниваются новые строки при проверке дрейфа.
+    """
+
+    def __init__(self, clusterer, descriptions: dict, trained_rows: int,
+                 baseline_distance: float = 0.0, version: Optional[str] = None):
+        self.clusterer = clusterer
+        self.descriptions = descriptions
+        self.trained_rows = trained_rows
+        self.baseline_distance = baseline_distance
+        self.version = version
+
+    @property
+    def partition_column(self) -> Optional[str]:
+        """Колонка партиций для двухуровневой модели (PartitionedSessionClusterer), иначе None"""
+        return getattr(self.clusterer, 'partition_column', None)
+
+    def assign(self, texts, numeric, partitions=None):
+        """Номера кластеров и расстояния до ближайшего центра (одно матричное умножение)"""
+        if self.partition_column:
+            return self.clusterer.assign(texts, numeric, partitions)
+        return nearest_centroid(self.clusterer.transform(texts, numeric), self.clusterer.kmeans.cluster_centers_)
+
+    def describe(self, labels):
+        return np.array([self.descriptions.get(int(label), "Неизвестно") for label in labels], dtype=object)
+
+    def drift_ratio(self, mean_distance: float) -> float:
+        """Во сколько раз новые строки дальше от центров, чем обучающие"""
+        if not self.baseline_distance:
+            return 0.0
+        return mean_distance / self.baseline_distance
+
+
+class ClusterModelStore:
+    """Версии модели в локальном каталоге или в Cloud Storage (gs://bucket/prefix).
+
+    Каждая версия - <location>/<version>/model.pkl, файл LATEST хранит текущую версию
+    и переписывается только после успешной записи самой модели.
+    """
+
+    def __init__(self, location: str, credentials_path: Optional[str] = None):
+        self.location = location.rstrip('/')
+        self.credentials_path = credentials_path
+        self._bucket = None
+        self._prefix = ''
+        if self.location.startswith('gs://'):
+            bucket_name, _, self._prefix = self.location[len('gs://'):].partition('/')
+            self._bucket = self._gcs_bucket(bucket_name)
+        else:
+            os.makedirs(self.location, exist_ok=True)
+
+    def _gcs_bucket(self, bucket_name):
+        try:
+            from google.cloud import storage
+        except ImportError:
+            raise ImportError("Для хранения модели в gs:// нужен пакет google-cloud-storage")
+        from google.oauth2 import service_account
+
+        client_kwargs = {}
+        if self.credentials_path and os.path.exists(self.credentials_path):
+            client_kwargs['credentials'] = service_account.Credentials.from_service_account_file(
+                self.credentials_path,
+                scopes=["https://www.googleapis.com/auth/devstorage.read_write"]
+            )
+            client_kwargs['project'] = client_kwargs['credentials'].project_id
+        return storage.Client(**client_kwargs).bucket(bucket_name)
+
+    def _read(self, name: str) -> Optional[bytes]:
+        if self._bucket is not None:
+            blob = self._bucket.blob(f"{self._prefix}/{name}" if self._prefix else name)
+            return blob.download_as_bytes() if blob.exists() else None
+        path = os.path.join(self.location, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _write(self, name: str, data: bytes):
+        if self._bucket is not None:
+            self._bucket.blob(f"{self._prefix}/{name}" if self._prefix else name).upload_from_string(data)
+            return
+        path = os.path.join(self.location, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def latest_version(self) -> Optional[str]:
+        data = self._read(LATEST_FILENAME)
+        return data.decode('utf-8').strip() if data else None
+
+    def save(self, model: ClusterModel) -> str:
+        model.version = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self._write(f"{model.version}/{MODEL_FILENAME}", pickle.dumps(model))
+        self._write(LATEST_FILENAME, model.version.encode('utf-8'))
+        return model.version
+
+    def load(self, version: Optional[str] = None) -> Optional[ClusterModel]:
+        """Загружает указанную или последнюю версию; None, если модели еще нет"""
+        version = version or self.latest_version()
+        if not version:
+            return None
+        data = self._read(f"{version}/{MODEL_FILENAME}")
+        if data is None:
+            raise FileNotFoundError(f"Версия модели {version} не найдена в {self.location}")
+        return pickle.loads(data)
@@ -1,8 +1,5 @@
 import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
 from collections import Counter
 import nltk
 import re
@@ -27,6 +24,85 @@ except ImportError:
         BQ_CLUSTERING_TABLE = os.environ.get('BQ_CLUSTERING_TABLE', 'replay_text_complete')
     settings = MockSettings()
 
+from scripts.bq_io import PARTITION_COLUMN, BigQueryReader, make_storage_client
+from scripts.cluster_model import ClusterModel, ClusterModelStore
+from scripts.k_selection import stratified_sample_positions, sweep_k
+from scripts.near_duplicates import NearDuplicateGrouper
+from scripts.sparse_clustering import (
+    PartitionedSessionClusterer, StreamingSessionClusterer, SvdSessionClusterer, TfidfSessionClusterer,
+)
+
+# Ключевые слова признаков (подстроки в объединенном тексте summary + actions + sentiment)
+FEATURE_KEYWORDS = {
+    # Функциональные признаки
+    'navigation': ['main page', 'navigate', 'opened', 'clicked', 'menu', 'link'],
+    'payment': ['deposit', 'payment', 'cash', 'money', 'balance', 'refill', 'pay'],
+    'betting': ['bet', 'betting', 'stake', 'wager', 'place', 'odds'],
+    'gaming': ['game', 'gaming', 'stream', 'live', 'match', 'sport'],
+    'auth': ['login', 'register', 'authorization', 'auth', 'sign'],
+    'mobile': ['mobile', 'app', 'download', 'apk', 'application'],
+    # Проблемные признаки
+    'tech_error': ['error', 'fail', 'invalid', 'refused', 'not working', 'timeout'],
+    'ux_issue': ['confused', 'unclear', 'difficult', 'complicated', 'lost'],
+    'performance': ['slow', 'loading', 'lag', 'freeze', 'stuck'],
+    'successful': ['successful', 'completed', 'finished', 'achieved'],
+}
+
+# Признаки проблемы (подстроки в summary + actions)
+PROBLEM_INDICATORS = [
+    'error', 'fail', 'invalid', 'refused', 'not working', 'timeout',
+    'unable', 'cannot', 'problem', 'issue', 'difficulty'
+]
+NEGATIVE_ACTIONS = ['did not', 'failed to', 'unsuccessful', 'incomplete']
+
+# Источник проблемы: первая совпавшая группа по порядку
+PROBLEM_SOURCE_KEYWORDS = [
+    ('депозит', ['deposit', 'payment', 'cash', 'money', 'balance', 'refill']),
+    ('мобильное приложение', ['mobile', 'app', 'download', 'apk']),
+    ('ставки', ['bet', 'betting', 'stake', 'wager']),
+    ('регистрация/логин', ['login', 'register', 'auth', 'sign']),
+    ('игра', ['game', 'gaming', 'stream']),
+    ('навигация', ['navigation', 'menu', 'page']),
+]
+
+
+def _keyword_regex(words):
+    """Одна регулярка на группу подстрок: эквивалент any(word in text for word in words)"""
+    return re.compile('|'.join(re.escape(w) for w in words))
+
+
+FEATURE_REGEXES = {name: _keyword_regex(words) for name, words in FEATURE_KEYWORDS.items()}
+PROBLEM_INDICATORS_RE = _keyword_regex(PROBLEM_INDICATORS)
+NEGATIVE_ACTIONS_RE = _keyword_regex(NEGATIVE_ACTIONS)
+PROBLEM_SOURCE_REGEXES = [(source, _keyword_regex(words)) for source, words in PROBLEM_SOURCE_KEYWORDS]
+KEYWORD_FEATURES = list(FEATURE_KEYWORDS)
+NUMERIC_FEATURES = ['event_count', 'long_session', 'medium_session', 'short_session']
+
+# Колонки, которые читаются для признаков (вместо SELECT *); record_date - для ограничения MERGE по партициям
+CLUSTER_INPUT_COLUMNS = ['session_id', 'summary', 'sentiment', 'actions', 'session_length', 'event_total', 'sentiment_label',
+                         'record_date']
+
+# Результаты кластеризации, которые записываются обратно в таблицу (одним MERGE по session_id)
+CLUSTER_RESULT_SCHEMA = [
+    bigquery.SchemaField('session_id', 'STRING', mode='REQUIRED'),
+    bigquery.SchemaField('advanced_cluster', 'INT64'),
+    bigquery.SchemaField('cluster_description', 'STRING'),
+    bigquery.SchemaField('smart_category', 'STRING'),
+    bigquery.SchemaField('has_problem', 'INT64'),
+    bigquery.SchemaField('problem_source', 'STRING'),
+    bigquery.SchemaField('sentiment_label', 'STRING'),
+]
+CLUSTER_RESULT_COLUMNS = [field.name for field in CLUSTER_RESULT_SCHEMA]
+CLUSTER_RESULT_INT_COLUMNS = ['advanced_cluster', 'has_problem']
+
+
+def _safe_event_count(value):
+    try:
+        return min(int(value) / 20.0, 1.0)
+    except:
+        return 0
+
+
 class ClusteringAnalysisProcessor:
     def __init__(self, status_callback: Optional[Callable[[str, int], None]] = None):
         self.status_callback = status_callback
@@ -34,6 +110,53 @@ class ClusteringAnalysisProcessor:
         self.bq_project_id = settings.BQ_PROJECT_ID
         self.bq_dataset_id = settings.BQ_DATASET_ID
         self.bq_table = settings.BQ_CLUSTERING_TABLE
+
+        # Режим кластеризации: batch - все строки в памяти (плотный KMeans),
+        # streaming - разреженный MiniBatchKMeans по частям, auto - streaming на больших объемах
+        self.clustering_mode = os.environ.get('CLUSTERING_MODE', 'auto').lower()
+        self.streaming_min_rows = int(os.environ.get('CLUSTERING_STREAMING_MIN_ROWS', '50000'))
+        self.chunk_size = max(int(os.environ.get('CLUSTERING_CHUNK_SIZE', '50000')), 100)
+        self.hash_features = int(os.environ.get('CLUSTERING_HASH_FEATURES', str(2 ** 14)))
+        # Признаки пакетного режима: tfidf - словарь TF-IDF (~1000 измерений),
+        # svd - хэширование + TF-IDF + TruncatedSVD до CLUSTERING_SVD_COMPONENTS измерений (float32)
+        self.feature_pipeline = os.environ.get('CLUSTERING_FEATURES', 'tfidf').lower()
+        self.svd_components = int(os.environ.get('CLUSTERING_SVD_COMPONENTS', '100'))
+
+        # Сохраненная модель: ежедневный запуск только размечает новые строки,
+        # переобучение (refit) - отдельная команда или автоматически при дрейфе
+        # Модель хранится в постоянном месте (gs://bucket/prefix): локальный диск сервиса
+        # очищается при перезапуске, и без модели каждый запуск заново переразмечал бы всю таблицу
+        self.model_location = os.environ.get('CLUSTERING_MODEL_LOCATION', '')
+        self.environment = os.environ.get('ENVIRONMENT', 'development').lower()
+        self.model_version = os.environ.get('CLUSTERING_MODEL_VERSION', '') or None
+        self.drift_threshold = float(os.environ.get('CLUSTERING_DRIFT_THRESHOLD', '1.3'))
+        self.auto_refit = os.environ.get('CLUSTERING_AUTO_REFIT', 'false').lower() == 'true'
+        self.refit_sample_rows = int(os.environ.get('CLUSTERING_REFIT_SAMPLE_ROWS', '100000'))
+
+        # Подбор k при обучении: перебор на стратифицированной выборке фиксированного размера,
+        # поэтому стоимость не зависит от объема данных; иначе k = min(8, строк // 2)
+        self.k_sweep = os.environ.get('CLUSTERING_K_SWEEP', 'false').lower() == 'true'
+        self.k_min = int(os.environ.get('CLUSTERING_K_MIN', '2'))
+        self.k_max = int(os.environ.get('CLUSTERING_K_MAX', '12'))
+        self.k_sample_rows = int(os.environ.get('CLUSTERING_K_SAMPLE_ROWS', '5000'))
+        self.k_metric = os.environ.get('CLUSTERING_K_METRIC', 'silhouette')  # silhouette / davies_bouldin
+        self.k_jobs = int(os.environ.get('CLUSTERING_K_JOBS', '-1'))
+        self.k_sweep_report = []
+
+        # Схлопывание почти одинаковых текстов (MinHash LSH) после clean_text: кластеризуется
+        # один представитель группы с весом = размер группы, метка раздается всем членам
+        self.dedup_enabled = os.environ.get('CLUSTERING_DEDUP', 'false').lower() == 'true'
+        self.dedup_threshold = float(os.environ.get('CLUSTERING_DEDUP_THRESHOLD', '0.8'))
+        self.dedup_rows = 0
+        self.dedup_groups = 0
+
+        # Двухуровневый режим (пакетное обучение): строки делятся по smart_category или
+        # problem_source, каждая партиция обучается в своем процессе; '' - один общий KMeans
+        self.partition_by = os.environ.get('CLUSTERING_PARTITION_BY', '')
+        self.partition_k = int(os.environ.get('CLUSTERING_PARTITION_K', '4'))
+        self.partition_min_rows = int(os.environ.get('CLUSTERING_PARTITION_MIN_ROWS', '50'))
+        self.partition_workers = int(os.environ.get('CLUSTERING_PARTITION_WORKERS', '0')) or None
+        self.partition_report = {}
         
         # NLTK data path для Render
         nltk_data_path = os.environ.get('NLTK_DATA', '/opt/render/project/src/nltk_data')
@@ -45,6 +168,7 @@ class ClusteringAnalysisProcessor:
         self.total_processed = 0
         self.total_successful = 0
         self.total_failed = 0
+        self.failed_sessions = []
         
         self._update_status("🔐 Настраиваем подключения...", 1)
         self._init_clients()
@@ -66,6 +190,8 @@ class ClusteringAnalysisProcessor:
                 scopes=["https://www.googleapis.com/auth/bigquery"]
             )
             self.bq_client = bigquery.Client(credentials=credentials, project=self.bq_project_id)
+            self.bq_reader = BigQueryReader(self.bq_client, make_storage_client(credentials), stage='clustering',
+                                            log=lambda message: self._update_status(message, -1))
             self._update_status("✅ BigQuery подключен", 5)
         except Exception as e:
             raise Exception(f"❌ Ошибка подключения к BigQuery: {e}")
@@ -99,24 +225,76 @@ class ClusteringAnalysisProcessor:
                 'click', 'entered', 'selected', 'form', 'page'
             ])
 
-    def get_rows_without_clusters(self):
-        """Загрузить строки из BigQuery, где кластеры пустые"""
+    def query_rows_without_clusters(self):
+        """Запрос строк без кластеров; результат остается во временной таблице BigQuery.
+
+        Возвращает (job, rows): rows.total_rows известен без загрузки данных,
+        а job.destination можно читать постранично несколько раз (потоковый режим).
+        """
         table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_table}"
         query = f"""
-        SELECT * FROM `{table_id}`
-        WHERE advanced_cluster IS NULL OR cluster_description IS NULL
+        SELECT {', '.join(CLUSTER_INPUT_COLUMNS)} FROM `{table_id}`
+        WHERE (advanced_cluster IS NULL OR cluster_description IS NULL){self.bq_reader.recent_partitions(table_id)}
         """
-        
+
         self._update_status("🔍 Получаем строки без кластеров из BigQuery...", 10)
-        
+
+        try:
+            job, rows = self.bq_reader.query(query, page_size=self.chunk_size, description="Строки без кластеров")
+            self._update_status(f"📊 Найдено строк без кластеров: {rows.total_rows}", 15)
+            return job, rows
+        except Exception as e:
+            self._update_status(f"❌ Ошибка загрузки данных: {e}", -1)
+            raise
+
+    def get_rows_without_clusters(self):
+        """Загрузить строки из BigQuery, где кластеры пустые"""
+        _, rows = self.query_rows_without_clusters()
         try:
-            df = self.bq_client.query(query).to_dataframe()
-            self._update_status(f"📊 Загружено строк без кластеров: {len(df)}", 15)
-            return df
+            return self.bq_reader.to_dataframe(rows)
         except Exception as e:
             self._update_status(f"❌ Ошибка загрузки данных: {e}", -1)
             raise
 
+    def iter_row_chunks(self, job):
+        """Постраничное чтение результата запроса: в памяти одна часть (~chunk_size строк)"""
+        yield from self.bq_reader.iter_dataframes(job.destination, chunk_rows=self.chunk_size)
+
+    def query_sample_rows(self):
+        """Случайная выборка (~refit_sample_rows строк) из всей таблицы для переобучения"""
+        table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_table}"
+        total_rows = self.bq_client.get_table(table_id).num_rows or 0
+        fraction = min(1.0, self.refit_sample_rows / total_rows) if total_rows else 1.0
+        query = f"""
+        SELECT {', '.join(CLUSTER_INPUT_COLUMNS)} FROM `{table_id}`
+        WHERE RAND() < {fraction:.6f}
+        """
+        # Дешевый план: TABLESAMPLE читает (и оплачивает) только выбранные блоки таблицы,
+        # ценой менее равномерной выборки
+        block_sample_query = f"""
+        SELECT {', '.join(CLUSTER_INPUT_COLUMNS)}
+        FROM `{table_id}` TABLESAMPLE SYSTEM ({max(fraction * 100, 0.001):.3f} PERCENT)
+        """
+        self._update_status(f"🎲 Выборка для обучения: ~{min(total_rows, self.refit_sample_rows)} из {total_rows} строк", 10)
+        return self.bq_reader.query(query, page_size=self.chunk_size, description="Выборка для обучения",
+                                    fallback=(block_sample_query, None, "Блочная выборка (TABLESAMPLE)"))
+
+    def query_all_rows(self):
+        """Все строки таблицы (колонки для признаков) - для массовой переразметки"""
+        table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_table}"
+        query = f"""
+        SELECT {', '.join(CLUSTER_INPUT_COLUMNS)}
+        FROM `{table_id}`
+        """
+        return self.bq_reader.query(query, page_size=self.chunk_size, description="Все строки для переразметки")
+
+    def use_streaming(self, total_rows):
+        if self.clustering_mode == 'streaming':
+            return True
+        if self.clustering_mode == 'batch':
+            return False
+        return total_rows >= self.streaming_min_rows
+
     def extract_features_advanced(self, row):
         """Извлечение продвинутых признаков из данных сессии"""
         summary = str(row.get('summary', '')).lower()
@@ -124,48 +302,10 @@ class ClusteringAnalysisProcessor:
         sentiment = str(row.get('sentiment', '')).lower()
         combined_text = f"{summary} {actions} {sentiment}"
         
-        features = {}
-        
-        # Функциональные признаки
-        features['navigation'] = int(any(word in combined_text for word in [
-            'main page', 'navigate', 'opened', 'clicked', 'menu', 'link'
-        ]))
-        features['payment'] = int(any(word in combined_text for word in [
-            'deposit', 'payment', 'cash', 'money', 'balance', 'refill', 'pay'
-        ]))
-        features['betting'] = int(any(word in combined_text for word in [
-            'bet', 'betting', 'stake', 'wager', 'place', 'odds'
-        ]))
-        features['gaming'] = int(any(word in combined_text for word in [
-            'game', 'gaming', 'stream', 'live', 'match', 'sport'
-        ]))
-        features['auth'] = int(any(word in combined_text for word in [
-            'login', 'register', 'authorization', 'auth', 'sign'
-        ]))
-        features['mobile'] = int(any(word in combined_text for word in [
-            'mobile', 'app', 'download', 'apk', 'application'
-        ]))
-        
-        # Проблемные признаки
-        features['tech_error'] = int(any(word in combined_text for word in [
-            'error', 'fail', 'invalid', 'refused', 'not working', 'timeout'
-        ]))
-        features['ux_issue'] = int(any(word in combined_text for word in [
-            'confused', 'unclear', 'difficult', 'complicated', 'lost'
-        ]))
-        features['performance'] = int(any(word in combined_text for word in [
-            'slow', 'loading', 'lag', 'freeze', 'stuck'
-        ]))
-        features['successful'] = int(any(word in combined_text for word in [
-            'successful', 'completed', 'finished', 'achieved'
-        ]))
+        features = {name: int(bool(regex.search(combined_text))) for name, regex in FEATURE_REGEXES.items()}
         
         # Количественные признаки
-        event_total = row.get('event_total', 0)
-        try:
-            features['event_count'] = min(int(event_total) / 20.0, 1.0)
-        except:
-            features['event_count'] = 0
+        features['event_count'] = _safe_event_count(row.get('event_total', 0))
         
         # Длительность сессии
         session_length = str(row.get('session_length', '')).lower()
@@ -236,19 +376,13 @@ class ClusteringAnalysisProcessor:
         if row['sentiment_label'] == 'negative':
             return 1
         
-        combined_text = str(row['summary']) + ' ' + str(row['actions'])
-        problem_indicators = [
-            'error', 'fail', 'invalid', 'refused', 'not working', 'timeout',
-            'unable', 'cannot', 'problem', 'issue', 'difficulty'
-        ]
+        combined_text = (str(row['summary']) + ' ' + str(row['actions'])).lower()
         
-        if any(indicator in combined_text.lower() for indicator in problem_indicators):
+        if PROBLEM_INDICATORS_RE.search(combined_text):
             return 1
         
-        if row['sentiment_label'] == 'neutral':
-            negative_actions = ['did not', 'failed to', 'unsuccessful', 'incomplete']
-            if any(action in combined_text.lower() for action in negative_actions):
-                return 1
+        if row['sentiment_label'] == 'neutral' and NEGATIVE_ACTIONS_RE.search(combined_text):
+            return 1
         
         return 0
 
@@ -256,20 +390,148 @@ class ClusteringAnalysisProcessor:
         """Определение источника проблемы"""
         combined_text = (str(row['summary']) + ' ' + str(row['actions'])).lower()
         
-        if any(w in combined_text for w in ['deposit', 'payment', 'cash', 'money', 'balance', 'refill']):
-            return 'депозит'
-        elif any(w in combined_text for w in ['mobile', 'app', 'download', 'apk']):
-            return 'мобильное приложение'
-        elif any(w in combined_text for w in ['bet', 'betting', 'stake', 'wager']):
-            return 'ставки'
-        elif any(w in combined_text for w in ['login', 'register', 'auth', 'sign']):
-            return 'регистрация/логин'
-        elif any(w in combined_text for w in ['game', 'gaming', 'stream']):
-            return 'игра'
-        elif any(w in combined_text for w in ['navigation', 'menu', 'page']):
-            return 'навигация'
+        for source, regex in PROBLEM_SOURCE_REGEXES:
+            if regex.search(combined_text):
+                return source
+        return 'прочее'
+
+    # === Векторизованные версии: один колоночный проход вместо iterrows / apply(axis=1) ===
+
+    @staticmethod
+    def _lower_text_column(df, column):
+        """str(value).lower() для колонки, как в построчных методах; '' если колонки нет"""
+        if column not in df.columns:
+            return pd.Series('', index=df.index, dtype=object)
+        return df[column].map(str).str.lower()
+
+    def compute_keyword_matrix(self, df):
+        """Все флаги ключевых слов одной булевой матрицей NumPy (строки df x признаки)"""
+        summary = self._lower_text_column(df, 'summary')
+        actions = self._lower_text_column(df, 'actions')
+        sentiment = self._lower_text_column(df, 'sentiment')
+        combined_text = summary + ' ' + actions + ' ' + sentiment
+        problem_text = summary + ' ' + actions
+
+        columns = {name: combined_text.str.contains(regex) for name, regex in FEATURE_REGEXES.items()}
+        columns['problem_indicator'] = problem_text.str.contains(PROBLEM_INDICATORS_RE)
+        columns['negative_action'] = problem_text.str.contains(NEGATIVE_ACTIONS_RE)
+        for source, regex in PROBLEM_SOURCE_REGEXES:
+            columns[f'source:{source}'] = problem_text.str.contains(regex)
+        columns['summary_download'] = summary.str.contains('download', regex=False)
+
+        names = list(columns)
+        matrix = np.zeros((len(df), len(names)), dtype=bool)
+        for i, name in enumerate(names):
+            matrix[:, i] = columns[name].to_numpy(dtype=bool)
+        return matrix, names
+
+    def extract_features_vectorized(self, df):
+        """Векторизованный extract_features_advanced: (features_df, матрица флагов, имена флагов)"""
+        keyword_matrix, keyword_names = self.compute_keyword_matrix(df)
+        flags = dict(zip(keyword_names, keyword_matrix.T))
+
+        features = {name: flags[name].astype(int) for name in KEYWORD_FEATURES}
+        if 'event_total' in df.columns:
+            features['event_count'] = df['event_total'].map(_safe_event_count).astype(float).to_numpy()
         else:
-            return 'прочее'
+            features['event_count'] = np.zeros(len(df))
+
+        session_length = self._lower_text_column(df, 'session_length')
+        long_session = session_length.str.contains('h', regex=False).to_numpy(dtype=bool)
+        medium_session = session_length.str.contains('m', regex=False).to_numpy(dtype=bool) & ~long_session
+        features['long_session'] = long_session.astype(int)
+        features['medium_session'] = medium_session.astype(int)
+        features['short_session'] = (~long_session & ~medium_session).astype(int)
+
+        features_df = pd.DataFrame(features, index=df.index, columns=KEYWORD_FEATURES + NUMERIC_FEATURES)
+        return features_df, keyword_matrix, keyword_names
+
+    def smart_categorize_vectorized(self, df, features_df, keyword_matrix, keyword_names):
+        """Векторизованный smart_categorize: правила в том же порядке приоритета"""
+        flags = dict(zip(keyword_names, keyword_matrix.T))
+        event_count = features_df['event_count'].to_numpy()
+        long_session = features_df['long_session'].to_numpy(dtype=bool)
+        short_session = features_df['short_session'].to_numpy(dtype=bool)
+        if 'sentiment_label' in df.columns:
+            sentiment_label = df['sentiment_label'].to_numpy(dtype=object)
+        else:
+            sentiment_label = np.full(len(df), '', dtype=object)
+
+        rules = [
+            (flags['payment'] & flags['tech_error'], 'Проблемы с депозитами/платежами'),
+            (flags['mobile'] & (flags['tech_error'] | flags['summary_download']), 'Проблемы с мобильным приложением'),
+            (flags['auth'] & flags['tech_error'], 'Проблемы с авторизацией'),
+            (flags['betting'] & flags['tech_error'], 'Проблемы со ставками'),
+            (flags['payment'] & flags['successful'], 'Успешные депозиты'),
+            (flags['betting'] & flags['successful'], 'Успешные ставки'),
+            (flags['gaming'] | flags['betting'], 'Игровая активность'),
+            (flags['navigation'] & (event_count > 0.5), 'Активная навигация'),
+            (long_session & (event_count > 0.3), 'Длительные активные сессии'),
+            (short_session & (event_count < 0.2), 'Короткие/неактивные сессии'),
+            (flags['mobile'], 'Мобильная активность'),
+            (flags['performance'], 'Проблемы производительности'),
+            (flags['ux_issue'], 'UX проблемы'),
+            (sentiment_label == 'negative', 'Негативный опыт'),
+            ((sentiment_label == 'positive') & flags['successful'], 'Позитивный опыт'),
+        ]
+        conditions = [condition for condition, _ in rules]
+        choices = [category for _, category in rules]
+        return np.select(conditions, choices, default='Обычная активность').astype(object)
+
+    def extract_sentiment_vectorized(self, sentiment):
+        """Векторизованный extract_sentiment"""
+        text = sentiment.map(str).str.lower()
+        conditions = [text.str.contains(label, regex=False).to_numpy(dtype=bool) for label in ['positive', 'negative', 'neutral']]
+        return np.select(conditions, ['positive', 'negative', 'neutral'], default='unknown').astype(object)
+
+    def has_problem_vectorized(self, sentiment_label, keyword_matrix, keyword_names):
+        """Векторизованный has_problem_advanced"""
+        flags = dict(zip(keyword_names, keyword_matrix.T))
+        sentiment_label = np.asarray(sentiment_label, dtype=object)
+        has_problem = (
+            (sentiment_label == 'negative')
+            | flags['problem_indicator']
+            | ((sentiment_label == 'neutral') & flags['negative_action'])
+        )
+        return has_problem.astype(int)
+
+    def detect_problem_source_vectorized(self, keyword_matrix, keyword_names):
+        """Векторизованный detect_problem_source_advanced"""
+        flags = dict(zip(keyword_names, keyword_matrix.T))
+        conditions = [flags[f'source:{source}'] for source, _ in PROBLEM_SOURCE_KEYWORDS]
+        choices = [source for source, _ in PROBLEM_SOURCE_KEYWORDS]
+        return np.select(conditions, choices, default='прочее').astype(object)
+
+    def analyze_rows(self, df):
+        """Признаки и метки (smart_category, sentiment_label, has_problem, problem_source) в df.
+
+        Возвращает features_df с числовыми признаками для кластеризации.
+        """
+        features_df, keyword_matrix, keyword_names = self.extract_features_vectorized(df)
+        # Smart категоризация (до пересчета sentiment_label, как и раньше)
+        df['smart_category'] = self.smart_categorize_vectorized(df, features_df, keyword_matrix, keyword_names)
+        df['sentiment_label'] = self.extract_sentiment_vectorized(df['sentiment'])
+        df['has_problem'] = self.has_problem_vectorized(df['sentiment_label'], keyword_matrix, keyword_names)
+        df['problem_source'] = self.detect_problem_source_vectorized(keyword_matrix, keyword_names)
+        return features_df
+
+    def prepare_texts(self, df):
+        """Очищенные тексты summary + sentiment + actions для векторизации"""
+        texts = (
+            df['summary'].fillna('') + ' ' +
+            df['sentiment'].fillna('') + ' ' +
+            df['actions'].fillna('')
+        ).values
+        return [self.clean_text(t) for t in texts]
+
+    @staticmethod
+    def describe_cluster(category_counts):
+        """Описание кластера по убыванию частоты smart_category: "первая + вторая" """
+        top_category = category_counts.index[0] if len(category_counts) > 0 else "Неизвестно"
+        description = f"{top_category}"
+        if len(category_counts) > 1:
+            description += f" + {category_counts.index[1]}"
+        return description
 
     def clean_text(self, text):
         """Очистка текста для TF-IDF"""
@@ -278,145 +540,461 @@ class ClusteringAnalysisProcessor:
                  w not in self.russian_stopwords and w not in self.extra_stopwords]
         return " ".join(words)
 
-    def update_session_in_bq(self, session_data):
-        """Обновление одной сессии в BigQuery"""
-        table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_table}"
-        
-        update_query = f"""
-        UPDATE `{table_id}`
-        SET
-            advanced_cluster = @advanced_cluster,
-            cluster_description = @cluster_description,
-            smart_category = @smart_category,
-            has_problem = @has_problem,
-            problem_source = @problem_source,
-            sentiment_label = @sentiment_label
-        WHERE session_id = @session_id
-        """
-        
+    def save_results(self, staging):
+        """Запись результатов кластеризации из временной таблицы одним MERGE; ошибки учитываются по строкам"""
+        staged_rows = staging["rows"] + len(staging["failed"])
+        self._update_status(f"💾 Сохраняем результаты {staged_rows} строк в BigQuery (MERGE)...", 80)
+
         try:
-            job_config = bigquery.QueryJobConfig(
-                query_parameters=[
-                    bigquery.ScalarQueryParameter("advanced_cluster", "INT64", int(session_data['advanced_cluster'])),
-                    bigquery.ScalarQueryParameter("cluster_description", "STRING", str(session_data['cluster_description'])),
-                    bigquery.ScalarQueryParameter("smart_category", "STRING", str(session_data['smart_category'])),
-                    bigquery.ScalarQueryParameter("has_problem", "INT64", int(session_data['has_problem'])),
-                    bigquery.ScalarQueryParameter("problem_source", "STRING", str(session_data['problem_source'])),
-                    bigquery.ScalarQueryParameter("sentiment_label", "STRING", str(session_data['sentiment_label'])),
-                    bigquery.ScalarQueryParameter("session_id", "STRING", str(session_data['session_id'])),
-                ]
+            outcome = self.merge_results(staging)
+        except Exception as e:
+            # MERGE не прошел целиком - ни одна строка не записана
+            self._update_status(f"❌ Ошибка записи результатов: {e}", -1)
+            self.total_failed += staged_rows
+            self.total_processed += staged_rows
+            self.failed_sessions = [(str(sid), str(e)) for sid in staging["session_ids"]]
+            return
+
+        self.total_successful += outcome['updated_sessions']
+        self.total_failed += len(outcome['failed'])
+        self.total_processed += outcome['updated_sessions'] + len(outcome['failed'])
+        self.failed_sessions = outcome['failed'][:20]
+        for session_id, reason in outcome['failed'][:20]:
+            self._update_status(f"❌ Не обновлена session_id {session_id}: {reason}", -1)
+        self._update_status(f"💾 Обновлено строк: {outcome['updated_rows']}, ошибок: {len(outcome['failed'])}", 95)
+
+    def collapse_near_duplicates(self, texts_clean):
+        """(позиции представителей, веса или None, индекс представителя для каждой строки).
+
+        Без побочных эффектов: одни и те же части группируются в нескольких проходах,
+        статистика считается только при разметке (assign_with_model).
+        """
+        if not self.dedup_enabled:
+            return np.arange(len(texts_clean)), None, np.arange(len(texts_clean))
+        return NearDuplicateGrouper(self.dedup_threshold).collapse(texts_clean)
+
+    def reset_near_duplicates(self):
+        self.dedup_rows = 0
+        self.dedup_groups = 0
+
+    def near_duplicates_report(self):
+        return {
+            "enabled": self.dedup_enabled,
+            "threshold": self.dedup_threshold,
+            "rows": self.dedup_rows,
+            "groups": self.dedup_groups,
+            "compression_ratio": round(self.dedup_rows / self.dedup_groups, 2) if self.dedup_groups else 1.0,
+        }
+
+    def choose_k(self, features, strata):
+        """Параллельный перебор k на стратифицированной (по smart_category) выборке признаков"""
+        positions = stratified_sample_positions(strata, self.k_sample_rows)
+        self._update_status(f"🔢 Подбираем k ({self.k_min}-{self.k_max}, {self.k_metric}) на выборке {len(positions)} строк...", -1)
+        best_k, self.k_sweep_report = sweep_k(features[positions], range(self.k_min, self.k_max + 1),
+                                              metric=self.k_metric, n_jobs=self.k_jobs)
+        for entry in self.k_sweep_report:
+            self._update_status(f"🔢 k={entry['k']}: {self.k_metric}={entry['score']} за {entry['seconds']}s", -1)
+        if best_k:
+            self._update_status(f"✅ Выбрано k={best_k}", -1)
+        return best_k
+
+    def cluster_batch(self, df):
+        """Пакетный режим: все строки в памяти, TF-IDF (или SVD представление) + KMeans. Возвращает (df, clusterer)"""
+        # Извлечение признаков: один колоночный проход по ключевым словам
+        self._update_status("🔧 Извлекаем признаки и метки...", 30)
+        features_df = self.analyze_rows(df)
+
+        # Кластеризация: представление текста + стандартизованные числовые признаки + KMeans
+        self._update_status("🎯 Выполняем кластеризацию...", 60)
+        texts_clean = self.prepare_texts(df)
+        positions, weights, inverse = self.collapse_near_duplicates(texts_clean)
+        if weights is not None:
+            self._update_status(f"🧬 Почти дубликаты: {len(df)} строк -> {len(positions)} групп (x{len(df) / len(positions):.2f})", 62)
+
+        if self.partition_by in ('smart_category', 'problem_source'):
+            clusterer = PartitionedSessionClusterer(
+                self.partition_by, max_clusters=self.partition_k, min_rows=self.partition_min_rows,
+                feature_pipeline=self.feature_pipeline, svd_components=self.svd_components
             )
-            self.bq_client.query(update_query, job_config=job_config).result()
-            return True
+            labels = clusterer.fit([texts_clean[i] for i in positions], features_df.values[positions],
+                                   df[self.partition_by].values[positions], sample_weight=weights,
+                                   max_workers=self.partition_workers)
+            df['advanced_cluster'] = labels[inverse]
+            self.partition_report = {
+                partition: {"clusters": clusterer.clusterers[partition].n_clusters, "seconds": seconds}
+                for partition, seconds in clusterer.fit_seconds.items()
+            }
+            for partition, stats in self.partition_report.items():
+                self._update_status(f"🧩 Партиция {partition}: {stats['clusters']} кластеров за {stats['seconds']}s", -1)
+        else:
+            labels, clusterer = self.fit_global(df, texts_clean, features_df, positions, weights)
+            df['advanced_cluster'] = labels[inverse]
+
+        # Создание описаний кластеров
+        self._update_status("📝 Создаем описания кластеров...", 70)
+        cluster_desc_map = {
+            cluster_id: self.describe_cluster(cluster_data['smart_category'].value_counts())
+            for cluster_id, cluster_data in df.groupby('advanced_cluster')
+        }
+        df['cluster_description'] = df['advanced_cluster'].map(cluster_desc_map)
+        return df, clusterer
+
+    def fit_global(self, df, texts_clean, features_df, positions, weights):
+        """Один KMeans по всем представителям (с подбором k, если включен). Возвращает (метки представителей, clusterer)"""
+        n_clusters = min(8, len(positions) // 2) if len(positions) > 1 else 1
+        if self.feature_pipeline == 'svd':
+            clusterer = SvdSessionClusterer(n_clusters=n_clusters, n_components=self.svd_components)
+        else:
+            clusterer = TfidfSessionClusterer(n_clusters=n_clusters)
+        combined_features = clusterer.fit_features([texts_clean[i] for i in positions], features_df.values[positions])
+        if self.k_sweep:
+            best_k = self.choose_k(combined_features, df['smart_category'].values[positions])
+            if best_k:
+                clusterer.set_n_clusters(best_k)
+        return clusterer.fit_clusters(combined_features, sample_weight=weights), clusterer
+
+    def cluster_streaming(self, job, total_rows):
+        """Потоковый режим: страницы результата запроса, разреженные признаки, MiniBatchKMeans.
+
+        Возвращает (описания кластеров, clusterer).
+
+        Проход 1 - статистика IDF и масштабирования, проход 2 - partial_fit,
+        проход 3 - разметка для описаний. В памяти держится одна страница и счетчики
+        smart_category по кластерам, сами метки не сохраняются: строки таблицы
+        размечает assign_with_model.
+        """
+        if self.partition_by:
+            self._update_status("ℹ️ CLUSTERING_PARTITION_BY действует только в пакетном режиме, потоковый обучает один KMeans", -1)
+        n_clusters = min(8, total_rows // 2) if total_rows > 1 else 1
+        clusterer = StreamingSessionClusterer(n_clusters=n_clusters, n_features=self.hash_features)
+
+        def prepared_chunks():
+            for chunk in self.iter_row_chunks(job):
+                features_df = self.analyze_rows(chunk)
+                yield chunk, self.prepare_texts(chunk), features_df.values
+
+        self._update_status(f"🔧 Проход 1/3: статистика признаков ({total_rows} строк, части по {self.chunk_size})...", 30)
+        # Для подбора k в первом проходе откладывается стратифицированная выборка ~k_sample_rows строк
+        sample_texts, sample_numeric, sample_strata = [], [], []
+        for chunk, texts_clean, numeric in prepared_chunks():
+            clusterer.observe(texts_clean, numeric)
+            if self.k_sweep:
+                chunk_sample = max(1, round(len(chunk) * self.k_sample_rows / total_rows))
+                positions = stratified_sample_positions(chunk['smart_category'], chunk_sample)
+                sample_texts += [texts_clean[i] for i in positions]
+                sample_numeric.append(numeric[positions])
+                sample_strata += list(chunk['smart_category'].values[positions])
+        clusterer.finalize_statistics()
+
+        if self.k_sweep and sample_texts:
+            sample_features = clusterer.transform(sample_texts, np.vstack(sample_numeric))
+            best_k = self.choose_k(sample_features, sample_strata)
+            if best_k:
+                clusterer.set_n_clusters(best_k)
+
+        self._update_status("🎯 Проход 2/3: обучение MiniBatchKMeans...", 45)
+        for _, texts_clean, numeric in prepared_chunks():
+            positions, weights, _ = self.collapse_near_duplicates(texts_clean)
+            clusterer.partial_fit([texts_clean[i] for i in positions], numeric[positions], sample_weight=weights)
+        clusterer.finish_training()
+
+        self._update_status("🏷️ Проход 3/3: разметка кластеров...", 60)
+        category_counts = None
+        for chunk, texts_clean, numeric in prepared_chunks():
+            positions, _, inverse = self.collapse_near_duplicates(texts_clean)
+            chunk['advanced_cluster'] = clusterer.predict([texts_clean[i] for i in positions], numeric[positions])[inverse]
+            chunk_counts = chunk.groupby(['advanced_cluster', 'smart_category']).size()
+            category_counts = chunk_counts if category_counts is None else category_counts.add(chunk_counts, fill_value=0)
+
+        self._update_status("📝 Создаем описания кластеров...", 70)
+        cluster_desc_map = {
+            int(cluster_id): self.describe_cluster(counts.droplevel(0).sort_values(ascending=False, kind='stable'))
+            for cluster_id, counts in category_counts.groupby(level=0)
+        }
+        return cluster_desc_map, clusterer
+
+    def fit_model(self, job, rows):
+        """Обучение новой модели на результате запроса (пакетно или потоково по объему)"""
+        total_rows = rows.total_rows or 0
+        if self.use_streaming(total_rows):
+            descriptions, clusterer = self.cluster_streaming(job, total_rows)
+        else:
+            df, clusterer = self.cluster_batch(self.bq_reader.to_dataframe(rows))
+            descriptions = {
+                int(cluster_id): description
+                for cluster_id, description in df.groupby('advanced_cluster')['cluster_description'].first().items()
+            }
+        return ClusterModel(clusterer, descriptions, trained_rows=total_rows)
+
+    def assign_with_model(self, model, job, total_rows, staging, progress_from=30, progress_to=75):
+        """Разметка строк запроса сохраненной моделью по страницам: только predict, O(строк).
+
+        Каждая размеченная страница сразу дозагружается во временную таблицу staging,
+        память ограничена размером страницы. Возвращает среднее расстояние до ближайшего центра.
+        """
+        processed = 0
+        distance_sum = 0.0
+        for chunk in self.iter_row_chunks(job):
+            features_df = self.analyze_rows(chunk)
+            texts_clean = self.prepare_texts(chunk)
+            positions, _, inverse = self.collapse_near_duplicates(texts_clean)
+            partitions = chunk[model.partition_column].values[positions] if model.partition_column else None
+            labels, distances = model.assign([texts_clean[i] for i in positions], features_df.values[positions], partitions)
+            labels, distances = labels[inverse], distances[inverse]
+            if self.dedup_enabled:
+                self.dedup_rows += len(chunk)
+                self.dedup_groups += len(positions)
+            chunk['advanced_cluster'] = labels
+            chunk['cluster_description'] = model.describe(labels)
+            self.stage_results(chunk[CLUSTER_RESULT_COLUMNS + [PARTITION_COLUMN]], staging)
+            processed += len(chunk)
+            distance_sum += float(distances.sum())
+            progress = progress_from + int(processed / max(total_rows, 1) * (progress_to - progress_from))
+            self._update_status(f"🏷️ Размечено моделью {model.version or '(новая)'}: {processed}/{total_rows}", progress)
+
+        return distance_sum / processed if processed else 0.0
+
+    @staticmethod
+    def prepare_results(df):
+        """Проверка и приведение типов перед загрузкой: (валидные строки, [(session_id, причина)])"""
+        # MERGE требует не больше одной строки источника на сессию - остается последняя
+        results = df[CLUSTER_RESULT_COLUMNS]
+        results = results[~(results['session_id'].duplicated(keep='last') & results['session_id'].notna())].copy()
+
+        invalid = results['session_id'].isna() | (results['session_id'].astype(str).str.strip() == '')
+        failed = [("<пусто>", "нет session_id")] * int(invalid.sum())
+        for column in CLUSTER_RESULT_INT_COLUMNS:
+            bad = pd.to_numeric(results[column], errors='coerce').isna() & ~invalid
+            failed += [(str(sid), f"некорректное значение {column}") for sid in results.loc[bad, 'session_id']]
+            invalid |= bad
+
+        results = results[~invalid].copy()
+        for column in CLUSTER_RESULT_INT_COLUMNS:
+            results[column] = pd.to_numeric(results[column]).astype('int64')
+        for column in CLUSTER_RESULT_COLUMNS:
+            if column not in CLUSTER_RESULT_INT_COLUMNS:
+                results[column] = [None if pd.isna(value) else str(value) for value in results[column]]
+        return results.reset_index(drop=True), failed
+
+    def new_staging(self):
+        """Временная таблица для результатов разметки и счетчики загруженных в нее строк"""
+        return {
+            "table_id": f"{self.bq_project_id}.{self.bq_dataset_id}.temp_clustering_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            "rows": 0,
+            "failed": [],
+            "session_ids": [],
+            "clusters": set(),
+            "min_date": None,
+            "dates_complete": True,
+        }
+
+    def stage_results(self, df, staging):
+        """Дозагрузка одной страницы результатов во временную таблицу (WRITE_APPEND).
+
+        В staging копятся только счетчики: строки, отброшенные проверкой, кластеры,
+        самая ранняя record_date и до 20 session_id для отчета об ошибке.
+        """
+        results, failed = self.prepare_results(df)
+        staging["failed"] += failed
+        if PARTITION_COLUMN in df:
+            dates = pd.to_datetime(df[PARTITION_COLUMN], errors='coerce')
+            if dates.isna().any():
+                staging["dates_complete"] = False
+            elif not dates.empty and (staging["min_date"] is None or dates.min() < staging["min_date"]):
+                staging["min_date"] = dates.min()
+        else:
+            staging["dates_complete"] = False
+        if results.empty:
+            return
+
+        job_config = bigquery.LoadJobConfig(
+            schema=CLUSTER_RESULT_SCHEMA,
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        )
+        self.bq_client.load_table_from_dataframe(results, staging["table_id"], job_config=job_config).result()
+        staging["rows"] += len(results)
+        staging["clusters"].update(int(label) for label in results['advanced_cluster'].unique())
+        staging["session_ids"] += list(results['session_id'].head(20 - len(staging["session_ids"])))
+
+    def drop_staging(self, staging):
+        self.bq_client.delete_table(staging["table_id"], not_found_ok=True)
+
+    def partition_filter(self, staging, table_id):
+        """Условие MERGE на партиции целевой таблицы: от самой ранней record_date результатов.
+
+        Пусто, если таблица не партиционирована по record_date или у части строк нет даты.
+        """
+        if self.bq_reader.partition_field(table_id) != PARTITION_COLUMN:
+            return ""
+        if not staging["dates_complete"] or staging["min_date"] is None:
+            return ""
+        return f" AND T.{PARTITION_COLUMN} >= DATE('{staging['min_date']:%Y-%m-%d}')"
+
+    def merge_results(self, staging):
+        """Массовая запись результатов из временной таблицы одним MERGE по session_id.
+
+        Возвращает updated_rows (строк таблицы, затронутых MERGE), updated_sessions и
+        failed - [(session_id, причина)] для строк, отброшенных проверкой или не найденных MERGE.
+        """
+        failed = list(staging["failed"])
+        if staging["rows"] == 0:
+            return {"updated_rows": 0, "updated_sessions": 0, "failed": failed}
+
+        temp_table_id = staging["table_id"]
+        target_table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_table}"
+        update_set = ',\n            '.join(f"{c} = S.{c}" for c in CLUSTER_RESULT_COLUMNS[1:])
+        partition_filter = self.partition_filter(staging, target_table_id)
+
+        # Дубли session_id внутри страницы убирает prepare_results, между страницами - QUALIFY:
+        # MERGE требует не больше одной строки источника на сессию
+        merge_query = f"""
+        MERGE `{target_table_id}` T
+        USING (
+          SELECT * FROM `{temp_table_id}`
+          WHERE TRUE
+          QUALIFY ROW_NUMBER() OVER (PARTITION BY session_id) = 1
+        ) S
+        ON T.session_id = S.session_id{partition_filter}
+        WHEN MATCHED THEN
+          UPDATE SET
+            {update_set}
+        """
+        merge_job = self.bq_reader.run(merge_query, description="MERGE кластеров")
+        updated_rows = merge_job.num_dml_affected_rows or 0
+
+        # Строки, для которых MERGE не нашел сессию в таблице, и число загруженных сессий
+        unmatched_query = f"""
+        SELECT S.session_id
+        FROM (SELECT DISTINCT session_id FROM `{temp_table_id}`) S
+        LEFT JOIN `{target_table_id}` T ON T.session_id = S.session_id{partition_filter}
+        WHERE T.session_id IS NULL
+        """
+        _, unmatched_rows = self.bq_reader.query(unmatched_query, description="Проверка ненайденных сессий")
+        unmatched = [row.session_id for row in unmatched_rows]
+        sessions_query = f"SELECT COUNT(DISTINCT session_id) AS sessions FROM `{temp_table_id}`"
+        _, session_rows = self.bq_reader.query(sessions_query, description="Число загруженных сессий")
+        sessions = next(iter(session_rows)).sessions
+
+        failed += [(session_id, "session_id не найден в таблице") for session_id in unmatched]
+        return {
+            "updated_rows": updated_rows,
+            "updated_sessions": sessions - len(unmatched),
+            "failed": failed,
+        }
+
+    def check_model_location(self):
+        """Без постоянного хранилища модели не запускаемся: после перезапуска модель терялась бы,
+        и run() переобучал бы ее с новыми номерами кластеров"""
+        if not self.model_location:
+            raise RuntimeError("CLUSTERING_MODEL_LOCATION не задан: укажите постоянное хранилище модели (gs://bucket/prefix)")
+        if self.model_location.startswith('gs://'):
+            return
+        if self.environment == 'production':
+            raise RuntimeError(f"CLUSTERING_MODEL_LOCATION={self.model_location} - локальный диск, который очищается "
+                               f"при перезапуске сервиса; в production нужен gs://bucket/prefix")
+        self._update_status(f"⚠️ Модель хранится на локальном диске ({self.model_location}): после перезапуска "
+                            f"она будет потеряна, а следующий запуск переобучит модель и переразметит всю таблицу", -1)
+
+    def model_store(self):
+        return ClusterModelStore(self.model_location, credentials_path=self.credentials_path)
+
+    def refit(self):
+        """Переобучение: новая модель на выборке, массовая переразметка всех строк, новая версия модели.
+
+        Модель сохраняется только после успешной записи меток, поэтому метки в таблице
+        всегда соответствуют последней сохраненной версии.
+        """
+        self.start_time = datetime.now()
+        self.reset_near_duplicates()
+        self._update_status("🔄 ПЕРЕОБУЧЕНИЕ МОДЕЛИ КЛАСТЕРИЗАЦИИ", 5)
+        self.check_model_location()
+
+        job, rows = self.query_sample_rows()
+        sample_rows = rows.total_rows or 0
+        if sample_rows == 0:
+            self._update_status("✅ Нет данных для обучения!", 100)
+            return {"status": "no_data", "message": "Таблица пуста", **self.bq_reader.cost_report()}
+
+        staging = self.new_staging()
+        try:
+            model = self.fit_model(job, rows)
+
+            self._update_status("🏷️ Переразмечаем все строки новой моделью...", 75)
+            all_job, all_rows = self.query_all_rows()
+            mean_distance = self.assign_with_model(model, all_job, all_rows.total_rows or 0, staging, 75, 85)
+            model.baseline_distance = mean_distance
+            relabeled_rows = staging["rows"] + len(staging["failed"])
+
+            self._update_status(f"💾 Записываем метки {relabeled_rows} строк одним MERGE...", 88)
+            outcome = self.merge_results(staging)
+            version = self.model_store().save(model)
         except Exception as e:
-            self._update_status(f"❌ Ошибка обновления session_id {session_data['session_id']}: {e}", -1)
-            return False
+            self._update_status(f"❌ Критическая ошибка при переобучении: {e}", -1)
+            raise
+        finally:
+            self.drop_staging(staging)
+
+        total_time = datetime.now() - self.start_time
+        result = {
+            "status": "completed",
+            "mode": "refit",
+            "model_version": version,
+            "sample_rows": model.trained_rows,
+            "relabeled_rows": relabeled_rows,
+            "updated_rows": outcome['updated_rows'],
+            "failed_rows": len(outcome['failed']),
+            "clusters_created": len(model.descriptions),
+            "k_sweep": self.k_sweep_report,
+            "partitions": self.partition_report,
+            "near_duplicates": self.near_duplicates_report(),
+            **self.bq_reader.cost_report(),
+            "total_time_minutes": round(total_time.total_seconds() / 60, 1)
+        }
+        self._update_status(f"🏁 МОДЕЛЬ {version} ОБУЧЕНА, переразмечено строк: {outcome['updated_rows']}", 100)
+        return result
 
     def run(self):
-        """Основной метод кластеризации и анализа"""
+        """Ежедневная разметка новых строк сохраненной моделью; без модели - первое обучение (refit)"""
         self.start_time = datetime.now()
+        self.reset_near_duplicates()
         
         self._update_status("🔄 ЗАПУСК КЛАСТЕРИЗАЦИИ И АНАЛИЗА", 20)
+        self.check_model_location()
+
+        model = self.model_store().load(self.model_version)
+        if model is None:
+            self._update_status("ℹ️ Сохраненной модели нет - обучаем первую версию", 20)
+            return self.refit()
         
         # Получаем данные для обработки
-        df = self.get_rows_without_clusters()
+        job, rows = self.query_rows_without_clusters()
+        total_rows = rows.total_rows or 0
         
-        if df.empty:
+        if total_rows == 0:
             self._update_status("✅ Нет данных для кластеризации!", 100)
-            return {"status": "no_data", "message": "Все данные уже кластеризованы"}
+            return {"status": "no_data", "message": "Все данные уже кластеризованы", "model_version": model.version,
+                    **self.bq_reader.cost_report()}
 
-        self._update_status(f"📊 Начинаем анализ {len(df)} записей", 25)
+        self._update_status(f"📊 Размечаем {total_rows} новых записей моделью {model.version}", 25)
         
+        staging = self.new_staging()
         try:
-            # Извлечение признаков
-            self._update_status("🔧 Извлекаем признаки...", 30)
-            features_list = []
-            for _, row in df.iterrows():
-                features = self.extract_features_advanced(row)
-                features_list.append(features)
-            features_df = pd.DataFrame(features_list)
-
-            # Smart категоризация
-            self._update_status("🏷️ Применяем умную категоризацию...", 40)
-            smart_categories = []
-            for i, row in df.iterrows():
-                category = self.smart_categorize(row, features_list[i])
-                smart_categories.append(category)
-            df['smart_category'] = smart_categories
-
-            # Обработка sentiment
-            self._update_status("😊 Анализируем sentiment...", 45)
-            df['sentiment_label'] = df['sentiment'].apply(self.extract_sentiment)
-
-            # Определение проблем
-            self._update_status("🔍 Определяем проблемы...", 50)
-            df['has_problem'] = df.apply(self.has_problem_advanced, axis=1)
-            df['problem_source'] = df.apply(self.detect_problem_source_advanced, axis=1)
-
-            # Кластеризация
-            self._update_status("🎯 Выполняем кластеризацию...", 60)
-            
-            # Подготовка текстов
-            texts = (
-                df['summary'].fillna('') + ' ' +
-                df['sentiment'].fillna('') + ' ' +
-                df['actions'].fillna('')
-            ).values
-
-            texts_clean = [self.clean_text(t) for t in texts]
-            
-            # TF-IDF векторизация
-            vectorizer = TfidfVectorizer(max_features=1000, min_df=1, max_df=0.8)
-            text_features = vectorizer.fit_transform(texts_clean)
-            
-            # Стандартизация числовых признаков
-            scaler = StandardScaler()
-            numeric_features = scaler.fit_transform(features_df.values)
-            
-            # Объединение признаков
-            from scipy.sparse import hstack
-            combined_features = hstack([text_features, numeric_features])
-            
-            # K-means кластеризация
-            n_clusters = min(8, len(df) // 2) if len(df) > 1 else 1
-            kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-            cluster_labels = kmeans.fit_predict(combined_features.toarray())
-            df['advanced_cluster'] = cluster_labels
-
-            # Создание описаний кластеров
-            self._update_status("📝 Создаем описания кластеров...", 70)
-            cluster_descriptions = []
-            for cluster_id in sorted(set(cluster_labels)):
-                cluster_mask = df['advanced_cluster'] == cluster_id
-                cluster_data = df[cluster_mask]
-                cluster_categories = cluster_data['smart_category'].value_counts()
-                top_category = cluster_categories.index[0] if len(cluster_categories) > 0 else "Неизвестно"
-                description = f"{top_category}"
-                if len(cluster_categories) > 1:
-                    description += f" + {cluster_categories.index[1]}"
-                cluster_descriptions.append(description)
-            
-            cluster_desc_map = {i: desc for i, desc in enumerate(cluster_descriptions)}
-            df['cluster_description'] = df['advanced_cluster'].map(cluster_desc_map)
+            mean_distance = self.assign_with_model(model, job, total_rows, staging)
 
             # Обновление в BigQuery
-            self._update_status("💾 Сохраняем результаты в BigQuery...", 80)
-            
-            for i, (_, row) in enumerate(df.iterrows()):
-                progress = 80 + int((i / len(df)) * 15)
-                self._update_status(f"💾 Обновляем запись {i+1}/{len(df)}", progress)
-                
-                success = self.update_session_in_bq(row.to_dict())
-                if success:
-                    self.total_successful += 1
-                else:
-                    self.total_failed += 1
-                
-                self.total_processed += 1
+            self.save_results(staging)
 
         except Exception as e:
             self._update_status(f"❌ Критическая ошибка в кластеризации: {e}", -1)
             raise
+        finally:
+            self.drop_staging(staging)
+
+        drift_ratio = model.drift_ratio(mean_distance)
+        drift_exceeded = drift_ratio > self.drift_threshold
+        if drift_exceeded:
+            self._update_status(f"⚠️ Дрейф данных: новые строки в {drift_ratio:.2f} раза дальше от центров (порог {self.drift_threshold})", 96)
 
         # Финальная статистика
         total_time = datetime.now() - self.start_time
@@ -426,16 +1004,24 @@ class ClusteringAnalysisProcessor:
             "total_successful": self.total_successful,
             "total_failed": self.total_failed,
             "success_rate": f"{(self.total_successful/self.total_processed*100):.1f}%" if self.total_processed > 0 else "0%",
-            "clusters_created": len(set(cluster_labels)) if 'cluster_labels' in locals() else 0,
+            "failed_sessions": self.failed_sessions,
+            "clusters_created": len(staging["clusters"]),
+            "model_version": model.version,
+            "drift_ratio": round(drift_ratio, 3),
+            "drift_exceeded": drift_exceeded,
+            "near_duplicates": self.near_duplicates_report(),
+            **self.bq_reader.cost_report(),
             "total_time_minutes": round(total_time.total_seconds() / 60, 1)
         }
 
         self._update_status(f"🏁 КЛАСТЕРИЗАЦИЯ ЗАВЕРШЕНА!", 100)
         self._update_status(f"📊 Обработано: {self.total_processed}, Успешно: {self.total_successful}, Кластеров: {result['clusters_created']}", 100)
+
+        if drift_exceeded and self.auto_refit:
+            result["refit"] = self.refit()
         
         return result
 
-
 def main():
     """Основная функция для запуска кластеризации"""
     try:
@@ -446,7 +1032,11 @@ def main():
                 print(f"[INFO] {details}")
 
         processor = ClusteringAnalysisProcessor(status_callback=console_status_callback)
-        result = processor.run()
+        # python scripts/clustering_analysis.py refit - переобучение модели и переразметка всех строк
+        if len(sys.argv) > 1 and sys.argv[1] == 'refit':
+            result = processor.refit()
+        else:
+            result = processor.run()
         
         print(f"\n🏁 Финальный результат: {result}")
         return result
@@ -2,11 +2,11 @@ import os
 import sys
 import json
 import re
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from google.cloud import bigquery
 from google.oauth2 import service_account
 import pandas as pd
-import tempfile
 
 # Добавляем путь к корню проекта для импорта config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -29,6 +29,34 @@ except ImportError:
     
     settings = MockSettings()
 
+from scripts.bq_io import (PARTITION_COLUMN, URL_TABLE_CLUSTERING, BigQueryReader, BudgetExceededError,
+                           format_bytes, make_storage_client)
+
+REPLAY_BASE_URL = "https://app.amplitude.com/analytics/rn/session-replay"
+
+# Схема session_replay_urls: по ней создается таблица и типизируется Parquet загрузка
+URL_TABLE_SCHEMA = [
+    bigquery.SchemaField("record_date", "DATE", mode="REQUIRED"),
+    bigquery.SchemaField("session_replay_url", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("collection_datetime", "TIMESTAMP", mode="REQUIRED"),
+    bigquery.SchemaField("is_processed", "BOOLEAN", mode="REQUIRED"),
+    bigquery.SchemaField("amplitude_id", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("session_replay_id", "STRING", mode="NULLABLE"),
+    bigquery.SchemaField("duration_seconds", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("events_count", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("processed_datetime", "TIMESTAMP", mode="NULLABLE"),
+    bigquery.SchemaField("screenshots_count", "INTEGER", mode="NULLABLE"),
+    bigquery.SchemaField("drive_folder_id", "STRING", mode="NULLABLE"),
+    # Выборка при сборе (COLLECT_SAMPLING): NULL - сессия собрана без выборки и идет в обработку
+    bigquery.SchemaField("sampling_selected", "BOOLEAN", mode="NULLABLE"),
+    bigquery.SchemaField("sampling_weight", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("sampling_stratum", "STRING", mode="NULLABLE"),
+]
+URL_TABLE_COLUMNS = [field.name for field in URL_TABLE_SCHEMA]
+
+# Ключи выполненных шардов бэкфилла в таблице состояния (для возобновления)
+BACKFILL_STATE_PREFIX = 'collect_links_backfill/'
+
 
 class BigQueryReplayCollector:
     def __init__(self, credentials_path, project_id, dataset_id, table_id,
@@ -41,6 +69,22 @@ class BigQueryReplayCollector:
         self.output_table_id = 'session_replay_urls'
         self.full_table_name = f"`{project_id}.{dataset_id}.{table_id}`"
         self.output_table_name = f"{project_id}.{output_dataset_id}.{self.output_table_id}"
+        # Состояние инкрементального сбора: отметка (верхняя граница просканированного event_time)
+        self.state_table_name = f"{project_id}.{output_dataset_id}.collector_state"
+        # Перекрытие окна: события, пришедшие в выгрузку с опозданием, попадут в следующий запуск
+        self.overlap_hours = float(os.environ.get('COLLECT_OVERLAP_HOURS', '6'))
+        # Стратифицированная выборка сессий под пропускную способность этапа скриншотов
+        self.sampling_enabled = os.environ.get('COLLECT_SAMPLING', 'false').lower() == 'true'
+        self.sampling_max_per_user_day = int(os.environ.get('COLLECT_SAMPLING_MAX_PER_USER_DAY', '3'))
+        self.sampling_daily_quota = int(os.environ.get('COLLECT_SAMPLING_DAILY_QUOTA', '0'))
+        self.sampling_duration_edges = [
+            float(edge) for edge in os.environ.get('COLLECT_SAMPLING_DURATION_EDGES', '60,300,900').split(',') if edge.strip()
+        ]
+        self.sampling_events_edges = [
+            int(edge) for edge in os.environ.get('COLLECT_SAMPLING_EVENTS_EDGES', '20,100').split(',') if edge.strip()
+        ]
+        # Сколько из фактически загруженных строк попали в выборку (последняя загрузка save_urls_to_bigquery)
+        self.last_sampled_rows = 0
 
         print("🔐 Настраиваем аутентификацию...")
         print(f"📁 Пытаемся загрузить credentials из: {credentials_path}")
@@ -57,6 +101,7 @@ class BigQueryReplayCollector:
             )
 
             self.client = bigquery.Client(credentials=credentials, project=project_id)
+            self.reader = BigQueryReader(self.client, make_storage_client(credentials), stage='collect_links')
             print(f"✅ Подключение к BigQuery установлено")
             print(f"📊 Исходная таблица: {self.full_table_name}")
             print(f"💾 Целевая таблица: {self.output_table_name}")
@@ -78,52 +123,41 @@ class BigQueryReplayCollector:
                 dataset = self.client.create_dataset(dataset)
                 print(f"✅ Датасет {self.output_dataset_id} создан")
 
-            # Схема таблицы
-            schema = [
-                bigquery.SchemaField("record_date", "DATE", mode="REQUIRED"),
-                bigquery.SchemaField("session_replay_url", "STRING", mode="REQUIRED"),
-                bigquery.SchemaField("collection_datetime", "TIMESTAMP", mode="REQUIRED"),
-                bigquery.SchemaField("is_processed", "BOOLEAN", mode="REQUIRED"),
-                bigquery.SchemaField("amplitude_id", "INTEGER", mode="NULLABLE"),
-                bigquery.SchemaField("session_replay_id", "STRING", mode="NULLABLE"),
-                bigquery.SchemaField("duration_seconds", "FLOAT", mode="NULLABLE"),
-                bigquery.SchemaField("events_count", "INTEGER", mode="NULLABLE"),
-                bigquery.SchemaField("processed_datetime", "TIMESTAMP", mode="NULLABLE"),
-                bigquery.SchemaField("screenshots_count", "INTEGER", mode="NULLABLE"),
-                bigquery.SchemaField("drive_folder_id", "STRING", mode="NULLABLE"),
-            ]
-
             # Проверяем существование таблицы
             try:
                 table = self.client.get_table(self.output_table_name)
                 print(f"✅ Таблица {self.output_table_id} уже существует")
-                return table
             except:
                 print(f"📊 Создаем таблицу {self.output_table_id}...")
-                table_ref = bigquery.Table(self.output_table_name, schema=schema)
+                table_ref = bigquery.Table(self.output_table_name, schema=URL_TABLE_SCHEMA)
+                # Раскладка как после scripts/migrate_tables.py: партиции по дням, кластеры по состоянию и ID
+                table_ref.time_partitioning = bigquery.TimePartitioning(
+                    type_=bigquery.TimePartitioningType.DAY, field=PARTITION_COLUMN)
+                table_ref.clustering_fields = URL_TABLE_CLUSTERING
                 table = self.client.create_table(table_ref)
                 print(f"✅ Таблица {self.output_table_id} создана")
                 return table
 
+            # Таблица, созданная до появления новых колонок, дополняется ими (NULLABLE)
+            existing = {field.name for field in table.schema}
+            missing = [field for field in URL_TABLE_SCHEMA if field.name not in existing]
+            if missing:
+                print(f"➕ Добавляем колонки: {', '.join(field.name for field in missing)}")
+                table.schema = list(table.schema) + missing
+                table = self.client.update_table(table, ["schema"])
+            return table
+
         except Exception as e:
             print(f"❌ Ошибка создания таблицы: {e}")
             raise
 
     def test_connection(self):
-        """Тестирование подключения"""
+        """Тестирование подключения: чтение метаданных таблицы (tables.get), без запроса и оплаты байт"""
         try:
-            test_query = f"""
-            SELECT COUNT(*) as total_events
-            FROM {self.full_table_name}
-            WHERE TIMESTAMP_TRUNC(event_time, DAY) >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY)
-            LIMIT 1
-            """
-
             print("🔍 Тестируем подключение к BigQuery...")
-            result = self.client.query(test_query).result()
-
-            for row in result:
-                print(f"✅ Подключение успешно! События за последние 7 дней: {row.total_events:,}")
+            table = self.client.get_table(self.full_table_name.strip('`'))
+            print(f"✅ Подключение успешно! Таблица событий: {table.num_rows or 0:,} строк, "
+                  f"{format_bytes(table.num_bytes or 0)}, изменена {table.modified}")
 
             return True
 
@@ -131,157 +165,355 @@ class BigQueryReplayCollector:
             print(f"❌ Ошибка тестирования подключения: {e}")
             return False
 
-    def get_session_replay_ids_with_duration(self, start_date, end_date, min_duration_seconds=20, amplitude_id=None):
-        """Получение Session Replay ID с фильтрацией по длительности сессии"""
+    @staticmethod
+    def day_window(start_date, end_date):
+        """Границы [start_time, end_time) для полных дней start_date..end_date (включительно), UTC"""
+        start = datetime.strptime(str(start_date), '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        end = datetime.strptime(str(end_date), '%Y-%m-%d').replace(tzinfo=timezone.utc) + timedelta(days=1)
+        return start, end
 
-        # ОБНОВЛЕННЫЙ РАБОЧИЙ SQL ЗАПРОС
-        query = f"""
-        WITH session_data AS (
-            SELECT 
+    def session_replay_query(self, start_time, end_time, min_duration_seconds=20, amplitude_id=None,
+                             started_between=None):
+        """SQL для сессий с Session Replay ID по событиям из окна [start_time, end_time) (datetime UTC).
+
+        Фильтр - прямо по event_time (колонка партиционирования), чтобы читались только
+        партиции окна. Replay ID извлекается одним JSON_VALUE, а время начала и длительность
+        разбираются из короткой строки ID уже после группировки - один раз на сессию.
+        Сортировка не нужна: результат уходит в загрузку, а не на экран.
+
+        started_between=(from, to) оставляет только сессии, начавшиеся (по времени из ID)
+        в [from, to) - так шарды бэкфилла не делят одну сессию между собой.
+        """
+        amplitude_filter = f"\n                AND amplitude_id = {int(amplitude_id)}" if amplitude_id else ""
+        start_filter = ""
+        if started_between:
+            started_from, started_before = started_between
+            start_filter = (
+                f"\n            AND TIMESTAMP_MILLIS(SAFE_CAST(session_start_time_millis AS INT64))"
+                f" >= TIMESTAMP(\"{started_from:%Y-%m-%d %H:%M:%S.%f}\")"
+                f"\n            AND TIMESTAMP_MILLIS(SAFE_CAST(session_start_time_millis AS INT64))"
+                f" < TIMESTAMP(\"{started_before:%Y-%m-%d %H:%M:%S.%f}\")"
+            )
+        return f"""
+        WITH replay_events AS (
+            SELECT
                 amplitude_id,
-                REGEXP_EXTRACT(
-                    TO_JSON_STRING(event_properties),
-                    r'"\[Amplitude\] Session Replay ID":"([^"]+)"'
-                ) AS session_replay_id,
-                REGEXP_EXTRACT(
-                    TO_JSON_STRING(event_properties),
-                    r'"\[Amplitude\] Session Replay ID":"[^/]+/(\d+)"'
-                ) AS session_start_time_millis,
-                SAFE_CAST(REGEXP_EXTRACT(
-                    TO_JSON_STRING(event_properties),
-                    r'"\[Amplitude\] Session Replay ID":"[^/]+/\d+/(\d+)"'
-                ) AS INT64) AS session_duration_ms,
+                JSON_VALUE(event_properties, '$."[Amplitude] Session Replay ID"') AS session_replay_id,
                 event_time
             FROM {self.full_table_name}
-            WHERE 
-                TIMESTAMP_TRUNC(event_time, DAY) >= TIMESTAMP("{start_date}")
-                AND TIMESTAMP_TRUNC(event_time, DAY) <= TIMESTAMP("{end_date}")
-                AND TO_JSON_STRING(event_properties) LIKE '%Session Replay ID%'
+            WHERE
+                event_time >= TIMESTAMP("{start_time:%Y-%m-%d %H:%M:%S.%f}")
+                AND event_time < TIMESTAMP("{end_time:%Y-%m-%d %H:%M:%S.%f}"){amplitude_filter}
         ),
 
         session_stats AS (
-            SELECT 
+            SELECT
                 amplitude_id,
                 session_replay_id,
-                session_start_time_millis,
-                session_duration_ms,
+                COUNT(*) AS events_count,
+                MIN(event_time) AS first_event,
+                MAX(event_time) AS last_event
+            FROM replay_events
+            WHERE session_replay_id IS NOT NULL AND session_replay_id != ''
+            GROUP BY amplitude_id, session_replay_id
+        ),
+
+        parsed_sessions AS (
+            SELECT
+                *,
+                -- ID вида <device>/<start_millis>[/<duration_ms>]
+                REGEXP_EXTRACT(session_replay_id, r'^[^/]+/(\\d+)') AS session_start_time_millis,
                 COALESCE(
-                    session_duration_ms,
-                    CAST((MAX(UNIX_MILLIS(event_time)) - MIN(UNIX_MILLIS(event_time))) AS INT64)
-                ) AS calculated_duration_ms,
-                COUNT(*) as events_count,
-                MIN(event_time) as first_event,
-                MAX(event_time) as last_event
-            FROM session_data
-            WHERE session_replay_id IS NOT NULL 
-                AND session_replay_id != ''
-                AND session_start_time_millis IS NOT NULL
-            GROUP BY amplitude_id, session_replay_id, session_start_time_millis, session_duration_ms
+                    SAFE_CAST(REGEXP_EXTRACT(session_replay_id, r'^[^/]+/\\d+/(\\d+)') AS INT64),
+                    UNIX_MILLIS(last_event) - UNIX_MILLIS(first_event)
+                ) AS calculated_duration_ms
+            FROM session_stats
         )
 
-        SELECT 
+        SELECT
             amplitude_id,
             session_replay_id,
             session_start_time_millis,
-            calculated_duration_ms,
-            ROUND(calculated_duration_ms / 1000.0, 1) as duration_seconds,
+            ROUND(calculated_duration_ms / 1000.0, 1) AS duration_seconds,
             events_count,
-            first_event,
-            last_event,
-            DATE(first_event) as record_date
-        FROM session_stats
-        WHERE calculated_duration_ms >= {min_duration_seconds * 1000}
+            DATE(first_event) AS record_date
+        FROM parsed_sessions
+        WHERE session_start_time_millis IS NOT NULL
+            AND calculated_duration_ms >= {min_duration_seconds * 1000}{start_filter}
         """
 
-        if amplitude_id:
-            query += f"\n    AND amplitude_id = {amplitude_id}"
+    def new_sessions_query(self, sessions_query, check_start_date, check_end_date):
+        """Сессии запроса sessions_query, которых еще нет в таблице ссылок (с record_date в диапазоне проверки)"""
+        return f"""
+        SELECT s.*
+        FROM ({sessions_query}) s
+        WHERE s.amplitude_id IS NOT NULL
+            AND NOT EXISTS (
+                SELECT 1 FROM `{self.output_table_name}` u
+                WHERE u.session_replay_id = s.session_replay_id
+                    AND u.record_date BETWEEN DATE("{check_start_date}") AND DATE("{check_end_date}")
+            )
+        """
 
-        query += """
-        ORDER BY amplitude_id, calculated_duration_ms DESC
+    @staticmethod
+    def _bucket_sql(column, edges):
+        return f"CAST(RANGE_BUCKET({column}, [{', '.join(map(str, edges))}]) AS STRING)" if edges else "'0'"
+
+    def sampled_sessions_query(self, sessions_query, check_start_date, check_end_date):
+        """Стратифицированная выборка новых сессий под дневную квоту этапа скриншотов.
+
+        Все сессии остаются в результате с решением sampling_selected, страта
+        (корзина длительности x корзина числа событий) и весом для перевзвешивания статистик:
+        у выбранной - число сессий страты за день / число выбранных в ней, у остальных 0.
+        1. У каждого пользователя за день выбирается не больше sampling_max_per_user_day сессий
+           (с учетом выбранных прошлыми запусками).
+        2. Остальные распределяются по стратам поровну: по очереди первая из каждой страты,
+           затем вторая и т.д., пока не наберется квота дня за вычетом уже выбранного;
+           мелкие страты отдают остаток квоты крупным.
+        Порядок внутри - FARM_FINGERPRINT(session_replay_id): выборка воспроизводима.
         """
+        cap_condition = f"user_rank <= {self.sampling_max_per_user_day}" if self.sampling_max_per_user_day > 0 else "TRUE"
+        quota_condition = f"day_rank <= {self.sampling_daily_quota} - COALESCE(d.day_selected, 0)" if self.sampling_daily_quota > 0 else "TRUE"
+        return f"""
+        WITH sessions AS ({self.new_sessions_query(sessions_query, check_start_date, check_end_date)}),
 
-        print(f"🔍 Выполняем запрос за период {start_date} - {end_date}")
-        print(f"⏱️ Минимальная длительность сессии: {min_duration_seconds} секунд")
+        already_selected AS (
+            SELECT record_date, amplitude_id, COUNT(*) AS selected
+            FROM `{self.output_table_name}`
+            WHERE record_date BETWEEN DATE("{check_start_date}") AND DATE("{check_end_date}")
+                AND sampling_selected
+            GROUP BY record_date, amplitude_id
+        ),
 
-        try:
-            print("⏳ Выполняем запрос для получения Session Replay ID...")
-            query_job = self.client.query(query)
-            results_list = list(query_job.result())
+        day_selected AS (
+            SELECT record_date, SUM(selected) AS day_selected
+            FROM already_selected
+            GROUP BY record_date
+        ),
 
-            print(f"📊 Получено из BigQuery: {len(results_list)} записей")
+        capped AS (
+            SELECT
+                s.*,
+                CONCAT('d', {self._bucket_sql('s.duration_seconds', self.sampling_duration_edges)},
+                       '_e', {self._bucket_sql('s.events_count', self.sampling_events_edges)}) AS sampling_stratum,
+                COALESCE(a.selected, 0) + ROW_NUMBER() OVER (
+                    PARTITION BY s.record_date, s.amplitude_id ORDER BY FARM_FINGERPRINT(s.session_replay_id)
+                ) AS user_rank
+            FROM sessions s
+            LEFT JOIN already_selected a USING (record_date, amplitude_id)
+        ),
 
-            # Собираем данные
-            data = []
-            for row in results_list:
-                data.append({
-                    'amplitude_id': row.amplitude_id,
-                    'session_replay_id': row.session_replay_id,
-                    'session_start_time_millis': row.session_start_time_millis,
-                    'duration_seconds': row.duration_seconds,
-                    'events_count': row.events_count,
-                    'record_date': row.record_date
-                })
+        stratified AS (
+            SELECT
+                *,
+                COUNT(*) OVER (PARTITION BY record_date, sampling_stratum) AS stratum_sessions,
+                IF({cap_condition}, ROW_NUMBER() OVER (
+                    PARTITION BY record_date, sampling_stratum, {cap_condition}
+                    ORDER BY user_rank, FARM_FINGERPRINT(session_replay_id)
+                ), NULL) AS stratum_rank
+            FROM capped
+        ),
 
-            return pd.DataFrame(data)
+        decided AS (
+            SELECT
+                st.*,
+                COALESCE(st.stratum_rank IS NOT NULL AND {quota_condition}, FALSE) AS sampling_selected
+            FROM (
+                SELECT
+                    *,
+                    IF(stratum_rank IS NULL, NULL, ROW_NUMBER() OVER (
+                        PARTITION BY record_date, stratum_rank IS NULL
+                        ORDER BY stratum_rank, FARM_FINGERPRINT(session_replay_id)
+                    )) AS day_rank
+                FROM stratified
+            ) st
+            LEFT JOIN day_selected d USING (record_date)
+        )
+
+        SELECT
+            * EXCEPT (user_rank, stratum_sessions, stratum_rank, day_rank),
+            IF(sampling_selected, stratum_sessions / COUNTIF(sampling_selected) OVER (
+                PARTITION BY record_date, sampling_stratum
+            ), 0) AS sampling_weight
+        FROM decided
+        """
+
+    def collection_query(self, sessions_query, check_start_date, check_end_date):
+        """Новые сессии для записи: с выборкой (COLLECT_SAMPLING) или все, с NULL в колонках выборки"""
+        if self.sampling_enabled:
+            return self.sampled_sessions_query(sessions_query, check_start_date, check_end_date)
+        return f"""
+        SELECT
+            n.*,
+            CAST(NULL AS BOOL) AS sampling_selected,
+            CAST(NULL AS FLOAT64) AS sampling_weight,
+            CAST(NULL AS STRING) AS sampling_stratum
+        FROM ({self.new_sessions_query(sessions_query, check_start_date, check_end_date)}) n
+        """
+
+    def sampling_report(self):
+        if not self.sampling_enabled:
+            return None
+        return {
+            "max_per_user_day": self.sampling_max_per_user_day,
+            "daily_quota": self.sampling_daily_quota,
+            "duration_edges": self.sampling_duration_edges,
+            "events_edges": self.sampling_events_edges,
+        }
+
+    def get_session_replay_ids_with_duration(self, start_date, end_date, min_duration_seconds=20, amplitude_id=None):
+        """Получение Session Replay ID с фильтрацией по длительности сессии (полные дни start_date..end_date)"""
+        start_time, end_time = self.day_window(start_date, end_date)
+        return self.get_session_replay_ids_between(start_time, end_time, min_duration_seconds, amplitude_id)
+
+    def get_session_replay_ids_between(self, start_time, end_time, min_duration_seconds=20, amplitude_id=None,
+                                       started_between=None, check_range=None):
+        """Session Replay ID по событиям из окна [start_time, end_time).
+
+        check_range=(первая, последняя record_date) при включенной выборке оставляет только новые
+        сессии и добавляет решение выборки (sampling_selected, sampling_weight, sampling_stratum).
+        """
+        query = self.session_replay_query(start_time, end_time, min_duration_seconds, amplitude_id, started_between)
+        if self.sampling_enabled and check_range:
+            self.create_output_table()
+            query = self.collection_query(query, *check_range)
+
+        print(f"🔍 Выполняем запрос за окно {start_time:%Y-%m-%d %H:%M} - {end_time:%Y-%m-%d %H:%M} UTC")
+        print(f"⏱️ Минимальная длительность сессии: {min_duration_seconds} секунд")
+
+        try:
+            print("⏳ Выполняем запрос для получения Session Replay ID...")
+            df = self.reader.query_dataframe(query, description="Сессии Session Replay")
+            print(f"📊 Получено из BigQuery: {len(df)} записей")
+            return df
 
         except Exception as e:
             print(f"❌ Ошибка выполнения запроса: {e}")
             raise
 
-    def format_replay_urls(self, df, project_id="258068",
-                           base_url="https://app.amplitude.com/analytics/rn/session-replay"):
-        """Форматирование DataFrame в ссылки на Session Replay"""
+    def create_state_table(self):
+        """Таблица состояния сборщиков: одна строка на pipeline с отметкой обработанного event_time"""
+        schema = [
+            bigquery.SchemaField("pipeline", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("watermark", "TIMESTAMP", mode="REQUIRED"),
+            bigquery.SchemaField("updated_at", "TIMESTAMP", mode="REQUIRED"),
+        ]
+        try:
+            self.client.get_table(self.state_table_name)
+        except Exception:
+            print(f"📊 Создаем таблицу состояния {self.state_table_name}...")
+            self.client.create_table(bigquery.Table(self.state_table_name, schema=schema), exists_ok=True)
+
+    def get_watermark(self, pipeline='collect_links'):
+        """Отметка последнего просканированного event_time или None (первый запуск)"""
+        self.create_state_table()
+        query = f"SELECT watermark FROM `{self.state_table_name}` WHERE pipeline = @pipeline"
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter("pipeline", "STRING", pipeline)]
+        )
+        for row in self.reader.query(query, job_config, description="Отметка сбора")[1]:
+            return row.watermark
+        return None
 
-        urls_data = []
-        current_time = datetime.now()
+    def save_watermark(self, watermark, pipeline='collect_links'):
+        """Сдвиг отметки (только вперед) после успешной записи ссылок"""
+        query = f"""
+        MERGE `{self.state_table_name}` t
+        USING (SELECT @pipeline AS pipeline, @watermark AS watermark) s
+        ON t.pipeline = s.pipeline
+        WHEN MATCHED THEN
+            UPDATE SET watermark = GREATEST(t.watermark, s.watermark), updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN
+            INSERT (pipeline, watermark, updated_at) VALUES (s.pipeline, s.watermark, CURRENT_TIMESTAMP())
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("pipeline", "STRING", pipeline),
+            bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark),
+        ])
+        self.reader.run(query, job_config, description="Сдвиг отметки")
+        print(f"🔖 Отметка {pipeline}: {watermark:%Y-%m-%d %H:%M:%S} UTC")
+
+    def collection_window(self, days_back, now=None):
+        """Окно сканирования событий: (start_time, end_time, mode).
+
+        incremental - от отметки минус перекрытие до текущего момента;
+        initial - отметки еще нет, последние days_back дней (как раньше).
+        """
+        now = now or datetime.now(timezone.utc)
+        watermark = self.get_watermark()
+        if watermark is None:
+            start_date = now.date() - timedelta(days=days_back)
+            return datetime.combine(start_date, datetime.min.time(), tzinfo=timezone.utc), now, 'initial'
+        return watermark - timedelta(hours=self.overlap_hours), now, 'incremental'
+
+    def fit_window_to_budget(self, start_time, end_time, min_duration_seconds=20, min_hours=1):
+        """Конец окна, при котором запрос сессий помещается в бюджет BigQuery (оценка dry run).
+
+        Окно сокращается вдвое (не короче min_hours); отметка сдвинется только до нового конца,
+        остаток окна доберут следующие запуски. Если не помещается даже минимальное окно -
+        BudgetExceededError при самом запросе.
+        """
+        while end_time - start_time > timedelta(hours=min_hours) and not self.reader.fits_budget(
+                self.session_replay_query(start_time, end_time, min_duration_seconds)):
+            end_time = max(start_time + (end_time - start_time) / 2, start_time + timedelta(hours=min_hours))
+            print(f"⬇️ Окно не помещается в бюджет, сокращаем до {end_time:%Y-%m-%d %H:%M} UTC")
+        return end_time
 
-        print(f"🔗 Форматируем {len(df)} записей в URL...")
+    def format_replay_urls(self, df, project_id="258068", base_url=REPLAY_BASE_URL):
+        """Форматирование DataFrame сессий в записи session_replay_urls (колоночно, типы по URL_TABLE_SCHEMA).
 
-        for index, row in df.iterrows():
-            try:
-                amplitude_id = row['amplitude_id']
-                session_replay_id = row['session_replay_id']
-                session_start_time = row['session_start_time_millis']
-
-                # Формируем URL
-                url = (
-                    f"{base_url}/project/{project_id}/"
-                    f"search/amplitude_id%3D{amplitude_id}?"
-                    f"sessionReplayId={session_replay_id}&"
-                    f"sessionStartTime={session_start_time}"
-                )
-
-                # Подготавливаем запись для BigQuery
-                url_record = {
-                    'record_date': row['record_date'].strftime('%Y-%m-%d'),
-                    'session_replay_url': url,
-                    'collection_datetime': current_time.isoformat(),
-                    'is_processed': False,
-                    'amplitude_id': int(amplitude_id),
-                    'session_replay_id': session_replay_id,
-                    'duration_seconds': float(row['duration_seconds']),
-                    'events_count': int(row['events_count']),
-                    'processed_datetime': None,
-                    'screenshots_count': None,
-                    'drive_folder_id': None
-                }
-
-                urls_data.append(url_record)
-
-            except Exception as e:
-                print(f"⚠️ Ошибка форматирования URL для строки {index}: {e}")
-                continue
-
-        print(f"✅ Успешно сформировано {len(urls_data)} записей")
-        return urls_data
-
-    def filter_new_data(self, urls_data, start_date, end_date):
+        Строки без amplitude_id, session_replay_id, времени начала, числа событий или даты
+        пропускаются (раньше на них падало построчное форматирование).
+        """
+        print(f"🔗 Форматируем {len(df)} записей в URL...")
+        amplitude_id = pd.to_numeric(df['amplitude_id'], errors='coerce')
+        events_count = pd.to_numeric(df['events_count'], errors='coerce')
+        record_date = pd.to_datetime(df['record_date'], errors='coerce')
+        valid = (amplitude_id.notna() & events_count.notna() & record_date.notna()
+                 & df['session_replay_id'].notna() & df['session_start_time_millis'].notna())
+        skipped = int((~valid).sum())
+        if skipped:
+            print(f"⚠️ Пропущено {skipped} строк с неполными данными сессии")
+
+        rows = df[valid]
+        amplitude_id = amplitude_id[valid].astype('int64')
+        session_replay_id = rows['session_replay_id'].astype(str)
+        urls = pd.DataFrame({
+            'record_date': record_date[valid].dt.date,
+            'session_replay_url': (
+                f"{base_url}/project/{project_id}/search/amplitude_id%3D" + amplitude_id.astype(str)
+                + "?sessionReplayId=" + session_replay_id
+                + "&sessionStartTime=" + rows['session_start_time_millis'].astype(str)
+            ),
+            'collection_datetime': pd.Timestamp.now(tz='UTC'),
+            'is_processed': False,
+            'amplitude_id': amplitude_id,
+            'session_replay_id': session_replay_id,
+            'duration_seconds': pd.to_numeric(rows['duration_seconds'], errors='coerce').astype('float64'),
+            'events_count': events_count[valid].astype('int64'),
+            'processed_datetime': pd.Series(pd.NaT, index=rows.index, dtype='datetime64[ns, UTC]'),
+            'screenshots_count': pd.Series(pd.NA, index=rows.index, dtype='Int64'),
+            'drive_folder_id': pd.Series(pd.NA, index=rows.index, dtype='string'),
+            'sampling_selected': self._sampling_column(rows, 'sampling_selected', 'boolean'),
+            'sampling_weight': self._sampling_column(rows, 'sampling_weight', 'Float64'),
+            'sampling_stratum': self._sampling_column(rows, 'sampling_stratum', 'string'),
+        }, columns=URL_TABLE_COLUMNS).reset_index(drop=True)
+
+        print(f"✅ Успешно сформировано {len(urls)} записей")
+        return urls
+
+    @staticmethod
+    def _sampling_column(rows, column, dtype):
+        """Колонка выборки из результата запроса; без выборки - NULL"""
+        if column in rows:
+            return rows[column].astype(dtype)
+        return pd.Series(pd.NA, index=rows.index, dtype=dtype)
+
+    def filter_new_data(self, urls_df, start_date, end_date):
         """Фильтрация данных - оставляем только новые session_replay_id"""
-        if not urls_data:
-            return urls_data
+        if urls_df.empty:
+            return urls_df
 
-        original_count = len(urls_data)
-        
         try:
             # Получаем все существующие session_replay_id за период
             check_query = f"""
@@ -289,90 +521,209 @@ class BigQueryReplayCollector:
             FROM `{self.output_table_name}`
             WHERE record_date BETWEEN '{start_date}' AND '{end_date}'
             """
-            
-            result = self.client.query(check_query).result()
-            existing_session_ids = {row.session_replay_id for row in result}
-            
-            print(f"📋 Найдено {len(existing_session_ids)} существующих session_replay_id за период")
-            
+            existing = self.reader.query_dataframe(check_query, description="Уже собранные сессии")['session_replay_id']
+            print(f"📋 Найдено {len(existing)} существующих session_replay_id за период")
         except Exception as e:
             print(f"⚠️ Не удалось проверить существующие session_replay_id: {e}")
-            existing_session_ids = set()
-
-        # Фильтруем по session_replay_id
-        filtered_data = []
-        for record in urls_data:
-            session_replay_id = record['session_replay_id']
-            
-            if session_replay_id not in existing_session_ids:
-                filtered_data.append(record)
-
-        filtered_count = len(filtered_data)
-        skipped_count = original_count - filtered_count
+            return urls_df
 
+        filtered = urls_df[~urls_df['session_replay_id'].isin(existing)].reset_index(drop=True)
+        skipped_count = len(urls_df) - len(filtered)
         if skipped_count > 0:
             print(f"🔄 Отфильтровано {skipped_count} записей (session_replay_id уже существуют)")
-            print(f"✅ Осталось {filtered_count} новых записей для загрузки")
+            print(f"✅ Осталось {len(filtered)} новых записей для загрузки")
+        return filtered
 
-        return filtered_data
+    def save_urls_to_bigquery(self, urls_df, start_date, end_date):
+        """Сохранение записей в BigQuery: Parquet из памяти с явной схемой (без временного CSV).
 
-    def save_urls_to_bigquery(self, urls_data, start_date, end_date):
-        """Сохранение URL в BigQuery таблицу через batch load (CSV)"""
-        if not urls_data:
+        Возвращает число загруженных строк (output_rows задания загрузки).
+        """
+        self.last_sampled_rows = 0
+        if urls_df.empty:
             print("⚠️ Нет данных для сохранения")
-            return
+            return 0
 
         try:
             # Создаем таблицу если не существует
             self.create_output_table()
 
             # Фильтруем данные - оставляем только новые session_replay_id
-            urls_data = self.filter_new_data(urls_data, start_date, end_date)
+            urls_df = self.filter_new_data(urls_df, start_date, end_date)
 
-            if not urls_data:
+            if urls_df.empty:
                 print("ℹ️ Все session_replay_id за этот период уже существуют в таблице")
-                return
+                return 0
 
-            print(f"💾 Сохраняем {len(urls_data)} записей в BigQuery...")
+            print(f"💾 Сохраняем {len(urls_df)} записей в BigQuery...")
+            job_config = bigquery.LoadJobConfig(
+                schema=URL_TABLE_SCHEMA,
+                source_format=bigquery.SourceFormat.PARQUET,
+                write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            )
+            job = self.client.load_table_from_dataframe(urls_df[URL_TABLE_COLUMNS], self.output_table_name,
+                                                        job_config=job_config)
+            print("⏳ Загружаем данные в BigQuery...")
+            job.result()
 
-            # Создаем DataFrame
-            df = pd.DataFrame(urls_data)
+            loaded = job.output_rows if job.output_rows is not None else len(urls_df)
+            self.last_sampled_rows = int(urls_df['sampling_selected'].fillna(True).sum()) if loaded else 0
+            print(f"✅ Успешно загружено {loaded} записей в BigQuery")
+            return loaded
 
-            # Сохраняем во временный CSV файл
-            with tempfile.NamedTemporaryFile(mode='w', suffix=".csv", delete=False) as temp_file:
-                df.to_csv(temp_file.name, index=False, header=False)
-                temp_file_path = temp_file.name
+        except Exception as e:
+            print(f"❌ Ошибка сохранения в BigQuery: {e}")
+            raise
 
-            try:
-                # Настройка загрузки
-                table_ref = self.client.dataset(self.output_dataset_id).table(self.output_table_id)
-                job_config = bigquery.LoadJobConfig()
-                job_config.write_disposition = bigquery.WriteDisposition.WRITE_APPEND
-                job_config.source_format = bigquery.SourceFormat.CSV
-                job_config.autodetect = False
+    def insert_new_sessions(self, start_time, end_time, check_start_date, check_end_date,
+                            min_duration_seconds=20, project_id="258068", base_url=REPLAY_BASE_URL,
+                            started_between=None):
+        """Серверный сбор одним запросом: INSERT ... SELECT ... WHERE NOT EXISTS.
 
-                # Загружаем файл в BigQuery
-                with open(temp_file_path, "rb") as source_file:
-                    job = self.client.load_table_from_file(source_file, table_ref, job_config=job_config)
+        URL собираются в SQL так же, как в format_replay_urls, session_replay_id, уже
+        записанные с record_date в [check_start_date, check_end_date], пропускаются;
+        при включенной выборке с решением выборки записываются все новые сессии.
+        Данные сессий не покидают BigQuery; возвращается только число вставленных строк.
+        """
+        self.create_output_table()
+        sessions_query = self.session_replay_query(start_time, end_time, min_duration_seconds,
+                                                   started_between=started_between)
+        query = f"""
+        INSERT INTO `{self.output_table_name}` (
+            record_date, session_replay_url, collection_datetime, is_processed,
+            amplitude_id, session_replay_id, duration_seconds, events_count,
+            sampling_selected, sampling_weight, sampling_stratum
+        )
+        SELECT
+            s.record_date,
+            CONCAT(
+                @base_url, '/project/', @project_id, '/search/amplitude_id%3D', CAST(s.amplitude_id AS STRING),
+                '?sessionReplayId=', s.session_replay_id, '&sessionStartTime=', s.session_start_time_millis
+            ),
+            CURRENT_TIMESTAMP(),
+            FALSE,
+            s.amplitude_id,
+            s.session_replay_id,
+            s.duration_seconds,
+            s.events_count,
+            s.sampling_selected,
+            s.sampling_weight,
+            s.sampling_stratum
+        FROM ({self.collection_query(sessions_query, check_start_date, check_end_date)}) s
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("base_url", "STRING", base_url),
+            bigquery.ScalarQueryParameter("project_id", "STRING", str(project_id)),
+        ])
+        print("⏳ Собираем и вставляем новые сессии на стороне BigQuery...")
+        job = self.reader.run(query, job_config, description="INSERT новых сессий")
+        inserted = job.num_dml_affected_rows or 0
+        print(f"✅ Вставлено {inserted} новых записей")
+        return inserted
+
+    @staticmethod
+    def backfill_shards(date_from, date_to, shard_days=1):
+        """Разбиение дней date_from..date_to (включительно) на шарды по shard_days дней: [(первый, последний)]"""
+        first = datetime.strptime(str(date_from), '%Y-%m-%d').date()
+        last = datetime.strptime(str(date_to), '%Y-%m-%d').date()
+        shards = []
+        while first <= last:
+            shard_last = min(first + timedelta(days=shard_days - 1), last)
+            shards.append((first, shard_last))
+            first = shard_last + timedelta(days=1)
+        return shards
+
+    @staticmethod
+    def backfill_shard_key(shard):
+        return f"{BACKFILL_STATE_PREFIX}{shard[0]}_{shard[1]}"
+
+    def completed_backfill_shards(self):
+        """Ключи шардов, уже записанных прошлыми (в том числе прерванными) бэкфиллами"""
+        self.create_state_table()
+        query = f"SELECT pipeline FROM `{self.state_table_name}` WHERE STARTS_WITH(pipeline, @prefix)"
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter("prefix", "STRING", BACKFILL_STATE_PREFIX)]
+        )
+        return {row.pipeline for row in self.reader.query(query, job_config, description="Готовые шарды")[1]}
 
-                # Ждем завершения загрузки
-                print("⏳ Загружаем данные в BigQuery...")
-                job.result()
+    def collect_shard(self, shard, insert_mode='server', min_duration_seconds=20, project_id="258068"):
+        """Сбор одного шарда дней: сессии, начавшиеся в шарде, сразу записываются в таблицу ссылок.
 
-                print(f"✅ Успешно загружено {len(urls_data)} записей в BigQuery")
+        События сканируются с запасом overlap_hours после конца шарда, чтобы сессии,
+        перешедшие через границу, попали целиком. Возвращает число вставленных строк.
+        """
+        start_time, end_time = self.day_window(shard[0], shard[1])
+        scan_end = min(end_time + timedelta(hours=self.overlap_hours), datetime.now(timezone.utc))
+        check_start, check_end = shard[0] - timedelta(days=1), shard[1] + timedelta(days=1)
+        if insert_mode == 'server':
+            return self.insert_new_sessions(start_time, scan_end, check_start, check_end, min_duration_seconds,
+                                            project_id, started_between=(start_time, end_time))
+        df = self.get_session_replay_ids_between(start_time, scan_end, min_duration_seconds,
+                                                 started_between=(start_time, end_time),
+                                                 check_range=(check_start, check_end))
+        if df.empty:
+            return 0
+        return self.save_urls_to_bigquery(self.format_replay_urls(df, project_id=project_id),
+                                          check_start.strftime('%Y-%m-%d'), check_end.strftime('%Y-%m-%d'))
 
-            finally:
-                # Удаляем временный файл
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
+    def backfill(self, date_from, date_to, shard_days=1, max_workers=4, insert_mode='server',
+                 min_duration_seconds=20, project_id="258068"):
+        """Параллельный бэкфилл периода по шардам дней (параллельные задания BigQuery).
 
-        except Exception as e:
-            print(f"❌ Ошибка сохранения в BigQuery: {e}")
-            raise
+        Каждый шард записывается в таблицу ссылок сразу по готовности и отмечается
+        в таблице состояния; повторный запуск того же периода пропускает отмеченные шарды.
+        Отметка инкрементального сбора не меняется.
+        """
+        shards = self.backfill_shards(date_from, date_to, shard_days)
+        completed = self.completed_backfill_shards()
+        pending = [shard for shard in shards if self.backfill_shard_key(shard) not in completed]
+        print(f"🧩 Бэкфилл {date_from} - {date_to}: шардов {len(shards)} по {shard_days} дн., "
+              f"уже готово {len(shards) - len(pending)}, параллельно до {max_workers}")
+        self.create_output_table()
+
+        inserted_total = 0
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            futures = {
+                pool.submit(self.collect_shard, shard, insert_mode, min_duration_seconds, project_id): shard
+                for shard in pending
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                shard = futures[future]
+                try:
+                    inserted = future.result()
+                    self.save_watermark(self.day_window(shard[0], shard[1])[1], pipeline=self.backfill_shard_key(shard))
+                    inserted_total += inserted
+                    print(f"✅ [{done}/{len(pending)}] Шард {shard[0]} - {shard[1]}: вставлено {inserted}")
+                except Exception as e:
+                    failed.append({"shard": f"{shard[0]} - {shard[1]}", "error": str(e)})
+                    print(f"❌ [{done}/{len(pending)}] Шард {shard[0]} - {shard[1]}: {e}")
+
+        return {
+            "status": "success" if not failed else "partial",
+            "mode": "backfill",
+            "insert_mode": insert_mode,
+            "period": f"{date_from} - {date_to}",
+            "shards_total": len(shards),
+            "shards_skipped": len(shards) - len(pending),
+            "shards_completed": len(pending) - len(failed),
+            "shards_failed": failed,
+            "collected_urls": inserted_total,
+            "sampling": self.sampling_report(),
+            "table": self.output_table_name,
+            **self.reader.cost_report(),
+        }
 
 
-def main():
-    """Основная функция"""
+def main(backfill_from=None, backfill_to=None):
+    """Основная функция.
+
+    По умолчанию сбор инкрементальный: сканируются только события после сохраненной отметки
+    (с перекрытием COLLECT_OVERLAP_HOURS). backfill_from/backfill_to (YYYY-MM-DD, также
+    COLLECT_BACKFILL_FROM/COLLECT_BACKFILL_TO) - ручной пересбор указанных дней без сдвига отметки:
+    период делится на шарды по COLLECT_BACKFILL_SHARD_DAYS дней, до COLLECT_BACKFILL_WORKERS
+    шардов выполняются параллельно, выполненные шарды пропускаются при повторном запуске.
+    """
     print("🚀 ЗАПУСК СБОРЩИКА SESSION REPLAY ID")
     print("=" * 50)
 
@@ -384,7 +735,9 @@ def main():
         'table_id': settings.BQ_TABLE_EVENTS,
         'output_dataset_id': settings.BQ_DATASET_ID,
         'amplitude_project_id': settings.AMPLITUDE_PROJECT_ID,
-        'min_duration_seconds': settings.MIN_DURATION_SECONDS
+        'min_duration_seconds': settings.MIN_DURATION_SECONDS,
+        # server - сбор, дедупликация и вставка одним запросом в BigQuery; client - через pandas и Parquet загрузку
+        'insert_mode': os.environ.get('COLLECT_INSERT_MODE', 'server')
     }
 
     # Валидация настроек
@@ -398,13 +751,10 @@ def main():
         print(f"❌ Credentials файл не найден: {CONFIG['credentials_path']}")
         return {"status": "error", "error": "Credentials file not found"}
 
-    days_back = settings.DAYS_BACK
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=days_back)
-
-    print(f"📅 Период сбора: {start_date} - {end_date}")
-    print(f"⏱️ Минимальная длительность: {CONFIG['min_duration_seconds']} секунд")
+    backfill_from = backfill_from or os.environ.get('COLLECT_BACKFILL_FROM') or None
+    backfill_to = backfill_to or os.environ.get('COLLECT_BACKFILL_TO') or None
 
+    collector = None
     try:
         collector = BigQueryReplayCollector(
             credentials_path=CONFIG['credentials_path'],
@@ -418,42 +768,98 @@ def main():
             print("❌ Тест подключения не прошел. Завершаем работу.")
             return {"status": "error", "error": "BigQuery connection failed"}
 
+        if backfill_from:
+            return collector.backfill(
+                backfill_from, backfill_to or backfill_from,
+                shard_days=int(os.environ.get('COLLECT_BACKFILL_SHARD_DAYS', '1')),
+                max_workers=int(os.environ.get('COLLECT_BACKFILL_WORKERS', '4')),
+                insert_mode=CONFIG['insert_mode'],
+                min_duration_seconds=CONFIG['min_duration_seconds'],
+                project_id=CONFIG['amplitude_project_id']
+            )
+
+        start_time, end_time, mode = collector.collection_window(settings.DAYS_BACK)
+        end_time = collector.fit_window_to_budget(start_time, end_time, CONFIG['min_duration_seconds'])
+        # Уже собранные сессии проверяются с запасом в день: сессия, начавшаяся до окна,
+        # могла быть записана с более ранней record_date
+        start_date = (start_time - timedelta(days=1)).date()
+        end_date = end_time.date()
+        period = f"{start_time:%Y-%m-%d %H:%M} - {end_time:%Y-%m-%d %H:%M} UTC"
+
+        print(f"📅 Окно сбора ({mode}): {period}")
+        print(f"⏱️ Минимальная длительность: {CONFIG['min_duration_seconds']} секунд")
+        if collector.sampling_enabled:
+            print(f"🎯 Выборка: до {collector.sampling_max_per_user_day} сессий на пользователя в день, "
+                  f"квота дня {collector.sampling_daily_quota or 'без ограничения'}")
+
+        if CONFIG['insert_mode'] == 'server':
+            inserted = collector.insert_new_sessions(
+                start_time, end_time, start_date, end_date,
+                min_duration_seconds=CONFIG['min_duration_seconds'],
+                project_id=CONFIG['amplitude_project_id']
+            )
+            collector.save_watermark(end_time)
+            return {
+                "status": "success",
+                "collected_urls": inserted,
+                "mode": mode,
+                "insert_mode": "server",
+                "period": period,
+                "sampling": collector.sampling_report(),
+                "table": collector.output_table_name,
+                "message": f"Successfully collected {inserted} Session Replay URLs",
+                **collector.reader.cost_report()
+            }
+
         print(f"🔍 Собираем Session Replay ID...")
-        df = collector.get_session_replay_ids_with_duration(
-            start_date=start_date.strftime('%Y-%m-%d'),
-            end_date=end_date.strftime('%Y-%m-%d'),
-            min_duration_seconds=CONFIG['min_duration_seconds']
+        df = collector.get_session_replay_ids_between(
+            start_time, end_time,
+            min_duration_seconds=CONFIG['min_duration_seconds'],
+            check_range=(start_date, end_date)
         )
 
         if df.empty:
             print(f"⚠️ Не найдено ни одной сессии")
-            return {"status": "success", "collected_urls": 0, "message": "No sessions found"}
+            collector.save_watermark(end_time)
+            return {"status": "success", "collected_urls": 0, "mode": mode, "period": period,
+                    "message": "No sessions found", **collector.reader.cost_report()}
 
         print(f"🔗 Форматируем URL...")
-        urls_data = collector.format_replay_urls(
+        urls_df = collector.format_replay_urls(
             df,
             project_id=CONFIG['amplitude_project_id']
         )
 
-        if not urls_data:
+        if urls_df.empty:
             print("❌ Не удалось сформировать ни одного URL")
             return {"status": "error", "error": "Failed to format URLs"}
 
-        collector.save_urls_to_bigquery(urls_data, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        inserted = collector.save_urls_to_bigquery(urls_df, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        collector.save_watermark(end_time)
 
         print(f"\n🎉 ГОТОВО!")
-        print(f"✅ Собрано и сохранено {len(urls_data)} Session Replay URL")
+        print(f"✅ Сформировано {len(urls_df)} Session Replay URL, новых сохранено: {inserted}")
         print(f"💾 Таблица: {CONFIG['project_id']}.{CONFIG['output_dataset_id']}.session_replay_urls")
 
         # Возвращаем результат для API
         return {
             "status": "success",
-            "collected_urls": len(urls_data),
-            "period": f"{start_date} - {end_date}",
+            "collected_urls": inserted,
+            "formatted_urls": len(urls_df),
+            "mode": mode,
+            "insert_mode": "client",
+            "period": period,
+            "sampling": collector.sampling_report(),
+            "sampled_urls": collector.last_sampled_rows,
             "table": f"{CONFIG['project_id']}.{CONFIG['output_dataset_id']}.session_replay_urls",
-            "message": f"Successfully collected {len(urls_data)} Session Replay URLs"
+            "message": f"Successfully collected {inserted} Session Replay URLs",
+            **collector.reader.cost_report()
         }
 
+    except BudgetExceededError as e:
+        print(f"💸 Бюджет BigQuery исчерпан: {e}")
+        return {"status": "budget_exceeded", "error": str(e), **collector.reader.cost_report()}
+
     except Exception as e:
         print(f"❌ Ошибка: {e}")
         import traceback
@@ -468,5 +874,9 @@ def main():
 
 
 if __name__ == "__main__":
-    result = main()
+    # python scripts/collect_links.py backfill 2025-01-01 [2025-01-07] - пересбор дней без сдвига отметки
+    if len(sys.argv) > 2 and sys.argv[1] == 'backfill':
+        result = main(backfill_from=sys.argv[2], backfill_to=sys.argv[3] if len(sys.argv) > 3 else None)
+    else:
+        result = main()
     print(f"\n📋 Итоговый результат: {result}")
\ No newline at end of file
@@ -1,5 +1,4 @@
 import io
-import re
 import zipfile
 import pytesseract
 from PIL import Image
@@ -8,10 +7,10 @@ from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 import pandas as pd
-import pandas_gbq
 from datetime import datetime
 import os
 import sys
+import time
 from typing import Callable, Optional
 
 # Добавляем путь к корню проекта для импорта config
@@ -28,190 +27,63 @@ except ImportError:
         BQ_TARGET_TABLE = os.environ.get('BQ_TARGET_TABLE', 'replay_text_complete')
     settings = MockSettings()
 
-
-def clean_summary(text):
-    """Очищает summary от технического мусора"""
-    if pd.isna(text) or text == 'null' or not text:
-        return ''
-
-    lines = text.split('\n')
-    clean_lines = []
-    found_content = False
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        technical_patterns = [
-            r'^[A-Za-z0-9]{6,20}$', r'^[0-9,.\s<an>]+$', r'^[0-9]+\.$',
-            r'Session Length', r'Device Type', r'Event Total', r'Amplitude AI',
-            r'ReplaySummary', r'Events \+\}', r'Powered by',
-            r'^[0-9]+[hms]\s*[0-9]*\s*(Android|iOS|Windows|Apple iPhone)$',
-            r'^[0-9]+\s+(Russia|France|Spain|Germany)', r'^\d+[hms]\s+\d+$',
-            r'^.*Russia.*<[an]$', r'^.*Android$', r'^.*Windows$', r'^.*Apple iPhone$',
-            r'^Summary\s*$', r'^[A-Z]{2,5}\s*$', r'^\d{1,3}$', r'^[*%+\}\s]+$',
-            r'^Recent\s*v\s*Favorites', r'^Q\s*Search',
-        ]
-
-        is_technical = any(re.search(pattern, line, re.IGNORECASE) for pattern in technical_patterns)
-
-        if not is_technical:
-            if len(line) > 20 and re.search(r'[a-zA-Z].*[a-zA-Z]', line):
-                found_content = True
-                clean_lines.append(line)
-            elif found_content:
-                clean_lines.append(line)
-
-    if not clean_lines:
-        return ''
-
-    content = ' '.join(clean_lines)
-    highlights_match = re.search(r'(.+?)(?:\n\s*Highlights|\s+Highlights)', content, re.DOTALL)
-    if highlights_match:
-        clean_text = highlights_match.group(1).strip()
-    else:
-        clean_text = content.strip()
-
-    artifacts_to_remove = [r'\s*\*%\s*$', r'\s*\+\}\s*$', r'\s*GJ!\s*$', r'\s*iG!\s*$', 
-                          r'\s*AT\s*$', r'\s*AC\s*$', r'\s*NS\s*$', r'\s*[*%+\}]{1,3}\s*$']
-    
-    for pattern in artifacts_to_remove:
-        clean_text = re.sub(pattern, '', clean_text)
-
-    clean_text = re.sub(r'\s+', ' ', clean_text)
-    return clean_text.strip() if clean_text.strip() else ''
-
-
-def clean_sentiment(text):
-    """Очищает sentiment от технического мусора"""
-    if pd.isna(text) or text == 'null' or not text:
-        return ''
-
-    text = re.sub(r'^\s*Sentiment\s*\n*', '', text, flags=re.IGNORECASE)
-    lines = text.split('\n')
-    clean_lines = []
-    found_content = False
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        technical_patterns = [r'^[A-Za-z0-9]{6,20}$', r'^Sentiment\s*$', r'^[A-Z]{2,5}\s*$', 
-                            r'^\d{1,3}$', r'^[*%+\}\s]+$']
-        is_technical = any(re.search(pattern, line, re.IGNORECASE) for pattern in technical_patterns)
-
-        if not is_technical:
-            if (len(line) > 15 and 
-                re.search(r'(user|demonstrated|appeared|showed|felt|experienced)', line, re.IGNORECASE)):
-                found_content = True
-                clean_lines.append(line)
-            elif found_content and len(line) > 10:
-                clean_lines.append(line)
-
-    if clean_lines:
-        content = ' '.join(clean_lines)
-    else:
-        content = text.strip()
-
-    for pattern in [r'\s*\*%\s*$', r'\s*\+\}\s*$', r'\s*[*%+\}]{1,3}\s*$']:
-        content = re.sub(pattern, '', content)
-    
-    content = re.sub(r'\s+', ' ', content)
-    return content.strip()
-
-
-def clean_actions(text):
-    """Очищает actions от технического мусора"""
-    if pd.isna(text) or text == 'null' or not text:
-        return ''
-
-    text = re.sub(r'^\s*(?:Actions?|ActIONS?|AC)\s*\n*', '', text, flags=re.IGNORECASE)
-    lines = text.split('\n')
-    action_lines = []
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        technical_patterns = [r'^[A-Za-z0-9]{6,20}$', r'^Actions?\s*$', r'^ActIONS?\s*$', 
-                            r'^AC\s*$', r'^[A-Z]{2,5}\s*$', r'^\d{1,3}$', r'^[*%+\}\s]+$',
-                            r'^Recent\s*v\s*Favorites', r'^Q\s*Search']
-        is_technical = any(re.search(pattern, line, re.IGNORECASE) for pattern in technical_patterns)
-
-        if not is_technical:
-            if (line.startswith(('-', '+', '•')) or 
-                len(line) > 15 and
-                re.search(r'(consider|provide|add|improve|investigate|enhance|create|implement)', line, re.IGNORECASE)):
-                action_lines.append(line)
-
-    if action_lines:
-        content = '\n'.join(action_lines)
-    else:
-        content = text.strip()
-        for pattern in [r'^Recent.*?\n', r'^Q\s*Search.*?\n']:
-            content = re.sub(pattern, '', content, flags=re.MULTILINE)
-
-    for pattern in [r'\s*\*%\s*$', r'\s*\+\}\s*$', r'\s*[*%+\}]{1,3}\s*$']:
-        content = re.sub(pattern, '', content)
-
-    content = re.sub(r'[ \t]+', ' ', content)
-    content = re.sub(r'\n\s*\n', '\n', content)
-    return content.strip()
-
-
-def parse_userinfo_text(text):
-    """Парсинг userinfo из текста"""
-    res = {'user_id': '', 'country': '', 'session_length': '', 'event_total': '', 'device_type': ''}
-    
-    # Парсинг user_id
-    user_id_patterns = [r'\b([A-Z]{2}[0-9]{6})\b', r'\b([A-Z]{2,3}[0-9]{5,7})\b', 
-                       r'\b([A-Z]{4}[0-9]{4,8})\b', r'\b([0-9]{10,15})\b', r'\b([A-Z]+[0-9]+)\b']
-    for pattern in user_id_patterns:
-        matches = re.findall(pattern, text, re.MULTILINE)
-        valid_matches = [m for m in matches if m.lower() not in ['android', 'session', 'length', 'total', 'event', 'device']]
-        if valid_matches:
-            res['user_id'] = valid_matches[0]
-            break
-    
-    # Парсинг country
-    country_patterns = {
-        'Spain': ['spain', 'españa'], 'Costa Rica': ['costa rica', 'costa'],
-        'Russia': ['russia', 'russian', 'рф'], 'Peru': ['peru', 'perú'],
-        'Bolivia': ['bolivia'], 'Ecuador': ['ecuador'], 'Netherlands': ['netherlands', 'holland'],
-        'Germany': ['germany', 'deutschland'], 'France': ['france', 'francia']
-    }
-    combined_lower = text.lower()
-    for country, patterns in country_patterns.items():
-        for pattern in patterns:
-            if pattern in combined_lower:
-                res['country'] = country
-                break
-        if res['country']:
-            break
-    
-    # Парсинг session_length
-    for pattern in [r'(\d+h\s*\d+m)', r'(\d+m\s*\d+s)', r'(\d+h)', r'(\d+m)', r'(\d+s)']:
-        match = re.search(pattern, text)
-        if match:
-            res['session_length'] = match.group(1)
-            break
-    
-    # Парсинг event_total
-    event_match = re.search(r'(?:event\s*total|total)\s*:?\s*(\d+)', text, re.IGNORECASE)
-    if event_match:
-        res['event_total'] = event_match.group(1)
-    
-    # Парсинг device_type
-    devices = ['android', 'iphone', 'ios', 'windows', 'mac', 'linux']
-    for device in devices:
-        if device in combined_lower:
-            res['device_type'] = device.capitalize()
-            break
-    
-    return res
+from scripts.archive_cache import ArchiveCache
+from scripts.bq_io import PARTITION_COLUMN, BigQueryReader, format_bytes, make_storage_client
+from scripts.ocr_cache import OCRResultCache
+from scripts.range_reader import RangeReader, drive_range_fetcher
+from scripts.text_cleaning import (
+    clean_summary, clean_sentiment, clean_actions, parse_userinfo_text,
+    clean_series, parse_userinfo_series
+)
+
+# Колонки результата OCR в replay_text_complete
+OCR_RESULT_COLUMNS = [
+    'session_id', 'amplitude_id', 'session_replay_url', 'duration_seconds',
+    'events_count', 'record_date', 'user_id', 'country', 'session_length',
+    'event_total', 'device_type', 'summary', 'sentiment', 'actions'
+]
+
+# Сырой текст Tesseract по блокам: позволяет перечистить данные без повторного OCR
+RAW_TEXT_COLUMNS = ['raw_userinfo', 'raw_summary', 'raw_sentiment', 'raw_actions']
+RAW_TEXT_SCHEMA = [
+    bigquery.SchemaField("session_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("raw_userinfo", "STRING"),
+    bigquery.SchemaField("raw_summary", "STRING"),
+    bigquery.SchemaField("raw_sentiment", "STRING"),
+    bigquery.SchemaField("raw_actions", "STRING"),
+    bigquery.SchemaField("ocr_datetime", "TIMESTAMP"),
+]
+
+# Временная таблица перечистки: session_id и очищенные поля с типами replay_text_complete
+RECLEAN_COLUMNS = ['session_id', 'user_id', 'country', 'session_length', 'event_total', 'device_type',
+                   'summary', 'sentiment', 'actions']
+
+# Staging: результат OCR + сырой текст + статус обработки для session_replay_urls + время записи
+STAGING_SCHEMA = [
+    bigquery.SchemaField("session_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("amplitude_id", "INTEGER"),
+    bigquery.SchemaField("session_replay_url", "STRING"),
+    bigquery.SchemaField("duration_seconds", "FLOAT"),
+    bigquery.SchemaField("events_count", "INTEGER"),
+    bigquery.SchemaField("record_date", "STRING"),
+    bigquery.SchemaField("user_id", "STRING"),
+    bigquery.SchemaField("country", "STRING"),
+    bigquery.SchemaField("session_length", "STRING"),
+    bigquery.SchemaField("event_total", "STRING"),
+    bigquery.SchemaField("device_type", "STRING"),
+    bigquery.SchemaField("summary", "STRING"),
+    bigquery.SchemaField("sentiment", "STRING"),
+    bigquery.SchemaField("actions", "STRING"),
+    bigquery.SchemaField("raw_userinfo", "STRING"),
+    bigquery.SchemaField("raw_summary", "STRING"),
+    bigquery.SchemaField("raw_sentiment", "STRING"),
+    bigquery.SchemaField("raw_actions", "STRING"),
+    bigquery.SchemaField("processed_datetime", "TIMESTAMP"),
+    bigquery.SchemaField("screenshots_count", "INTEGER"),
+    bigquery.SchemaField("drive_folder_id", "STRING"),
+    bigquery.SchemaField("staged_at", "TIMESTAMP", mode="REQUIRED"),
+]
+RECLEAN_SCHEMA = [field for field in STAGING_SCHEMA if field.name in RECLEAN_COLUMNS]
 
 
 class TextExtractionProcessor:
@@ -228,6 +100,51 @@ class TextExtractionProcessor:
         self.max_runtime_minutes = int(os.environ.get('OCR_MAX_RUNTIME_MINUTES', '25'))
         self.save_frequency = int(os.environ.get('OCR_SAVE_FREQUENCY', '5'))
         
+        # Append-only staging для результатов OCR и компакция в целевые таблицы
+        self.bq_staging_table = os.environ.get('OCR_STAGING_TABLE', 'replay_text_staging')
+        self.staging_table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_staging_table}"
+        self.bq_raw_table = os.environ.get('OCR_RAW_TEXT_TABLE', 'replay_text_raw')
+        self.raw_table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_raw_table}"
+        self.compaction_interval_minutes = int(os.environ.get('OCR_COMPACTION_INTERVAL_MINUTES', '0'))
+        # Перечистка читает replay_text_raw частями по столько строк
+        self.reclean_chunk_rows = int(os.environ.get('OCR_RECLEAN_CHUNK_ROWS', '50000'))
+        self.last_compaction_time = None
+        self.total_staged = 0
+        self.compactions_count = 0
+        
+        # Чтение архивов Range запросами вместо полного скачивания
+        self.range_reads_enabled = os.environ.get('OCR_RANGE_READS', 'true').lower() == 'true'
+        self.range_block_size = int(os.environ.get('OCR_RANGE_BLOCK_KB', '128')) * 1024
+        self.range_cached_blocks = int(os.environ.get('OCR_RANGE_CACHE_BLOCKS', '8'))
+        # Небольшие архивы дешевле скачать одним запросом
+        self.range_min_archive_bytes = int(os.environ.get('OCR_RANGE_MIN_ARCHIVE_MB', '4')) * 1024 * 1024
+        self.archive_bytes_total = 0
+        self.archive_bytes_downloaded = 0
+        
+        # Локальный дисковый кэш архивов, скачанных целиком (меньше OCR_RANGE_MIN_ARCHIVE_MB
+        # или при выключенных Range запросах); 0 - выключен
+        self.archive_cache_dir = os.environ.get('OCR_ARCHIVE_CACHE_DIR', '/tmp/ocr_cache/archives')
+        self.archive_cache_max_mb = int(os.environ.get('OCR_ARCHIVE_CACHE_MAX_MB', '512'))
+        self.archive_cache = None
+        
+        # Кэш результатов OCR (ключ - хэш PNG + конфигурация OCR)
+        self.ocr_lang = 'eng'
+        self.ocr_cache_enabled = os.environ.get('OCR_CACHE_ENABLED', 'true').lower() == 'true'
+        self.ocr_cache_path = os.environ.get('OCR_CACHE_PATH', '/tmp/ocr_cache/ocr_results.sqlite')
+        self.ocr_cache_max_mb = int(os.environ.get('OCR_CACHE_MAX_MB', '256'))
+        self.ocr_cache = None
+        self.ocr_config_signature = ''
+        
+        # Двухпроходный OCR: быстрый проход (уменьшенное изображение, только LSTM),
+        # полный проход только для блоков с низкой уверенностью или пустым результатом
+        self.two_pass_enabled = os.environ.get('OCR_TWO_PASS', 'true').lower() == 'true'
+        self.fast_pass_scale = float(os.environ.get('OCR_FAST_SCALE', '0.6'))
+        self.confidence_threshold = float(os.environ.get('OCR_CONFIDENCE_THRESHOLD', '80'))
+        self.two_pass_stats = {}
+        self.fast_pass_seconds = 0.0
+        self.full_pass_seconds = 0.0
+        self.full_pass_count = 0
+        
         # Добавлены недостающие атрибуты
         self.start_time = None
         self.total_processed = 0
@@ -254,8 +171,12 @@ class TextExtractionProcessor:
                 scopes=["https://www.googleapis.com/auth/bigquery", "https://www.googleapis.com/auth/drive"]
             )
             self.bq_client = bigquery.Client(credentials=credentials, project=self.bq_project_id)
+            self.bq_reader = BigQueryReader(self.bq_client, make_storage_client(credentials), stage='extract_text',
+                                            log=lambda message: self._update_status(message, -1))
             self.drive_service = build('drive', 'v3', credentials=credentials)
             self._setup_tesseract()
+            self._setup_ocr_cache()
+            self._setup_archive_cache()
             self._update_status("✅ Google Cloud подключен", 5)
         except Exception as e:
             raise Exception(f"❌ Ошибка подключения к Google Cloud: {e}")
@@ -290,17 +211,138 @@ class TextExtractionProcessor:
             self._update_status(f"⚠️ Ошибка настройки Tesseract: {e}", -1)
             self.tesseract_available = False
 
+    def _setup_ocr_cache(self):
+        if not self.ocr_cache_enabled or not self.tesseract_available:
+            return
+        try:
+            tesseract_version = str(pytesseract.get_tesseract_version())
+        except Exception:
+            tesseract_version = 'unknown'
+        self.ocr_config_signature = f"tesseract={tesseract_version};lang={self.ocr_lang}"
+        if self.two_pass_enabled:
+            self.ocr_config_signature += f";two_pass=scale:{self.fast_pass_scale},conf:{self.confidence_threshold}"
+        try:
+            self.ocr_cache = OCRResultCache(self.ocr_cache_path, max_bytes=self.ocr_cache_max_mb * 1024 * 1024)
+            self._update_status(f"✅ Кэш OCR: {self.ocr_cache_path} (лимит {self.ocr_cache_max_mb} МБ)", -1)
+        except Exception as e:
+            self._update_status(f"⚠️ Кэш OCR недоступен, работаем без него: {e}", -1)
+            self.ocr_cache = None
+
+    def _setup_archive_cache(self):
+        if self.archive_cache_max_mb <= 0:
+            return
+        try:
+            self.archive_cache = ArchiveCache(self.archive_cache_dir, max_bytes=self.archive_cache_max_mb * 1024 * 1024)
+            self._update_status(f"✅ Кэш архивов: {self.archive_cache_dir} (лимит {self.archive_cache_max_mb} МБ)", -1)
+        except Exception as e:
+            self._update_status(f"⚠️ Кэш архивов недоступен, работаем без него: {e}", -1)
+            self.archive_cache = None
+
+    def _ocr_full(self, img):
+        """Полный проход: исходное изображение, движок по умолчанию"""
+        started = time.perf_counter()
+        text = pytesseract.image_to_string(img, lang=self.ocr_lang)
+        self.full_pass_seconds += time.perf_counter() - started
+        self.full_pass_count += 1
+        return text
+
+    def _ocr_fast(self, img):
+        """Быстрый проход: уменьшенное изображение, только LSTM, текст и средняя уверенность слов"""
+        started = time.perf_counter()
+        if self.fast_pass_scale != 1.0:
+            width, height = img.size
+            img = img.resize((max(1, int(width * self.fast_pass_scale)), max(1, int(height * self.fast_pass_scale))), Image.BILINEAR)
+        data = pytesseract.image_to_data(img, lang=self.ocr_lang, config='--oem 1', output_type=pytesseract.Output.DICT)
+        
+        # Собираем текст по строкам в порядке Tesseract, абзацы разделяем пустой строкой
+        lines = []
+        confidences = []
+        current_key = None
+        current_paragraph = None
+        for i, word in enumerate(data['text']):
+            word = word.strip()
+            if not word:
+                continue
+            confidence = float(data['conf'][i])
+            if confidence >= 0:
+                confidences.append(confidence)
+            paragraph = (data['block_num'][i], data['par_num'][i])
+            line_key = paragraph + (data['line_num'][i],)
+            if line_key != current_key:
+                if current_paragraph is not None and paragraph != current_paragraph:
+                    lines.append('')
+                lines.append(word)
+                current_key = line_key
+                current_paragraph = paragraph
+            else:
+                lines[-1] += ' ' + word
+        
+        self.fast_pass_seconds += time.perf_counter() - started
+        mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        return '\n'.join(lines), mean_confidence
+
+    @staticmethod
+    def _cleaned_is_empty(block, text):
+        if block == 'userinfo':
+            return not any(parse_userinfo_text(text).values())
+        cleaner = {'summary': clean_summary, 'sentiment': clean_sentiment, 'actions': clean_actions}.get(block)
+        return cleaner is not None and not cleaner(text)
+
+    def ocr_image(self, image_bytes, block='other'):
+        """OCR одного PNG с проверкой кэша перед вызовом Tesseract.
+
+        При двухпроходном режиме второй (полный) проход выполняется, только если средняя
+        уверенность быстрого прохода ниже OCR_CONFIDENCE_THRESHOLD или очищенный результат пуст.
+        """
+        cache_key = None
+        if self.ocr_cache:
+            cache_key = OCRResultCache.make_key(image_bytes, self.ocr_config_signature)
+            cached_text = self.ocr_cache.get(cache_key)
+            if cached_text is not None:
+                return cached_text
+
+        img = Image.open(io.BytesIO(image_bytes))
+        if self.two_pass_enabled:
+            block_stats = self.two_pass_stats.setdefault(block, {"images": 0, "second_pass": 0})
+            block_stats["images"] += 1
+            text, mean_confidence = self._ocr_fast(img)
+            if mean_confidence < self.confidence_threshold or self._cleaned_is_empty(block, text):
+                block_stats["second_pass"] += 1
+                text = self._ocr_full(img)
+        else:
+            text = self._ocr_full(img)
+
+        if self.ocr_cache:
+            self.ocr_cache.put(cache_key, text)
+        return text
+
+    def two_pass_report(self):
+        """Статистика двухпроходного OCR: сколько изображений потребовали второй проход и сэкономленное время"""
+        accepted = sum(s["images"] - s["second_pass"] for s in self.two_pass_stats.values())
+        report = {"ocr_two_pass": self.two_pass_stats, "ocr_fast_pass_accepted": accepted}
+        if self.full_pass_count:
+            # Экономия = полные проходы, которых удалось избежать, минус все быстрые проходы,
+            # включая потраченные на изображения, которым все равно понадобился полный проход
+            avg_full_seconds = self.full_pass_seconds / self.full_pass_count
+            report["ocr_time_saved_seconds"] = round(accepted * avg_full_seconds - self.fast_pass_seconds, 1)
+        else:
+            report["ocr_time_saved_seconds"] = None
+        return report
+
     def get_processed_sessions(self, limit=None):
         if limit is None: limit = 1600  # ✅ ИСПРАВЛЕНО: Увеличиваем лимит с 200 до 1000
+        source_table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_source_table}"
+        target_table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_target_table}"
+        # В партиционированных таблицах обе стороны anti-join читают только последние PIPELINE_LOOKBACK_DAYS дней
         query = f"""
         SELECT s.session_replay_url, s.amplitude_id, s.session_replay_id, s.duration_seconds, s.events_count, s.record_date
-        FROM `{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_source_table}` s
-        LEFT JOIN `{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_target_table}` t ON s.session_replay_id = t.session_id
-        WHERE s.is_processed = TRUE AND t.session_id IS NULL
+        FROM `{source_table_id}` s
+        LEFT JOIN `{target_table_id}` t ON s.session_replay_id = t.session_id{self.bq_reader.recent_partitions(target_table_id, 't')}
+        WHERE s.is_processed = TRUE AND t.session_id IS NULL{self.bq_reader.recent_partitions(source_table_id, 's')}
         ORDER BY s.record_date DESC LIMIT {limit}"""
         self._update_status("🔍 Получаем необработанные сессии из BigQuery...", 10)
         try:
-            sessions = [dict(row) for row in self.bq_client.query(query).result()]
+            sessions = self.bq_reader.query_records(query, description="Сессии для OCR")
             self._update_status(f"📊 Найдено НЕобработанных OCR сессий: {len(sessions)}", 15)
             return sessions
         except Exception as e:
@@ -311,7 +353,7 @@ class TextExtractionProcessor:
         search_patterns = [f"name contains '{session_id}' and name contains '.zip' and '{self.gdrive_folder_id}' in parents"]
         for i, query in enumerate(search_patterns):
             try:
-                results = self.drive_service.files().list(q=query, fields="files(id, name)", pageSize=1).execute()
+                results = self.drive_service.files().list(q=query, fields="files(id, name, size, modifiedTime)", pageSize=1).execute()
                 files = results.get('files', [])
                 if files:
                     self._update_status(f"  🔎 Найден архив (попытка {i+1}): {files[0]['name']}", -1)
@@ -321,19 +363,58 @@ class TextExtractionProcessor:
         self._update_status("  ❌ Архив не найден!", -1)
         return None
 
-    def get_zipfile_from_drive(self, file_id):
+    def _download_to(self, file_id, fh):
+        """Полное скачивание файла из Drive в файловый объект"""
+        request = self.drive_service.files().get_media(fileId=file_id)
+        downloader = MediaIoBaseDownload(fh, request)
+        done = False
+        while not done: status, done = downloader.next_chunk()
+
+    def get_zipfile_from_drive(self, file_id, file_size=None, modified_time=None):
+        """Открывает архив из Drive.
+
+        Крупные архивы (от OCR_RANGE_MIN_ARCHIVE_MB) читаются Range запросами - скачиваются только
+        центральный каталог и нужные члены архива, в кэш они не попадают. Остальные скачиваются
+        целиком, и только они хранятся в локальном кэше архивов (ключ - id + modifiedTime).
+        """
         try:
-            request = self.drive_service.files().get_media(fileId=file_id)
+            if self.range_reads_enabled and file_size and int(file_size) >= self.range_min_archive_bytes:
+                reader = RangeReader(
+                    drive_range_fetcher(self.drive_service, file_id), int(file_size),
+                    block_size=self.range_block_size, max_cached_blocks=self.range_cached_blocks
+                )
+                return zipfile.ZipFile(reader)
+
+            if self.archive_cache and modified_time:
+                cached_path = self.archive_cache.get_path(file_id, modified_time)
+                if cached_path:
+                    self._update_status("  🗃️ Архив взят из локального кэша", -1)
+                else:
+                    cached_path = self.archive_cache.put(file_id, modified_time, lambda fh: self._download_to(file_id, fh))
+                    self.archive_bytes_downloaded += os.path.getsize(cached_path)
+                return zipfile.ZipFile(cached_path)
+
             fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done: status, done = downloader.next_chunk()
+            self._download_to(file_id, fh)
             fh.seek(0)
             return zipfile.ZipFile(fh)
         except Exception as e:
             self._update_status(f"❌ Ошибка скачивания архива: {e}", -1)
             raise
 
+    def account_archive_transfer(self, zip_file):
+        """Учитывает размер архива и сколько байт реально скачано (скачивание в кэш учитывается при загрузке)"""
+        source = zip_file.fp
+        if isinstance(source, RangeReader):
+            self.archive_bytes_total += source.size
+            self.archive_bytes_downloaded += source.bytes_fetched
+        elif isinstance(source, io.BytesIO):
+            archive_size = len(source.getbuffer())
+            self.archive_bytes_total += archive_size
+            self.archive_bytes_downloaded += archive_size
+        elif zip_file.filename:
+            self.archive_bytes_total += os.path.getsize(zip_file.filename)
+
     def process_zip_session(self, session, zip_file):
         """ОБНОВЛЕНО: Полная схема + очистка + userinfo"""
         data = {
@@ -355,7 +436,7 @@ class TextExtractionProcessor:
         }
         
         screenshots_count = 0
-        raw_data = {'summary': '', 'sentiment': '', 'actions': ''}
+        raw_data = {'userinfo': None, 'summary': None, 'sentiment': None, 'actions': None}
         
         try:
             for fname in zip_file.namelist():
@@ -363,11 +444,12 @@ class TextExtractionProcessor:
                     screenshots_count += 1
                     if not self.tesseract_available: 
                         continue
+                    block = next((b for b in ['userinfo', 'summary', 'sentiment', 'actions'] if b in fname.lower()), 'other')
                     with zip_file.open(fname) as file:
-                        img = Image.open(file)
-                        text = pytesseract.image_to_string(img, lang='eng')
+                        text = self.ocr_image(file.read(), block)
                         
                         if 'userinfo' in fname.lower():
+                            raw_data['userinfo'] = text
                             userinfo = parse_userinfo_text(text)
                             data.update(userinfo)
                         elif 'summary' in fname.lower():
@@ -394,32 +476,12 @@ class TextExtractionProcessor:
         if cleaning_stats:
             self._update_status(f"🧹 Очищено: {', '.join(cleaning_stats)}", -1)
         
+        # Сырой текст сохраняется в staging и затем в replay_text_raw
+        for field, text in raw_data.items():
+            data[f'raw_{field}'] = text
+        
         return data, screenshots_count
 
-    def update_session_status_in_bq(self, session_replay_url, screenshots_count, drive_file_id):
-        """ОБНОВЛЕНО: Добавляем processed_datetime"""
-        processed_datetime = datetime.utcnow().isoformat()
-        
-        table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_source_table}"
-        update_query = f"""
-        UPDATE `{table_id}` 
-        SET 
-            processed_datetime = @processed_datetime,
-            screenshots_count = @screenshots_count, 
-            drive_folder_id = @drive_folder_id 
-        WHERE session_replay_url = @session_replay_url
-        """
-        try:
-            job_config = bigquery.QueryJobConfig(query_parameters=[
-                bigquery.ScalarQueryParameter("processed_datetime", "STRING", processed_datetime),
-                bigquery.ScalarQueryParameter("screenshots_count", "INT64", screenshots_count),
-                bigquery.ScalarQueryParameter("drive_folder_id", "STRING", drive_file_id),
-                bigquery.ScalarQueryParameter("session_replay_url", "STRING", session_replay_url)
-            ])
-            self.bq_client.query(update_query, job_config=job_config).result()
-        except Exception as e:
-            self._update_status(f"❌ Ошибка обновления статуса: {e}", -1)
-        
     def check_runtime_limit(self):
         if self.start_time:
             elapsed_minutes = (datetime.now() - self.start_time).total_seconds() / 60
@@ -428,100 +490,264 @@ class TextExtractionProcessor:
                 return True
         return False
 
-    def upload_to_bigquery(self, rows):
-        """ОБНОВЛЕНО: MERGE вместо append + дедупликация"""
+    def ensure_staging_table(self):
+        """Создает append-only staging таблицу и таблицу сырого текста, если их нет"""
+        self.bq_client.create_table(bigquery.Table(self.staging_table_id, schema=STAGING_SCHEMA), exists_ok=True)
+        self.bq_client.create_table(bigquery.Table(self.raw_table_id, schema=RAW_TEXT_SCHEMA), exists_ok=True)
+
+    def upload_to_bigquery(self, rows, status_updates=None):
+        """Дописывает батч результатов OCR в staging таблицу (один load job, без MERGE).
+
+        status_updates - статусы обработки (processed_datetime, screenshots_count, drive_folder_id)
+        по session_replay_url; пишутся в те же строки staging таблицы и применяются к
+        session_replay_urls при компакции.
+        """
         if not rows:
             return
         
-        # Дедупликация по session_id
-        seen_sessions = set()
-        unique_rows = []
-        duplicates_found = 0
-        
+        # Дедупликация по session_id внутри батча: побеждает последняя запись
+        unique_rows = {}
         for row in rows:
-            session_id = row.get('session_id')
-            if session_id not in seen_sessions:
-                seen_sessions.add(session_id)
-                unique_rows.append(row)
-            else:
-                duplicates_found += 1
+            unique_rows[row.get('session_id')] = row
+        duplicates_found = len(rows) - len(unique_rows)
         
         if duplicates_found > 0:
             self._update_status(f"🧹 Убрано дубликатов: {duplicates_found}", -1)
         
         try:
-            df = pd.DataFrame(unique_rows)
+            df = pd.DataFrame(list(unique_rows.values()))
             
             if df.empty:
                 self._update_status("ℹ️ Нет корректных данных для загрузки", -1)
                 return
 
-            # Используем MERGE вместо простого append
-            temp_table_id = f"{self.bq_dataset_id}.temp_ocr_batch_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
-            target_table_id = f"{self.bq_dataset_id}.{self.bq_target_table}"
-            
-            # Загружаем во временную таблицу
-            job_config = bigquery.LoadJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
-            job = self.bq_client.load_table_from_dataframe(df, temp_table_id, job_config=job_config)
+            if status_updates:
+                status_df = pd.DataFrame(status_updates).drop_duplicates('session_replay_url', keep='last')
+                df = df.merge(status_df, on='session_replay_url', how='left')
+
+            for field in STAGING_SCHEMA:
+                if field.name not in df.columns:
+                    df[field.name] = None
+            df['staged_at'] = pd.Timestamp.now(tz='UTC')
+            df = df[[field.name for field in STAGING_SCHEMA]]
+
+            job_config = bigquery.LoadJobConfig(
+                schema=STAGING_SCHEMA,
+                write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+            )
+            job = self.bq_client.load_table_from_dataframe(df, self.staging_table_id, job_config=job_config)
             job.result()
+            self.total_staged += len(df)
+            
+            self._update_status(f"💾 В staging добавлено {len(df)} записей (всего за запуск: {self.total_staged})", -1)
+            self.maybe_compact_staging()
+
+        except Exception as e:
+            import traceback
+            self._update_status(f"❌ Ошибка загрузки в BigQuery: {e}", -1)
+            print(f"🔍 Трейсбек: {traceback.format_exc()}")
+
+    def maybe_compact_staging(self):
+        """Компакция по таймеру, если задан OCR_COMPACTION_INTERVAL_MINUTES"""
+        if not self.compaction_interval_minutes or not self.last_compaction_time:
+            return
+        elapsed_minutes = (datetime.now() - self.last_compaction_time).total_seconds() / 60
+        if elapsed_minutes >= self.compaction_interval_minutes:
+            self.compact_staging()
+
+    def compact_staging(self):
+        """Переносит staging в целевые таблицы одним скриптом в транзакции.
+
+        Строки дедуплицируются по session_id (и по session_replay_url для статусов),
+        побеждает последняя запись по staged_at. Очищенные поля идут в replay_text_complete,
+        сырой текст - в replay_text_raw, статусы - в session_replay_urls.
+        Перенесенные строки удаляются из staging.
+
+        Для таблиц, партиционированных по record_date (scripts/migrate_tables.py), MERGE
+        ограничены партициями от самой ранней даты в staging (min_date), а record_date
+        приводится к DATE.
+        """
+        target_table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_target_table}"
+        source_table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_source_table}"
+        target_partitioned = self.bq_reader.partition_field(target_table_id) == PARTITION_COLUMN
+        source_partitioned = self.bq_reader.partition_field(source_table_id) == PARTITION_COLUMN
+
+        def value(column):
+            if column == PARTITION_COLUMN and target_partitioned:
+                return f"SAFE_CAST(S.{column} AS DATE)"
+            return f"S.{column}"
+
+        target_filter = "\n            AND (T.record_date >= min_date OR T.record_date IS NULL)" if target_partitioned else ""
+        source_filter = ("\n            AND (T.record_date >= min_date OR T.record_date IS NULL) AND T.is_processed"
+                         if source_partitioned else "")
+        update_set = ',\n                '.join(f"{c} = {value(c)}" for c in OCR_RESULT_COLUMNS if c != 'session_id')
+        insert_columns = ', '.join(OCR_RESULT_COLUMNS)
+        insert_values = ', '.join(value(c) for c in OCR_RESULT_COLUMNS)
+        raw_columns = ', '.join(RAW_TEXT_COLUMNS)
+        raw_values = ', '.join(f"S.{c}" for c in RAW_TEXT_COLUMNS)
+        raw_update_set = ',\n                '.join(f"{c} = S.{c}" for c in RAW_TEXT_COLUMNS)
+
+        compaction_script = f"""
+        DECLARE watermark TIMESTAMP DEFAULT (SELECT MAX(staged_at) FROM `{self.staging_table_id}`);
+        DECLARE min_date DATE;
+
+        IF watermark IS NOT NULL THEN
+          -- Строка без даты снимает ограничение по партициям (сессия может быть в любой)
+          SET min_date = (
+            SELECT IF(LOGICAL_OR(SAFE_CAST(record_date AS DATE) IS NULL), DATE '0001-01-01',
+                      MIN(SAFE_CAST(record_date AS DATE)))
+            FROM `{self.staging_table_id}`
+            WHERE staged_at <= watermark
+          );
+
+          BEGIN TRANSACTION;
+
+          MERGE `{target_table_id}` T
+          USING (
+            SELECT * EXCEPT(row_num) FROM (
+              SELECT *, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY staged_at DESC) AS row_num
+              FROM `{self.staging_table_id}`
+              WHERE staged_at <= watermark
+            ) WHERE row_num = 1
+          ) S
+          ON T.session_id = S.session_id{target_filter}
+          WHEN MATCHED THEN
+            UPDATE SET
+                {update_set}
+          WHEN NOT MATCHED THEN
+            INSERT ({insert_columns})
+            VALUES ({insert_values});
+
+          MERGE `{source_table_id}` T
+          USING (
+            SELECT * EXCEPT(row_num) FROM (
+              SELECT session_replay_url, processed_datetime, screenshots_count, drive_folder_id,
+                     ROW_NUMBER() OVER (PARTITION BY session_replay_url ORDER BY staged_at DESC) AS row_num
+              FROM `{self.staging_table_id}`
+              WHERE staged_at <= watermark AND processed_datetime IS NOT NULL
+            ) WHERE row_num = 1
+          ) S
+          ON T.session_replay_url = S.session_replay_url{source_filter}
+          WHEN MATCHED THEN
+            UPDATE SET
+                processed_datetime = S.processed_datetime,
+                screenshots_count = S.screenshots_count,
+                drive_folder_id = S.drive_folder_id;
+
+          MERGE `{self.raw_table_id}` T
+          USING (
+            SELECT * EXCEPT(row_num) FROM (
+              SELECT session_id, {raw_columns}, staged_at,
+                     ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY staged_at DESC) AS row_num
+              FROM `{self.staging_table_id}`
+              WHERE staged_at <= watermark
+            ) WHERE row_num = 1
+          ) S
+          ON T.session_id = S.session_id
+          WHEN MATCHED THEN
+            UPDATE SET
+                {raw_update_set},
+                ocr_datetime = S.staged_at
+          WHEN NOT MATCHED THEN
+            INSERT (session_id, {raw_columns}, ocr_datetime)
+            VALUES (S.session_id, {raw_values}, S.staged_at);
+
+          DELETE FROM `{self.staging_table_id}` WHERE staged_at <= watermark;
+
+          COMMIT TRANSACTION;
+        END IF;
+        """
+        try:
+            self._update_status("🗜️ Компакция staging → целевые таблицы...", -1)
+            self.bq_reader.run(compaction_script, description="Компакция staging")
+            self.compactions_count += 1
+            self._update_status(f"✅ Компакция завершена: {self.bq_target_table}, {self.bq_source_table}", -1)
+        except Exception as e:
+            self._update_status(f"❌ Ошибка компакции staging: {e}", -1)
+        finally:
+            self.last_compaction_time = datetime.now()
+
+    def reclean(self):
+        """Перечистка без OCR: заново выводит очищенные поля и userinfo из сохраненного сырого текста.
+
+        Сырой текст читается частями (OCR_RECLEAN_CHUNK_ROWS строк), каждая часть чистится
+        пакетным API и дописывается во временную таблицу с явной схемой (RECLEAN_SCHEMA);
+        к replay_text_complete результат применяется одним MERGE.
+        """
+        self.start_time = datetime.now()
+        self._update_status("🔄 ЗАПУСК ПЕРЕЧИСТКИ OCR ТЕКСТА (без повторного OCR)", 10)
+        
+        query = f"""
+        SELECT session_id, {', '.join(RAW_TEXT_COLUMNS)}
+        FROM `{self.raw_table_id}`
+        """
+        job, rows = self.bq_reader.query(query, description="Сырой текст для перечистки")
+        raw_sessions = rows.total_rows or 0
+        if raw_sessions == 0:
+            self._update_status("ℹ️ Нет сохраненного сырого текста для перечистки", 100)
+            return {"status": "no_raw_text", "message": "Нет сохраненного сырого текста", **self.bq_reader.cost_report()}
+        
+        temp_table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.temp_ocr_reclean_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        target_table_id = f"{self.bq_project_id}.{self.bq_dataset_id}.{self.bq_target_table}"
+        cleaned_columns = [c for c in RECLEAN_COLUMNS if c != 'session_id']
+        update_set = ',\n                '.join(f"{c} = S.{c}" for c in cleaned_columns)
+        job_config = bigquery.LoadJobConfig(schema=RECLEAN_SCHEMA, write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+        
+        try:
+            self.bq_client.create_table(bigquery.Table(temp_table_id, schema=RECLEAN_SCHEMA))
+            cleaned_rows = 0
+            for raw_df in self.bq_reader.iter_dataframes(job.destination, chunk_rows=self.reclean_chunk_rows):
+                cleaned = parse_userinfo_series(raw_df['raw_userinfo'])
+                cleaned.insert(0, 'session_id', raw_df['session_id'])
+                for field in ['summary', 'sentiment', 'actions']:
+                    cleaned[field] = clean_series(raw_df[f'raw_{field}'], field)
+                self.bq_client.load_table_from_dataframe(cleaned[RECLEAN_COLUMNS], temp_table_id, job_config=job_config).result()
+                cleaned_rows += len(cleaned)
+                progress = 20 + int(cleaned_rows / raw_sessions * 50)
+                self._update_status(f"🧹 Перечищено и загружено {cleaned_rows}/{raw_sessions} сессий", progress)
             
-            # MERGE запрос
             merge_query = f"""
             MERGE `{target_table_id}` T
             USING `{temp_table_id}` S
             ON T.session_id = S.session_id
             WHEN MATCHED THEN
               UPDATE SET
-                amplitude_id = S.amplitude_id,
-                session_replay_url = S.session_replay_url,
-                duration_seconds = S.duration_seconds,
-                events_count = S.events_count,
-                record_date = S.record_date,
-                user_id = S.user_id,
-                country = S.country,
-                session_length = S.session_length,
-                event_total = S.event_total,
-                device_type = S.device_type,
-                summary = S.summary,
-                sentiment = S.sentiment,
-                actions = S.actions
-            WHEN NOT MATCHED THEN
-              INSERT (
-                session_id, amplitude_id, session_replay_url, duration_seconds, 
-                events_count, record_date, user_id, country, session_length, 
-                event_total, device_type, summary, sentiment, actions
-              )
-              VALUES (
-                S.session_id, S.amplitude_id, S.session_replay_url, S.duration_seconds,
-                S.events_count, S.record_date, S.user_id, S.country, S.session_length,
-                S.event_total, S.device_type, S.summary, S.sentiment, S.actions
-              )
+                {update_set}
             """
-            
-            merge_job = self.bq_client.query(merge_query)
-            merge_job.result()
-            
-            # Удаляем временную таблицу
-            self.bq_client.delete_table(temp_table_id)
-            
-            self._update_status(f"💾 MERGE завершен: {len(df)} записей обработано", -1)
-
-        except Exception as e:
-            import traceback
-            self._update_status(f"❌ Ошибка загрузки в BigQuery: {e}", -1)
-            print(f"🔍 Трейсбек: {traceback.format_exc()}")
+            self._update_status("💾 Применяем перечищенные данные одним MERGE...", 80)
+            merge_job = self.bq_reader.run(merge_query, description="MERGE перечищенного текста")
+            updated_rows = merge_job.num_dml_affected_rows or 0
+        finally:
+            self.bq_client.delete_table(temp_table_id, not_found_ok=True)
+        
+        total_time = datetime.now() - self.start_time
+        result = {
+            "status": "completed",
+            "mode": "reclean",
+            "raw_sessions": raw_sessions,
+            "updated_rows": updated_rows,
+            **self.bq_reader.cost_report(),
+            "total_time_minutes": round(total_time.total_seconds() / 60, 1)
+        }
+        self._update_status(f"🏁 ПЕРЕЧИСТКА ЗАВЕРШЕНА! Обновлено строк: {updated_rows}", 100)
+        return result
 
     def run(self):
         self.start_time = datetime.now()
         self._update_status("🔄 ЗАПУСК ОБРАБОТКИ OCR ТЕКСТА", 20)
+        # Остатки staging от прерванного запуска переносим до выборки сессий,
+        # иначе они снова попадут в обработку
+        self.ensure_staging_table()
+        self.compact_staging()
         sessions = self.get_processed_sessions()
         
         if not sessions:
             self._update_status("✅ Все сессии уже обработаны OCR!", 100)
-            return {"status": "no_sessions", "message": "Нет сессий для OCR обработки"}
+            return {"status": "no_sessions", "message": "Нет сессий для OCR обработки", **self.bq_reader.cost_report()}
 
         self._update_status(f"📋 Начинаем обработку {len(sessions)} сессий (макс. {self.max_runtime_minutes} мин)", 25)
         all_data = []
+        status_updates = []
         
         for i, session in enumerate(sessions, 1):
             if self.check_runtime_limit():
@@ -537,11 +763,18 @@ class TextExtractionProcessor:
                 continue
 
             try:
-                zip_file = self.get_zipfile_from_drive(zip_file_info['id'])
+                zip_file = self.get_zipfile_from_drive(zip_file_info['id'], zip_file_info.get('size'), zip_file_info.get('modifiedTime'))
                 row, screenshots_count = self.process_zip_session(session, zip_file)
+                self.account_archive_transfer(zip_file)
+                zip_file.close()
                 all_data.append(row)
-                # ✅ ДОБАВЛЕНО: Обновляем статус в session_replay_urls
-                self.update_session_status_in_bq(session['session_replay_url'], screenshots_count, zip_file_info['id'])
+                # Статус в session_replay_urls обновляется вместе с батчем результатов
+                status_updates.append({
+                    'session_replay_url': session['session_replay_url'],
+                    'processed_datetime': pd.Timestamp.now(tz='UTC'),
+                    'screenshots_count': screenshots_count,
+                    'drive_folder_id': zip_file_info['id'],
+                })
                 self.total_successful += 1
             except Exception as e:
                 self.total_failed += 1
@@ -549,21 +782,44 @@ class TextExtractionProcessor:
             
             self.total_processed += 1
             if len(all_data) >= self.save_frequency:
-                self.upload_to_bigquery(all_data)
+                self.upload_to_bigquery(all_data, status_updates)
                 all_data = []
+                status_updates = []
 
         if all_data: 
-            self.upload_to_bigquery(all_data)
+            self.upload_to_bigquery(all_data, status_updates)
+        if self.total_staged:
+            self.compact_staging()
 
         total_time = datetime.now() - self.start_time
-        result = {"status": "completed", "total_processed": self.total_processed, "successful": self.total_successful, "failed": self.total_failed}
+        result = {"status": "completed", "total_processed": self.total_processed, "successful": self.total_successful, "failed": self.total_failed,
+                  "staged_rows": self.total_staged, "staging_compactions": self.compactions_count,
+                  "archive_bytes_total": self.archive_bytes_total, "archive_bytes_downloaded": self.archive_bytes_downloaded}
+        if self.two_pass_enabled:
+            result.update(self.two_pass_report())
+            second_pass = sum(s["second_pass"] for s in self.two_pass_stats.values())
+            self._update_status(f"⚡ Двухпроходный OCR: второй проход для {second_pass} изображений, "
+                                f"сэкономлено ~{result['ocr_time_saved_seconds']} с", -1)
+        if self.archive_cache:
+            result.update(self.archive_cache.stats())
+            self._update_status(f"🗃️ Кэш архивов: hit ratio {result['archive_cache_hit_ratio']}, "
+                                f"сэкономлено {result['archive_cache_bytes_saved'] / 1024 / 1024:.1f} МБ", -1)
+        if self.ocr_cache:
+            result.update(self.ocr_cache.stats())
+            self._update_status(f"🗃️ Кэш OCR: попаданий {self.ocr_cache.hits}, промахов {self.ocr_cache.misses}", -1)
+        result.update(self.bq_reader.cost_report())
+        self._update_status(f"💰 BigQuery: оплачено {format_bytes(result['bytes_billed'])} за {result['bigquery_queries']} запросов", -1)
         self._update_status(f"🏁 OCR ОБРАБОТКА ЗАВЕРШЕНА! Успешно: {self.total_successful}, Ошибки: {self.total_failed}", 100)
         return result
 
 def main():
     try:
         processor = TextExtractionProcessor()
-        processor.run()
+        # python scripts/extract_text.py reclean - перечистка из сохраненного сырого текста
+        if len(sys.argv) > 1 and sys.argv[1] == 'reclean':
+            processor.reclean()
+        else:
+            processor.run()
     except Exception as e:
         print(f"❌ Критическая ошибка: {e}")
         import traceback
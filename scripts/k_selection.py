@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+
+# Сколько строк выборки использовать для silhouette (попарные расстояния - O(n^2))
+SILHOUETTE_MAX_ROWS = 2000
+
+
+def stratified_sample_positions(strata, n_rows: int, random_state: int = 42):
+    """Позиции стратифицированной выборки ~n_rows строк: доля каждой страты сохраняется,
+    редкие страты получают хотя бы одну строку"""
+    strata = np.asarray(strata, dtype=object)
+    if len(strata) <= n_rows:
+        return np.arange(len(strata))
+
+    rng = np.random.default_rng(random_state)
+    fraction = n_rows / len(strata)
+    positions = []
+    for stratum in dict.fromkeys(strata):
+        members = np.flatnonzero(strata == stratum)
+        take = max(1, int(round(len(members) * fraction)))
+        positions.append(rng.choice(members, size=min(take, len(members)), replace=False))
+    return np.sort(np.concatenate(positions))
+
+
+def davies_bouldin(center_distances_by_row, labels, centers):
+    """Davies-Bouldin по расстояниям строк до центров (KMeans.transform): без уплотнения разреженных признаков"""
+    present = np.unique(labels)
+    scatter = np.array([center_distances_by_row[labels == k, k].mean() for k in present])
+    center_distances = np.linalg.norm(centers[present][:, None, :] - centers[present][None, :, :], axis=2)
+    np.fill_diagonal(center_distances, np.inf)
+    return float(np.mean(np.max((scatter[:, None] + scatter[None, :]) / center_distances, axis=1)))
+
+
+def score_k(features, k: int, metric: str, random_state: int = 42):
+    """Обучает KMeans с k кластерами на выборке и оценивает разбиение"""
+    start = time.perf_counter()
+    kmeans = KMeans(n_clusters=k, random_state=random_state, n_init=3)
+    labels = kmeans.fit_predict(features)
+    if len(set(labels)) < 2:
+        score = None
+    elif metric == 'davies_bouldin':
+        score = davies_bouldin(kmeans.transform(features), labels, kmeans.cluster_centers_)
+    else:
+        score = float(silhouette_score(features, labels, sample_size=min(features.shape[0], SILHOUETTE_MAX_ROWS),
+                                       random_state=random_state))
+    return {"k": k, "score": None if score is None else round(score, 4), "seconds": round(time.perf_counter() - start, 2)}
+
+
+def sweep_k(features, k_values, metric: str = 'silhouette', n_jobs: int = -1, random_state: int = 42):
+    """Параллельный перебор k на выборке признаков.
+
+    silhouette - чем больше, тем лучше; davies_bouldin - чем меньше, тем лучше.
+    Возвращает (лучшее k или None, отчет [{k, score, seconds}] по каждому k).
+    """
+    k_values = [k for k in k_values if 2 <= k < features.shape[0]]
+    report = Parallel(n_jobs=n_jobs)(delayed(score_k)(features, k, metric, random_state) for k in k_values)
+    scored = [r for r in report if r['score'] is not None]
+    if not scored:
+        return None, report
+    pick = min if metric == 'davies_bouldin' else max
+    return pick(scored, key=lambda r: r['score'])['k'], report
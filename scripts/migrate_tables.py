@@ -0,0 +1,203 @@
+"""Миграция таблиц конвейера на партиционирование по record_date и кластеризацию.
+
+session_replay_urls и replay_text_complete пересоздаются через CREATE TABLE ... AS SELECT
+с PARTITION BY record_date (строковая record_date replay_text_complete приводится к DATE
+через SAFE_CAST) и CLUSTER BY колонка состояния + ID. После проверки числа строк новая
+таблица занимает место старой, старая остается резервной копией <table>_backup_<время>.
+Этапы сами добавляют условия на партиции, когда видят партиционированную таблицу.
+
+Запускать при остановленном конвейере: записи в старую таблицу во время копирования не переносятся.
+
+Запуск:
+  python scripts/migrate_tables.py        - план: текущая раскладка и оценки (dry run), без изменений
+  python scripts/migrate_tables.py apply  - миграция и сравнение стоимости запросов этапов до/после
+"""
+import os
+import sys
+from datetime import datetime
+
+from google.cloud import bigquery
+from google.oauth2 import service_account
+
+# Добавляем путь к корню проекта для импорта config
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from config.settings import settings
+except ImportError:
+    class MockSettings:
+        GOOGLE_APPLICATION_CREDENTIALS = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS', '/etc/secrets/bigquery-credentials.json')
+        BQ_PROJECT_ID = os.environ.get('BQ_PROJECT_ID', 'codellon-dwh')
+        BQ_DATASET_ID = os.environ.get('BQ_DATASET_ID', 'amplitude_session_replay')
+        BQ_SOURCE_TABLE = os.environ.get('BQ_SOURCE_TABLE', 'session_replay_urls')
+        BQ_TARGET_TABLE = os.environ.get('BQ_TARGET_TABLE', 'replay_text_complete')
+    settings = MockSettings()
+
+from scripts.bq_io import (PARTITION_COLUMN, TEXT_TABLE_CLUSTERING, URL_TABLE_CLUSTERING, BigQueryReader,
+                           format_bytes, make_storage_client)
+
+MIGRATED_SUFFIX = '__migrated'
+
+
+class TableMigrator:
+    def __init__(self, credentials_path, project_id, dataset_id, urls_table, text_table):
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.urls_table = urls_table
+        self.text_table = text_table
+        # Таблица -> колонки кластеризации
+        self.layouts = {urls_table: URL_TABLE_CLUSTERING, text_table: TEXT_TABLE_CLUSTERING}
+
+        credentials = service_account.Credentials.from_service_account_file(
+            credentials_path,
+            scopes=["https://www.googleapis.com/auth/bigquery"]
+        )
+        self.client = bigquery.Client(credentials=credentials, project=project_id)
+        self.reader = BigQueryReader(self.client, make_storage_client(credentials), stage='migrate_tables')
+
+    def table_id(self, name):
+        return f"{self.project_id}.{self.dataset_id}.{name}"
+
+    def is_migrated(self, table):
+        return bool(table.time_partitioning) and table.time_partitioning.field == PARTITION_COLUMN
+
+    def create_query(self, table, new_table_id):
+        """CREATE TABLE ... AS SELECT с партициями по record_date и кластеризацией по существующим колонкам"""
+        fields = {field.name: field.field_type for field in table.schema}
+        if PARTITION_COLUMN not in fields:
+            raise ValueError(f"В таблице {table.table_id} нет колонки {PARTITION_COLUMN}")
+        select = "SELECT *"
+        if fields[PARTITION_COLUMN] != 'DATE':
+            select = f"SELECT * REPLACE (SAFE_CAST({PARTITION_COLUMN} AS DATE) AS {PARTITION_COLUMN})"
+        clustering = [column for column in self.layouts[table.table_id] if column in fields]
+        cluster_by = f"\n        CLUSTER BY {', '.join(clustering)}" if clustering else ""
+        return f"""
+        CREATE TABLE `{new_table_id}`
+        PARTITION BY {PARTITION_COLUMN}{cluster_by}
+        AS {select} FROM `{self.table_id(table.table_id)}`
+        """
+
+    def stage_queries(self, urls_table_id, text_table_id):
+        """Типовые запросы этапов к таблицам; условия на партиции - как у этапов (только для партиционированных)"""
+        urls_partitioned = self.reader.partition_field(urls_table_id) == PARTITION_COLUMN
+        mark_filter = " AND record_date = CURRENT_DATE() AND is_processed = FALSE" if urls_partitioned else ""
+        return {
+            "Необработанные URL (скриншоты)": f"""
+                SELECT session_replay_url, amplitude_id, session_replay_id, duration_seconds, events_count, record_date
+                FROM `{urls_table_id}`
+                WHERE is_processed = FALSE{self.reader.recent_partitions(urls_table_id)}
+            """,
+            "Отметка URL (UPDATE)": f"""
+                UPDATE `{urls_table_id}` SET is_processed = TRUE
+                WHERE session_replay_url = 'https://app.amplitude.com/'{mark_filter}
+            """,
+            "Сессии для OCR (anti-join)": f"""
+                SELECT s.session_replay_url, s.session_replay_id, s.record_date
+                FROM `{urls_table_id}` s
+                LEFT JOIN `{text_table_id}` t ON s.session_replay_id = t.session_id{self.reader.recent_partitions(text_table_id, 't')}
+                WHERE s.is_processed = TRUE AND t.session_id IS NULL{self.reader.recent_partitions(urls_table_id, 's')}
+            """,
+            "Строки без кластеров": f"""
+                SELECT session_id, summary, sentiment, actions, session_length, event_total, sentiment_label, record_date
+                FROM `{text_table_id}`
+                WHERE (advanced_cluster IS NULL OR cluster_description IS NULL){self.reader.recent_partitions(text_table_id)}
+            """,
+        }
+
+    def estimate_stage_queries(self, urls_table_id, text_table_id):
+        return {name: self.reader.estimate_bytes(query)
+                for name, query in self.stage_queries(urls_table_id, text_table_id).items()}
+
+    @staticmethod
+    def print_comparison(before, after):
+        print(f"\n{'запрос':<32} {'до':>12} {'после':>12}")
+        for name in before:
+            print(f"{name:<32} {format_bytes(before[name]):>12} {format_bytes(after.get(name)):>12}")
+        print("ℹ️ Dry run учитывает только отсечение партиций; экономию от кластеризации показывает "
+              "фактический bytes_billed в результатах этапов")
+
+    def plan(self):
+        """Текущая раскладка, стоимость копирования и запросов этапов - без изменений"""
+        migration = {}
+        for name in self.layouts:
+            table = self.client.get_table(self.table_id(name))
+            if self.is_migrated(table):
+                print(f"✅ {name}: уже партиционирована по {PARTITION_COLUMN}, кластеры {table.clustering_fields}")
+                continue
+            estimate = self.reader.estimate_bytes(self.create_query(table, self.table_id(name + MIGRATED_SUFFIX)))
+            migration[name] = estimate
+            print(f"📋 {name}: {table.num_rows or 0:,} строк, без партиций; копирование ~{format_bytes(estimate)}")
+
+        before = self.estimate_stage_queries(self.table_id(self.urls_table), self.table_id(self.text_table))
+        print(f"\n{'запрос':<32} {'сейчас':>12}")
+        for name, estimate in before.items():
+            print(f"{name:<32} {format_bytes(estimate):>12}")
+        return {"status": "plan", "migration_bytes": migration, "stage_queries_bytes": before}
+
+    def apply(self):
+        """Копирование в партиционированные таблицы, сравнение стоимости, замена старых таблиц"""
+        before = self.estimate_stage_queries(self.table_id(self.urls_table), self.table_id(self.text_table))
+
+        created = {}
+        for name in self.layouts:
+            table = self.client.get_table(self.table_id(name))
+            if self.is_migrated(table):
+                print(f"✅ {name}: уже партиционирована, пропускаем")
+                continue
+            new_table_id = self.table_id(name + MIGRATED_SUFFIX)
+            self.client.delete_table(new_table_id, not_found_ok=True)
+            print(f"🔄 {name}: копируем в {new_table_id}...")
+            self.reader.run(self.create_query(table, new_table_id), description=f"Копирование {name}")
+            copied_rows = self.client.get_table(new_table_id).num_rows or 0
+            if copied_rows != (table.num_rows or 0):
+                self.client.delete_table(new_table_id, not_found_ok=True)
+                raise RuntimeError(f"{name}: скопировано {copied_rows} строк из {table.num_rows}, миграция остановлена")
+            created[name] = new_table_id
+
+        after = self.estimate_stage_queries(
+            created.get(self.urls_table, self.table_id(self.urls_table)),
+            created.get(self.text_table, self.table_id(self.text_table)),
+        )
+        self.print_comparison(before, after)
+
+        backups = {}
+        suffix = datetime.now().strftime('%Y%m%d_%H%M%S')
+        for name, new_table_id in created.items():
+            backup_name = f"{name}_backup_{suffix}"
+            self.reader.run(f"ALTER TABLE `{self.table_id(name)}` RENAME TO `{backup_name}`",
+                            description=f"Резервная копия {name}")
+            self.reader.run(f"ALTER TABLE `{new_table_id}` RENAME TO `{name}`", description=f"Замена {name}")
+            backups[name] = self.table_id(backup_name)
+            print(f"✅ {name}: партиции по {PARTITION_COLUMN}, кластеры {self.layouts[name]}; старая таблица - {backup_name}")
+
+        return {
+            "status": "completed",
+            "migrated_tables": list(created),
+            "backups": backups,
+            "cost_comparison": {name: {"before": before[name], "after": after.get(name)} for name in before},
+            **self.reader.cost_report(),
+        }
+
+
+def main(apply=False):
+    print("🚀 МИГРАЦИЯ ТАБЛИЦ: ПАРТИЦИИ ПО RECORD_DATE И КЛАСТЕРИЗАЦИЯ")
+    print("=" * 50)
+    try:
+        migrator = TableMigrator(
+            credentials_path=settings.GOOGLE_APPLICATION_CREDENTIALS,
+            project_id=settings.BQ_PROJECT_ID,
+            dataset_id=settings.BQ_DATASET_ID,
+            urls_table=settings.BQ_SOURCE_TABLE,
+            text_table=settings.BQ_TARGET_TABLE,
+        )
+        return migrator.apply() if apply else migrator.plan()
+    except Exception as e:
+        print(f"❌ Ошибка миграции: {e}")
+        import traceback
+        traceback.print_exc()
+        return {"status": "error", "error": str(e)}
+
+
+if __name__ == "__main__":
+    result = main(apply=len(sys.argv) > 1 and sys.argv[1] == 'apply')
+    print(f"\n📋 Итоговый результат: {result}")
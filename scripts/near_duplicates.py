@@ -0,0 +1,151 @@
+import zlib
+
+import numpy as np
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def _shingles(text: str, size: int):
+    """Множество словесных n-грамм; короткий текст - множество слов"""
+    words = text.split()
+    if len(words) < size:
+        return frozenset(words)
+    return frozenset(' '.join(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def _lsh_bands(num_perm: int, threshold: float, min_recall: float = 0.9):
+    """Число полос b и строк в полосе r (b * r = num_perm).
+
+    Пара с Жаккаром = threshold попадает в общую корзину с вероятностью 1 - (1 - t^r)^b;
+    выбирается самое узкое (большое r) разбиение, где она не меньше min_recall -
+    лишние кандидаты все равно отсекает точная проверка Жаккара.
+    """
+    options = [(num_perm // r, r) for r in range(1, num_perm + 1) if num_perm % r == 0]
+    recall = lambda b, r: 1 - (1 - threshold ** r) ** b
+    suitable = [(b, r) for b, r in options if recall(b, r) >= min_recall]
+    return max(suitable, key=lambda br: br[1]) if suitable else max(options, key=lambda br: br[0])
+
+
+class _UnionFind:
+    def __init__(self, size):
+        self.parent = np.arange(size)
+
+    def find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+class NearDuplicateGrouper:
+    """Группировка почти одинаковых текстов: MinHash подписи + LSH по полосам.
+
+    Сначала объединяются точные совпадения, затем для уникальных текстов считаются
+    MinHash подписи (векторно, блоками документов), кандидаты из общих LSH корзин
+    проверяются точным коэффициентом Жаккара по множествам n-грамм (>= threshold)
+    и объединяются через union-find. Группа представлена первым текстом в порядке входа;
+    как и у любой single-linkage группировки, похожесть транзитивна (цепочки объединяются).
+    Пустой текст всегда остается отдельной группой: без содержания похожесть не определена.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, shingle_size: int = 2,
+                 block_size: int = 2000, max_leaders: int = 16, random_state: int = 42):
+        self.threshold = threshold
+        self.max_leaders = max_leaders
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.block_size = block_size
+        self.bands, self.rows_per_band = _lsh_bands(num_perm, threshold)
+        rng = np.random.default_rng(random_state)
+        self.perm_a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.perm_b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.band_coefs = rng.integers(1, 1 << 31, size=self.rows_per_band, dtype=np.uint64)
+
+    def _signatures(self, shingle_sets):
+        """MinHash подписи (документы x num_perm); пустым множествам - MAX_HASH"""
+        signatures = np.full((len(shingle_sets), self.num_perm), MAX_HASH, dtype=np.uint64)
+        for start in range(0, len(shingle_sets), self.block_size):
+            block = shingle_sets[start:start + self.block_size]
+            lengths = np.array([len(s) for s in block])
+            non_empty = np.flatnonzero(lengths)
+            if not len(non_empty):
+                continue
+            hashes = np.fromiter(
+                (zlib.crc32(shingle.encode('utf-8')) for i in non_empty for shingle in block[i]),
+                dtype=np.uint64, count=int(lengths.sum())
+            )
+            # (a * h + b) mod p, усеченное до 32 бит (переполнение uint64 допустимо, как в datasketch);
+            # минимум по n-граммам каждого документа
+            permuted = (np.outer(hashes, self.perm_a) + self.perm_b) % np.uint64(MERSENNE_PRIME) & np.uint64(MAX_HASH)
+            offsets = np.concatenate([[0], np.cumsum(lengths[non_empty])[:-1]])
+            signatures[start + non_empty] = np.minimum.reduceat(permuted, offsets, axis=0)
+        return signatures
+
+    def group(self, texts):
+        """Номер представителя группы для каждого текста (позиция в texts)"""
+        texts = ['' if t is None else str(t) for t in texts]
+        representative = np.arange(len(texts))
+
+        # Точные совпадения; пустые тексты не группируются
+        first_position = {}
+        unique_positions = []
+        for i, text in enumerate(texts):
+            if not text.strip():
+                continue
+            if text in first_position:
+                representative[i] = first_position[text]
+            else:
+                first_position[text] = i
+                unique_positions.append(i)
+
+        shingle_sets = [_shingles(texts[i], self.shingle_size) for i in unique_positions]
+        signatures = self._signatures(shingle_sets)
+        union_find = _UnionFind(len(unique_positions))
+
+        for band in range(self.bands):
+            columns = signatures[:, band * self.rows_per_band:(band + 1) * self.rows_per_band]
+            keys = columns @ self.band_coefs
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            bucket_starts = np.flatnonzero(np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]]))
+            bucket_ends = np.append(bucket_starts[1:], len(order))
+            for start, end in zip(bucket_starts, bucket_ends):
+                if end - start < 2:
+                    continue
+                # Лидеры корзины: член корзины сравнивается с ними и присоединяется к первому
+                # похожему, иначе сам становится лидером (не больше max_leaders сравнений)
+                leaders = [order[start]]
+                for member in order[start + 1:end]:
+                    for leader in leaders:
+                        if union_find.find(leader) == union_find.find(member):
+                            break
+                        a, b = shingle_sets[leader], shingle_sets[member]
+                        if a and b and len(a & b) / len(a | b) >= self.threshold:
+                            union_find.union(leader, member)
+                            break
+                    else:
+                        if len(leaders) < self.max_leaders:
+                            leaders.append(member)
+
+        unique_positions = np.array(unique_positions, dtype=np.int64)
+        roots = np.array([union_find.find(i) for i in range(len(unique_positions))], dtype=np.int64)
+        unique_representative = unique_positions[roots] if len(roots) else unique_positions
+        position_to_unique = np.empty(len(texts), dtype=np.int64)
+        position_to_unique[unique_positions] = np.arange(len(unique_positions))
+        grouped = np.array([i for i, text in enumerate(texts) if text.strip()], dtype=np.int64)
+        representative[grouped] = unique_representative[position_to_unique[representative[grouped]]]
+        return representative
+
+    def collapse(self, texts):
+        """(позиции представителей, веса = размеры групп, индекс представителя для каждой строки)"""
+        representative = self.group(texts)
+        positions, inverse, weights = np.unique(representative, return_inverse=True, return_counts=True)
+        return positions, weights, inverse
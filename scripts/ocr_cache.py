@@ -0,0 +1,110 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class OCRResultCache:
+    """Локальный кэш результатов OCR в SQLite.
+
+    Ключ - SHA-256 от байтов PNG и строки конфигурации OCR, поэтому одинаковые
+    скриншоты при повторных запусках и ретраях не отправляются в Tesseract повторно.
+    Размер кэша ограничен max_bytes, при переполнении удаляются записи,
+    к которым дольше всего не обращались (LRU). Общий размер ведется счетчиком
+    (считается один раз при открытии), время обращений при попаданиях копится в памяти
+    и записывается вместе со следующей вставкой (в ее транзакции) или при закрытии.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ocr_results (
+                cache_key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_results_last_access ON ocr_results (last_access)")
+        self._conn.commit()
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM ocr_results").fetchone()[0]
+        self._pending_access = {}
+
+    @staticmethod
+    def make_key(image_bytes: bytes, ocr_config: str) -> str:
+        """Ключ кэша: хэш содержимого изображения + конфигурация OCR"""
+        digest = hashlib.sha256()
+        digest.update(ocr_config.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM ocr_results WHERE cache_key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._pending_access[key] = time.time()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, text: str):
+        size_bytes = len(text.encode('utf-8'))
+        if size_bytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._conn.execute("SELECT size_bytes FROM ocr_results WHERE cache_key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_results (cache_key, text, size_bytes, last_access) VALUES (?, ?, ?, ?)",
+                (key, text, size_bytes, time.time())
+            )
+            self._pending_access.pop(key, None)
+            self._flush_access()
+            self.total_bytes += size_bytes - (previous[0] if previous else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _flush_access(self):
+        if self._pending_access:
+            self._conn.executemany("UPDATE ocr_results SET last_access = ? WHERE cache_key = ?",
+                                   [(accessed, key) for key, accessed in self._pending_access.items()])
+            self._pending_access.clear()
+
+    def _evict(self):
+        """Удаляет самые старые записи, пока кэш не уложится в лимит"""
+        cursor = self._conn.execute("SELECT cache_key, size_bytes FROM ocr_results ORDER BY last_access ASC")
+        to_delete = []
+        for cache_key, size_bytes in cursor:
+            if self.total_bytes <= self.max_bytes:
+                break
+            to_delete.append((cache_key,))
+            self.total_bytes -= size_bytes
+        self._conn.executemany("DELETE FROM ocr_results WHERE cache_key = ?", to_delete)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "ocr_cache_hits": self.hits,
+            "ocr_cache_misses": self.misses,
+            "ocr_cache_hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,141 @@
+import io
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import requests
+
+# fetch_range(start, end) -> bytes, границы включительно (как в заголовке Range)
+RangeFetcher = Callable[[int, int], bytes]
+
+
+class RangeReader(io.RawIOBase):
+    """Seekable файл поверх HTTP Range запросов с небольшим LRU кэшем блоков.
+
+    zipfile.ZipFile читает через него центральный каталог в конце архива и затем
+    только те члены архива, которые открыты, поэтому архив целиком не скачивается,
+    а память ограничена max_cached_blocks * block_size (плюс читаемый член архива).
+    """
+
+    def __init__(self, fetch_range: RangeFetcher, size: int,
+                 block_size: int = 128 * 1024, max_cached_blocks: int = 8):
+        super().__init__()
+        self.fetch_range = fetch_range
+        self.size = size
+        self.block_size = block_size
+        self.max_cached_blocks = max_cached_blocks
+        self.position = 0
+        self.bytes_fetched = 0
+        self.range_requests = 0
+        self._blocks = OrderedDict()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Некорректный whence: {whence}")
+        if position < 0:
+            raise ValueError(f"Отрицательная позиция: {position}")
+        self.position = position
+        return self.position
+
+    def _store_block(self, index, data):
+        self._blocks[index] = data
+        self._blocks.move_to_end(index)
+        while len(self._blocks) > self.max_cached_blocks:
+            self._blocks.popitem(last=False)
+
+    def _fetch_blocks(self, first_block, last_block):
+        """Один Range запрос на непрерывный диапазон отсутствующих в кэше блоков"""
+        start = first_block * self.block_size
+        end = min((last_block + 1) * self.block_size, self.size) - 1
+        data = self.fetch_range(start, end)
+        if len(data) != end - start + 1:
+            raise IOError(f"Range {start}-{end}: ожидалось {end - start + 1} байт, получено {len(data)}")
+        self.range_requests += 1
+        self.bytes_fetched += len(data)
+
+        blocks = {}
+        for index in range(first_block, last_block + 1):
+            offset = (index - first_block) * self.block_size
+            blocks[index] = data[offset:offset + self.block_size]
+            self._store_block(index, blocks[index])
+        return blocks
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        end = min(self.position + size, self.size)
+        if self.position >= end:
+            return b''
+
+        chunks = []
+        last_block = (end - 1) // self.block_size
+        fetched = {}
+        while self.position < end:
+            index = self.position // self.block_size
+            block = fetched.get(index)
+            if block is None and index in self._blocks:
+                block = self._blocks[index]
+                self._blocks.move_to_end(index)
+            if block is None:
+                run_end = index
+                while run_end < last_block and run_end + 1 not in self._blocks:
+                    run_end += 1
+                fetched = self._fetch_blocks(index, run_end)
+                block = fetched[index]
+
+            offset = self.position - index * self.block_size
+            chunk = block[offset:offset + end - self.position]
+            chunks.append(chunk)
+            self.position += len(chunk)
+        return b''.join(chunks)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def stats(self) -> dict:
+        return {"bytes_fetched": self.bytes_fetched, "range_requests": self.range_requests, "size": self.size}
+
+
+def drive_range_fetcher(drive_service, file_id) -> RangeFetcher:
+    """Range запросы к Google Drive через files().get_media"""
+    def fetch(start, end):
+        request = drive_service.files().get_media(fileId=file_id)
+        request.headers['Range'] = f'bytes={start}-{end}'
+        return request.execute()
+    return fetch
+
+
+def http_range_fetcher(url: str, session: Optional[requests.Session] = None, timeout: int = 60) -> RangeFetcher:
+    """Range запросы к произвольному HTTP источнику (например, локальному стенду)"""
+    session = session or requests.Session()
+
+    def fetch(start, end):
+        response = session.get(url, headers={'Range': f'bytes={start}-{end}'}, timeout=timeout)
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise IOError(f"Сервер не поддерживает Range запросы: HTTP {response.status_code}")
+        return response.content
+    return fetch
+
+
+def http_content_length(url: str, session: Optional[requests.Session] = None, timeout: int = 60) -> int:
+    session = session or requests.Session()
+    response = session.head(url, timeout=timeout)
+    response.raise_for_status()
+    return int(response.headers['Content-Length'])
@@ -37,6 +37,8 @@ except ImportError:
         BQ_TABLE_ID = os.environ.get('BQ_TABLE_ID', 'session_replay_urls')
     settings = MockSettings()
 
+from scripts.bq_io import BigQueryReader, format_bytes, make_storage_client
+
 # Константы - ОПТИМИЗИРОВАНЫ ДЛЯ ПАМЯТИ
 PROCESS_TIMEOUT = 120  # Уменьшено до 2 минут для быстрой очистки зависших процессов
 USER_AGENTS = [
@@ -153,6 +155,9 @@ def worker_process_url(url_data, collector_config, safety_settings, result_queue
         
         collector_config['verbose'] = False
         collector_config['temp_dir'] = temp_dir
+        # Бюджет BigQuery проверяет основной процесс перед запуском каждого URL: у процесса
+        # отметка URL идет без dry run и без запроса расхода за день
+        collector_config['bq_check_budget'] = False
         collector = RenderScreenshotCollector(config_override=collector_config)
         sanitized_cookies = sanitize_cookies(collector.cookies)
 
@@ -233,14 +238,15 @@ def worker_process_url(url_data, collector_config, safety_settings, result_queue
 
             success, _ = collector.process_single_url(page, url_data, safety_settings)
             if success:
-                collector.mark_url_as_processed(url_data['url'], success)
-            result_queue.put(success)
+                collector.mark_url_as_processed(url_data, success)
+            # Байты BigQuery процесса учитываются в бюджете и статистике основного сборщика
+            result_queue.put((success, collector.bq_reader.cost_report()))
             
             print(f"✅ Процесс PID {process_pid} завершил обработку URL")
 
     except Exception as e:
         print(f"❌ [Критическая ошибка в процессе PID {os.getpid()}] URL: {url_data.get('url', 'N/A')}. Ошибка: {e}")
-        result_queue.put(False)
+        result_queue.put((False, {}))
     finally:
         # КРИТИЧНО: СТРОГАЯ ОЧИСТКА РЕСУРСОВ
         process_pid = os.getpid()
@@ -296,6 +302,7 @@ class RenderScreenshotCollector:
             self.temp_dir = config_override.get("temp_dir", tempfile.mkdtemp())
             self.status_callback = None
             self.verbose = config_override.get('verbose', True)
+            self.bq_check_budget = config_override.get('bq_check_budget', True)
             self.cookies = self._load_cookies_from_secret_file(verbose=False)
         else:
             self.status_callback = status_callback
@@ -308,6 +315,7 @@ class RenderScreenshotCollector:
             self.min_duration_seconds = int(os.environ.get('MIN_DURATION_SECONDS', '20'))
             self.max_duration_seconds = int(os.environ.get('MAX_DURATION_SECONDS', '3600'))
             self.verbose = True
+            self.bq_check_budget = True
             self.start_time = None
             self.total_processed, self.total_successful, self.total_failed, self.total_timeouts = 0, 0, 0, 0
             
@@ -397,6 +405,8 @@ class RenderScreenshotCollector:
             credentials = service_account.Credentials.from_service_account_file(
                 self.credentials_path, scopes=["https://www.googleapis.com/auth/bigquery"])
             self.bq_client = bigquery.Client(credentials=credentials, project=self.bq_project_id)
+            self.bq_reader = BigQueryReader(self.bq_client, make_storage_client(credentials), stage='replay_screenshots',
+                                            check_budget=self.bq_check_budget)
             if self.verbose:
                 self._update_status("✅ BigQuery подключен", 4)
         except Exception as e:
@@ -414,19 +424,27 @@ class RenderScreenshotCollector:
             raise Exception(f"❌ Ошибка подключения к Google Drive: {e}")
 
     def get_unprocessed_urls(self, limit=None):
-        """Получение необработанных URL с фильтром по длительности сессии"""
+        """Получение необработанных URL с фильтром по длительности сессии.
+
+        Сессии, не попавшие в выборку при сборе (sampling_selected = FALSE), пропускаются;
+        NULL - собраны без выборки. Колонку добавляет сборщик ссылок, поэтому условие
+        есть, только если она уже есть в таблице.
+        """
+        sampling_filter = ""
+        if self.bq_reader.has_column(self.full_table_name, 'sampling_selected'):
+            sampling_filter = "\n        AND sampling_selected IS NOT FALSE"
         query = f"""
         SELECT 
-            session_replay_url,
+            session_replay_url AS url,
             amplitude_id,
             session_replay_id,
             duration_seconds,
             events_count,
-            record_date
+            CAST(record_date AS STRING) AS record_date
         FROM {self.full_table_name}
-        WHERE is_processed = FALSE
+        WHERE is_processed = FALSE{sampling_filter}
         AND duration_seconds >= {self.min_duration_seconds}
-        AND duration_seconds <= {self.max_duration_seconds}
+        AND duration_seconds <= {self.max_duration_seconds}{self.bq_reader.recent_partitions(self.full_table_name)}
         ORDER BY record_date DESC
         """
         if limit:
@@ -437,17 +455,8 @@ class RenderScreenshotCollector:
             print(f"⏱️ Длительность сессий: от {self.min_duration_seconds} до {self.max_duration_seconds} сек")
 
         try:
-            result = self.bq_client.query(query).result()
-            urls_data = []
-            for row in result:
-                urls_data.append({
-                    'url': row.session_replay_url,
-                    'amplitude_id': row.amplitude_id,
-                    'session_replay_id': row.session_replay_id,
-                    'duration_seconds': row.duration_seconds,
-                    'events_count': row.events_count,
-                    'record_date': row.record_date.strftime('%Y-%m-%d') if hasattr(row.record_date, 'strftime') else str(row.record_date)
-                })
+            # Колоночное чтение; дата форматируется в запросе (YYYY-MM-DD), а не для каждой строки в Python
+            urls_data = self.bq_reader.query_records(query, description="Необработанные URL")
             if self.verbose:
                 print(f"📊 Найдено {len(urls_data)} необработанных URL")
             return urls_data
@@ -455,18 +464,27 @@ class RenderScreenshotCollector:
             print(f"❌ Ошибка получения URL: {e}")
             raise
 
-    def mark_url_as_processed(self, url, success=True):
-        """Отметка URL как обработанного в BigQuery"""
+    def mark_url_as_processed(self, url_data, success=True):
+        """Отметка URL как обработанного в BigQuery.
+
+        Дата сессии и состояние сужают UPDATE до одной партиции record_date и блоков
+        кластеризации с is_processed = FALSE вместо полного сканирования таблицы.
+        Строка без record_date отмечается только по URL: условие на дату ее бы не нашло.
+        """
         try:
+            query_parameters = [bigquery.ScalarQueryParameter("url", "STRING", url_data['url'])]
+            date_filter = ""
+            if url_data.get('record_date'):
+                date_filter = "\n            AND record_date = @record_date"
+                query_parameters.append(bigquery.ScalarQueryParameter("record_date", "DATE", url_data['record_date']))
             update_query = f"""
             UPDATE {self.full_table_name} 
             SET is_processed = TRUE 
-            WHERE session_replay_url = @url
+            WHERE session_replay_url = @url{date_filter}
+            AND is_processed = FALSE
             """
-            job_config = bigquery.QueryJobConfig(
-                query_parameters=[bigquery.ScalarQueryParameter("url", "STRING", url)]
-            )
-            self.bq_client.query(update_query, job_config=job_config).result()
+            job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+            self.bq_reader.run(update_query, job_config, description="Отметка URL")
             status_message = "✅ URL отмечен как обработанный" if success else "⚠️ URL отмечен как обработанный (с ошибкой)"
             if self.verbose:
                 print(status_message)
@@ -1314,6 +1332,10 @@ class RenderScreenshotCollector:
         }
         
         for i, url_data in enumerate(urls_batch, 1):
+            if self.bq_budget_exhausted():
+                print(f"💸 Бюджет BigQuery исчерпан, остальные URL батча ({len(urls_batch) - i + 1}) - в следующий запуск")
+                break
+
             # Мониторим память перед каждым URL
             current_memory = self.monitor_memory_usage()
             
@@ -1344,10 +1366,11 @@ class RenderScreenshotCollector:
                 process.join()
                 batch_timeouts += 1
                 batch_failed += 1
-                self.mark_url_as_processed(url_data['url'], success=False)
+                self.mark_url_as_processed(url_data, success=False)
             else:
                 try:
-                    success = result_queue.get_nowait()
+                    success, cost = result_queue.get_nowait()
+                    self.bq_reader.add_cost(cost)
                     if success:
                         batch_successful += 1
                         print("✅ URL успешно обработан.")
@@ -1356,7 +1379,7 @@ class RenderScreenshotCollector:
                         print("❌ Ошибка при обработке URL.")
                 except queue.Empty:
                     batch_failed += 1
-                    self.mark_url_as_processed(url_data['url'], success=False)
+                    self.mark_url_as_processed(url_data, success=False)
                     print("❌ Процесс завершился без результата.")
 
             # Очищаем очередь
@@ -1378,7 +1401,7 @@ class RenderScreenshotCollector:
                 self.print_progress(i, len(urls_batch), batch_start_time, batch_successful, batch_failed, batch_timeouts)
 
         # Обновляем общую статистику
-        self.total_processed += len(urls_batch)
+        self.total_processed += batch_successful + batch_failed
         self.total_successful += batch_successful
         self.total_failed += batch_failed
         self.total_timeouts += batch_timeouts
@@ -1391,6 +1414,11 @@ class RenderScreenshotCollector:
         print(f"📊 [Успешно: {batch_successful}, Ошибок: {batch_failed}, Зависаний: {batch_timeouts}]")
         print(f"💾 Память: было {initial_memory:.1f} MB, стало {final_memory:.1f} MB (разница: {memory_diff:+.1f} MB)")
 
+    def bq_budget_exhausted(self):
+        """Бюджет BigQuery этапа или дня израсходован (отметки URL тоже оплачиваются)"""
+        remaining = self.bq_reader.remaining_budget_bytes()
+        return remaining is not None and remaining <= 0
+
     def run(self):
         """Запуск обработки - оптимизированная версия"""
         self.start_time = time.time()
@@ -1407,7 +1435,7 @@ class RenderScreenshotCollector:
         urls_data = self.get_unprocessed_urls()
         if not urls_data:
             print("🎉 Все URL уже обработаны!")
-            return
+            return {"status": "no_urls", "total_processed": 0, **self.bq_reader.cost_report()}
 
         count_to_process = self.get_url_count(len(urls_data))
         urls_to_process = urls_data[:count_to_process]
@@ -1418,6 +1446,9 @@ class RenderScreenshotCollector:
 
         try:
             for i in range(0, len(urls_to_process), safety_settings['batch_size']):
+                if self.bq_budget_exhausted():
+                    print("💸 Бюджет BigQuery исчерпан - остальные URL в следующий запуск")
+                    break
                 batch = urls_to_process[i:i + safety_settings['batch_size']]
                 
                 print(f"\n{'='*20} БАТЧ {(i//safety_settings['batch_size'])+1} {'='*20}")
@@ -1439,6 +1470,14 @@ class RenderScreenshotCollector:
             traceback.print_exc()
         
         self.print_overall_stats()
+        return {
+            "status": "completed",
+            "total_processed": self.total_processed,
+            "successful": self.total_successful,
+            "failed": self.total_failed,
+            "timeouts": self.total_timeouts,
+            **self.bq_reader.cost_report(),
+        }
 
     def print_overall_stats(self):
         """Вывод общей статистики"""
@@ -1464,6 +1503,7 @@ class RenderScreenshotCollector:
                 print(f"⚡ Среднее время на URL: {avg_time_per_url:.1f} сек")
             print(f"☁️ Все успешные результаты загружены в Google Drive.")
             print(f"💾 Статусы обновлены в BigQuery.")
+            print(f"💰 BigQuery: оплачено {format_bytes(self.bq_reader.bytes_billed)} за {self.bq_reader.queries} запросов")
             print("=" * 60)
 
 def main():
@@ -0,0 +1,302 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags, hstack, vstack
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer, TfidfVectorizer
+from sklearn.preprocessing import StandardScaler, normalize
+from sklearn.utils.extmath import row_norms
+from threadpoolctl import threadpool_limits
+
+
+def nearest_centroid(features, centers):
+    """Ближайший центр через одно матричное умножение: ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2.
+
+    Работает и с разреженной, и с плотной матрицей; возвращает (номера центров, расстояния).
+    """
+    centers = np.asarray(centers, dtype=features.dtype)
+    squared = -2 * np.asarray(features @ centers.T)
+    squared += (centers ** 2).sum(axis=1)[None, :]
+    labels = squared.argmin(axis=1)
+    nearest = squared[np.arange(squared.shape[0]), labels] + row_norms(features, squared=True)
+    return labels, np.sqrt(np.maximum(nearest, 0))
+
+
+class TfidfSessionClusterer:
+    """Пакетная модель: TfidfVectorizer со словарем + StandardScaler + KMeans на плотной матрице.
+
+    Обучается на всех строках сразу (fit_predict); после обучения transform / predict
+    работают по частям и без уплотнения, поэтому модель можно сохранить и применять к новым строкам.
+    """
+
+    def __init__(self, n_clusters: int, max_features: int = 1000, max_df: float = 0.8, random_state: int = 42):
+        self.random_state = random_state
+        self.vectorizer = TfidfVectorizer(max_features=max_features, min_df=1, max_df=max_df)
+        self.scaler = StandardScaler()
+        self.set_n_clusters(n_clusters)
+
+    def set_n_clusters(self, n_clusters: int):
+        self.n_clusters = n_clusters
+        self.kmeans = KMeans(n_clusters=n_clusters, random_state=self.random_state, n_init=10)
+
+    def fit_features(self, texts, numeric):
+        """Обучает словарь и scaler, возвращает объединенную разреженную матрицу признаков"""
+        text_features = self.vectorizer.fit_transform(texts)
+        numeric_features = self.scaler.fit_transform(numeric)
+        return hstack([text_features, numeric_features], format='csr')
+
+    def fit_clusters(self, combined_features, sample_weight=None):
+        return self.kmeans.fit_predict(combined_features.toarray(), sample_weight=sample_weight)
+
+    def fit_predict(self, texts, numeric):
+        return self.fit_clusters(self.fit_features(texts, numeric))
+
+    def transform(self, texts, numeric):
+        text_features = self.vectorizer.transform(texts)
+        numeric_features = csr_matrix(self.scaler.transform(numeric))
+        return hstack([text_features, numeric_features], format='csr')
+
+    def predict(self, texts, numeric):
+        return self.kmeans.predict(self.transform(texts, numeric))
+
+
+class SvdSessionClusterer:
+    """Пакетная модель на компактном представлении: HashingVectorizer (без словаря) + TF-IDF +
+    TruncatedSVD до n_components измерений, объединенные с масштабированными числовыми признаками.
+
+    KMeans работает на плотной float32 матрице строки x (n_components + числовые) вместо
+    ~1000 float64 измерений TF-IDF, а разметка новых строк - одно матричное умножение (nearest_centroid).
+    """
+
+    def __init__(self, n_clusters: int, n_components: int = 100, n_features: int = 2 ** 16,
+                 random_state: int = 42):
+        self.random_state = random_state
+        self.hasher = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+        self.tfidf = TfidfTransformer()
+        self.svd = TruncatedSVD(n_components=n_components, random_state=random_state)
+        self.scaler = StandardScaler()
+        self.set_n_clusters(n_clusters)
+
+    def set_n_clusters(self, n_clusters: int):
+        self.n_clusters = n_clusters
+        self.kmeans = KMeans(n_clusters=n_clusters, random_state=self.random_state, n_init=10)
+
+    def fit_features(self, texts, numeric):
+        tfidf = self.tfidf.fit_transform(self.hasher.transform(texts))
+        # SVD не может дать больше измерений, чем признаков у матрицы
+        self.svd.n_components = max(1, min(self.svd.n_components, min(tfidf.shape) - 1))
+        text_features = normalize(self.svd.fit_transform(tfidf))
+        numeric_features = self.scaler.fit_transform(numeric)
+        return np.hstack([text_features, numeric_features]).astype(np.float32)
+
+    def fit_clusters(self, features, sample_weight=None):
+        return self.kmeans.fit_predict(features, sample_weight=sample_weight)
+
+    def fit_predict(self, texts, numeric):
+        return self.fit_clusters(self.fit_features(texts, numeric))
+
+    def transform(self, texts, numeric):
+        text_features = normalize(self.svd.transform(self.tfidf.transform(self.hasher.transform(texts))))
+        numeric_features = self.scaler.transform(numeric)
+        return np.hstack([text_features, numeric_features]).astype(np.float32)
+
+    def predict(self, texts, numeric):
+        labels, _ = nearest_centroid(self.transform(texts, numeric), self.kmeans.cluster_centers_)
+        return labels
+
+
+class StreamingSessionClusterer:
+    """Кластеризация сессий по частям: данные остаются разреженными (CSR) от начала до конца.
+
+    Словарь TF-IDF нельзя построить, не увидев все строки, поэтому тексты хэшируются
+    (HashingVectorizer не хранит состояния), а IDF и параметры StandardScaler
+    собираются первым проходом по частям (observe). Вторым проходом (partial_fit)
+    MiniBatchKMeans обучается на мини-батчах; память ограничена размером части,
+    а не объемом данных. Порог max_df повторяет TfidfVectorizer(max_df=0.8) пакетного режима.
+    """
+
+    def __init__(self, n_clusters: int, n_features: int = 2 ** 14, max_df: float = 0.8,
+                 batch_size: int = 4096, random_state: int = 42):
+        self.max_df = max_df
+        self.batch_size = batch_size
+        self.random_state = random_state
+        self.hasher = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+        self.scaler = StandardScaler()
+        self.set_n_clusters(n_clusters)
+        self.document_frequency = np.zeros(n_features, dtype=np.int64)
+        self.n_documents = 0
+        self.idf = None
+        self._pending = None
+
+    def set_n_clusters(self, n_clusters: int):
+        """Число кластеров можно поменять до первого partial_fit (например, после подбора k)"""
+        self.n_clusters = n_clusters
+        self.kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=self.batch_size,
+                                      random_state=self.random_state, n_init=3)
+
+    # === Проход 1: статистика для IDF и масштабирования ===
+
+    def observe(self, texts, numeric):
+        counts = self.hasher.transform(texts)
+        self.document_frequency += np.bincount(counts.indices, minlength=counts.shape[1])
+        self.n_documents += counts.shape[0]
+        self.scaler.partial_fit(numeric)
+
+    def finalize_statistics(self):
+        """IDF как в TfidfTransformer(smooth_idf=True); слишком частые токены (max_df) обнуляются"""
+        n = self.n_documents
+        idf = np.log((1 + n) / (1 + self.document_frequency)) + 1.0
+        idf[self.document_frequency > self.max_df * n] = 0.0
+        self.idf = diags(idf)
+
+    # === Проход 2: обучение и разметка ===
+
+    def transform(self, texts, numeric):
+        text_features = normalize(self.hasher.transform(texts) @ self.idf)
+        numeric_features = csr_matrix(self.scaler.transform(numeric))
+        return hstack([text_features, numeric_features], format='csr')
+
+    def partial_fit(self, texts, numeric, sample_weight=None):
+        features = self.transform(texts, numeric)
+        weights = np.ones(features.shape[0]) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+        if not hasattr(self.kmeans, 'cluster_centers_'):
+            # Первый partial_fit инициализирует центры и требует не меньше n_clusters строк
+            if self._pending is not None:
+                features = vstack([self._pending[0], features], format='csr')
+                weights = np.concatenate([self._pending[1], weights])
+                self._pending = None
+            if features.shape[0] < self.n_clusters:
+                self._pending = (features, weights)
+                return
+        for start in range(0, features.shape[0], self.batch_size):
+            self.kmeans.partial_fit(features[start:start + self.batch_size],
+                                    sample_weight=weights[start:start + self.batch_size])
+
+    def finish_training(self):
+        """Конец прохода 2: если всех строк (представителей) оказалось меньше n_clusters,
+        центры еще не инициализированы - обучаемся на отложенных строках с k = их числу"""
+        if hasattr(self.kmeans, 'cluster_centers_'):
+            return
+        if self._pending is None:
+            raise ValueError("Нет строк для обучения MiniBatchKMeans: partial_fit не получил ни одной строки")
+        features, weights = self._pending
+        self._pending = None
+        self.set_n_clusters(features.shape[0])
+        self.kmeans.partial_fit(features, sample_weight=weights)
+
+    def predict(self, texts, numeric):
+        return self.kmeans.predict(self.transform(texts, numeric))
+
+
+def fit_partition(texts, numeric, sample_weight, n_clusters, feature_pipeline='tfidf', svd_components=100, threads=1):
+    """Обучение кластеризатора одной партиции (выполняется в отдельном процессе).
+
+    threads ограничивает потоки BLAS/OpenMP в процессе: иначе каждый из параллельных
+    процессов KMeans займет все ядра и они будут мешать друг другу.
+    """
+    start = time.perf_counter()
+    with threadpool_limits(limits=threads):
+        if feature_pipeline == 'svd':
+            clusterer = SvdSessionClusterer(n_clusters=n_clusters, n_components=svd_components)
+        else:
+            # max_df=0.8 на паре документов отсекает весь словарь
+            clusterer = TfidfSessionClusterer(n_clusters=n_clusters, max_df=0.8 if len(texts) >= 10 else 1.0)
+        labels = clusterer.fit_clusters(clusterer.fit_features(texts, numeric), sample_weight=sample_weight)
+    return clusterer, labels, time.perf_counter() - start
+
+
+class PartitionedSessionClusterer:
+    """Двухуровневая модель: строки делятся по правиловой категории (smart_category / problem_source),
+    у каждой партиции свой векторизатор и небольшой KMeans.
+
+    Партиции обучаются параллельно в отдельных процессах, поэтому пиковая память процесса
+    обучения ограничена самой большой партицией. Номера кластеров глобально уникальны:
+    кластеры партиции сдвигаются на сумму кластеров предыдущих партиций.
+    Маленькие партиции и партиции без слов в текстах объединяются в общую (OTHER_PARTITION).
+    """
+
+    OTHER_PARTITION = '__other__'
+
+    def __init__(self, partition_column: str, max_clusters: int = 4, min_rows: int = 50,
+                 feature_pipeline: str = 'tfidf', svd_components: int = 100):
+        self.partition_column = partition_column
+        self.max_clusters = max_clusters
+        self.min_rows = min_rows
+        self.feature_pipeline = feature_pipeline
+        self.svd_components = svd_components
+        self.clusterers = {}
+        self.offsets = {}
+        self.mapping = {}
+        self.fallback_partition = None
+        self.fit_seconds = {}
+
+    def plan(self, partitions, texts):
+        """Итоговая партиция для каждого значения ключа"""
+        partitions = np.asarray(partitions, dtype=object)
+        has_words = np.array([bool(t.strip()) for t in texts])
+        values, counts = np.unique(partitions, return_counts=True)
+        sizes = dict(zip(values, counts))
+        usable = [v for v in values if sizes[v] >= self.min_rows and has_words[partitions == v].any()]
+        if not usable:
+            return {value: self.OTHER_PARTITION for value in values}
+
+        mapping = {value: value if value in usable else self.OTHER_PARTITION for value in values}
+        other_mask = np.isin(partitions, [v for v in values if v not in usable])
+        if other_mask.any() and (other_mask.sum() < self.min_rows or not has_words[other_mask].any()):
+            # Общая партиция тоже слишком мала - присоединяем ее к самой большой
+            largest = max(usable, key=lambda v: sizes[v])
+            mapping = {value: value if value in usable else largest for value in values}
+        return mapping
+
+    def fit(self, texts, numeric, partitions, sample_weight=None, max_workers=None):
+        """Параллельное обучение по партициям; возвращает глобальные номера кластеров"""
+        mapping = self.plan(partitions, texts)
+        effective = np.array([mapping[p] for p in partitions], dtype=object)
+        weights = np.ones(len(texts)) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+
+        max_workers = max_workers or os.cpu_count() or 1
+        threads = max(1, (os.cpu_count() or 1) // max_workers)
+        jobs = {}
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for partition in sorted(set(effective)):
+                rows = np.flatnonzero(effective == partition)
+                n_clusters = max(1, min(self.max_clusters, len(rows) // 2))
+                jobs[partition] = (rows, executor.submit(
+                    fit_partition, [texts[i] for i in rows], numeric[rows], weights[rows],
+                    n_clusters, self.feature_pipeline, self.svd_components, threads
+                ))
+
+            labels = np.empty(len(texts), dtype=np.int64)
+            offset = 0
+            for partition, (rows, future) in jobs.items():
+                clusterer, partition_labels, seconds = future.result()
+                self.clusterers[partition] = clusterer
+                self.offsets[partition] = offset
+                self.fit_seconds[partition] = round(seconds, 2)
+                labels[rows] = partition_labels + offset
+                offset += clusterer.n_clusters
+
+        self.mapping = mapping
+        self.fallback_partition = max(jobs, key=lambda p: len(jobs[p][0]))
+        return labels
+
+    @property
+    def n_clusters(self):
+        return sum(clusterer.n_clusters for clusterer in self.clusterers.values())
+
+    def assign(self, texts, numeric, partitions):
+        """Глобальные номера кластеров и расстояния; новые значения ключа - в самую большую партицию"""
+        effective = np.array([self.mapping.get(p, self.fallback_partition) for p in partitions], dtype=object)
+        labels = np.empty(len(texts), dtype=np.int64)
+        distances = np.empty(len(texts))
+        for partition in set(effective):
+            rows = np.flatnonzero(effective == partition)
+            clusterer = self.clusterers[partition]
+            features = clusterer.transform([texts[i] for i in rows], numeric[rows])
+            partition_labels, partition_distances = nearest_centroid(features, clusterer.kmeans.cluster_centers_)
+            labels[rows] = partition_labels + self.offsets[partition]
+            distances[rows] = partition_distances
+        return labels, distances
@@ -0,0 +1,256 @@
+import re
+
+import pandas as pd
+
+# === Скомпилированные наборы паттернов ===
+# Каждый набор "технических" строк собирается один раз в одну альтернацию:
+# re.search по альтернации находит совпадение тогда и только тогда,
+# когда совпадает хотя бы один из исходных паттернов.
+
+
+def _alternation(patterns, flags=0):
+    return re.compile('|'.join(f'(?:{p})' for p in patterns), flags)
+
+
+SUMMARY_TECHNICAL_RE = _alternation([
+    r'^[A-Za-z0-9]{6,20}$', r'^[0-9,.\s<an>]+$', r'^[0-9]+\.$',
+    r'Session Length', r'Device Type', r'Event Total', r'Amplitude AI',
+    r'ReplaySummary', r'Events \+\}', r'Powered by',
+    r'^[0-9]+[hms]\s*[0-9]*\s*(?:Android|iOS|Windows|Apple iPhone)$',
+    r'^[0-9]+\s+(?:Russia|France|Spain|Germany)', r'^\d+[hms]\s+\d+$',
+    r'^.*Russia.*<[an]$', r'^.*Android$', r'^.*Windows$', r'^.*Apple iPhone$',
+    r'^Summary\s*$', r'^[A-Z]{2,5}\s*$', r'^\d{1,3}$', r'^[*%+\}\s]+$',
+    r'^Recent\s*v\s*Favorites', r'^Q\s*Search',
+], re.IGNORECASE)
+
+SENTIMENT_TECHNICAL_RE = _alternation([
+    r'^[A-Za-z0-9]{6,20}$', r'^Sentiment\s*$', r'^[A-Z]{2,5}\s*$',
+    r'^\d{1,3}$', r'^[*%+\}\s]+$',
+], re.IGNORECASE)
+
+ACTIONS_TECHNICAL_RE = _alternation([
+    r'^[A-Za-z0-9]{6,20}$', r'^Actions?\s*$', r'^ActIONS?\s*$',
+    r'^AC\s*$', r'^[A-Z]{2,5}\s*$', r'^\d{1,3}$', r'^[*%+\}\s]+$',
+    r'^Recent\s*v\s*Favorites', r'^Q\s*Search',
+], re.IGNORECASE)
+
+SUMMARY_CONTENT_RE = re.compile(r'[a-zA-Z].*[a-zA-Z]')
+SUMMARY_HIGHLIGHTS_RE = re.compile(r'(.+?)(?:\n\s*Highlights|\s+Highlights)', re.DOTALL)
+SENTIMENT_HEADER_RE = re.compile(r'^\s*Sentiment\s*\n*', re.IGNORECASE)
+SENTIMENT_CONTENT_RE = re.compile(r'(?:user|demonstrated|appeared|showed|felt|experienced)', re.IGNORECASE)
+ACTIONS_HEADER_RE = re.compile(r'^\s*(?:Actions?|ActIONS?|AC)\s*\n*', re.IGNORECASE)
+ACTIONS_CONTENT_RE = re.compile(r'(?:consider|provide|add|improve|investigate|enhance|create|implement)', re.IGNORECASE)
+ACTIONS_FALLBACK_RES = [re.compile(r'^Recent.*?\n', re.MULTILINE), re.compile(r'^Q\s*Search.*?\n', re.MULTILINE)]
+ACTIONS_BULLETS = ('-', '+', '•')
+
+# Хвостовые артефакты удаляются последовательно: порядок важен,
+# т.к. каждый следующий паттерн применяется к результату предыдущего
+SUMMARY_ARTIFACT_RES = [re.compile(p) for p in [
+    r'\s*\*%\s*$', r'\s*\+\}\s*$', r'\s*GJ!\s*$', r'\s*iG!\s*$',
+    r'\s*AT\s*$', r'\s*AC\s*$', r'\s*NS\s*$', r'\s*[*%+\}]{1,3}\s*$',
+]]
+TAIL_ARTIFACT_RES = [re.compile(p) for p in [r'\s*\*%\s*$', r'\s*\+\}\s*$', r'\s*[*%+\}]{1,3}\s*$']]
+WHITESPACE_RE = re.compile(r'\s+')
+INLINE_WHITESPACE_RE = re.compile(r'[ \t]+')
+BLANK_LINES_RE = re.compile(r'\n\s*\n')
+
+USER_ID_RES = [re.compile(p, re.MULTILINE) for p in [
+    r'\b([A-Z]{2}[0-9]{6})\b', r'\b([A-Z]{2,3}[0-9]{5,7})\b',
+    r'\b([A-Z]{4}[0-9]{4,8})\b', r'\b([0-9]{10,15})\b', r'\b([A-Z]+[0-9]+)\b',
+]]
+USER_ID_STOPWORDS = ['android', 'session', 'length', 'total', 'event', 'device']
+SESSION_LENGTH_RES = [re.compile(p) for p in [r'(\d+h\s*\d+m)', r'(\d+m\s*\d+s)', r'(\d+h)', r'(\d+m)', r'(\d+s)']]
+USERINFO_FIELDS = ['user_id', 'country', 'session_length', 'event_total', 'device_type']
+EVENT_TOTAL_RE = re.compile(r'(?:event\s*total|total)\s*:?\s*(\d+)', re.IGNORECASE)
+
+COUNTRY_KEYWORDS = {
+    'Spain': ['spain', 'españa'], 'Costa Rica': ['costa rica', 'costa'],
+    'Russia': ['russia', 'russian', 'рф'], 'Peru': ['peru', 'perú'],
+    'Bolivia': ['bolivia'], 'Ecuador': ['ecuador'], 'Netherlands': ['netherlands', 'holland'],
+    'Germany': ['germany', 'deutschland'], 'France': ['france', 'francia']
+}
+DEVICE_KEYWORDS = ['android', 'iphone', 'ios', 'windows', 'mac', 'linux']
+
+
+class KeywordAutomaton:
+    """Поиск набора подстрок за один проход с приоритетом меток.
+
+    Эквивалент вложенного цикла "для каждой метки по порядку - есть ли любая из
+    её подстрок в тексте": lookahead-альтернация находит вхождения на каждой позиции
+    (в том числе перекрывающиеся), после чего выбирается метка с наименьшим приоритетом.
+    Ключевые слова с общим началом на одной позиции (costa / costa rica) принадлежат
+    одной метке, поэтому выбор альтернативы на позиции на результат не влияет.
+    """
+
+    def __init__(self, labelled_keywords):
+        self.priority = {}
+        self.labels = []
+        keywords = []
+        for label, words in labelled_keywords:
+            self.labels.append(label)
+            for word in words:
+                if word not in self.priority:
+                    self.priority[word] = len(self.labels) - 1
+                    keywords.append(word)
+        self.regex = re.compile('(?=(' + '|'.join(re.escape(w) for w in keywords) + '))')
+
+    def _best(self, found):
+        if not found:
+            return ''
+        return self.labels[min(self.priority[w] for w in found)]
+
+    def first(self, lowered_text):
+        return self._best(self.regex.findall(lowered_text))
+
+    def first_series(self, lowered):
+        return lowered.str.findall(self.regex).map(self._best)
+
+
+COUNTRY_AUTOMATON = KeywordAutomaton(list(COUNTRY_KEYWORDS.items()))
+DEVICE_AUTOMATON = KeywordAutomaton([(d.capitalize(), [d]) for d in DEVICE_KEYWORDS])
+
+
+def _is_empty(text):
+    return pd.isna(text) or text == 'null' or not text
+
+
+def _remove_patterns(text, patterns):
+    for pattern in patterns:
+        text = pattern.sub('', text)
+    return text
+
+
+# === Построчные функции (API для одного текста) ===
+
+def clean_summary(text):
+    """Очищает summary от технического мусора"""
+    if _is_empty(text):
+        return ''
+
+    clean_lines = []
+    found_content = False
+
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line or SUMMARY_TECHNICAL_RE.search(line):
+            continue
+        if len(line) > 20 and SUMMARY_CONTENT_RE.search(line):
+            found_content = True
+            clean_lines.append(line)
+        elif found_content:
+            clean_lines.append(line)
+
+    if not clean_lines:
+        return ''
+
+    content = ' '.join(clean_lines)
+    # Без слова Highlights регулярка не совпадёт, а на длинном тексте она квадратична
+    highlights_match = SUMMARY_HIGHLIGHTS_RE.search(content) if 'Highlights' in content else None
+    clean_text = highlights_match.group(1).strip() if highlights_match else content.strip()
+    clean_text = _remove_patterns(clean_text, SUMMARY_ARTIFACT_RES)
+    clean_text = WHITESPACE_RE.sub(' ', clean_text)
+    return clean_text.strip()
+
+
+def clean_sentiment(text):
+    """Очищает sentiment от технического мусора"""
+    if _is_empty(text):
+        return ''
+
+    text = SENTIMENT_HEADER_RE.sub('', text)
+    clean_lines = []
+    found_content = False
+
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line or SENTIMENT_TECHNICAL_RE.search(line):
+            continue
+        if len(line) > 15 and SENTIMENT_CONTENT_RE.search(line):
+            found_content = True
+            clean_lines.append(line)
+        elif found_content and len(line) > 10:
+            clean_lines.append(line)
+
+    content = ' '.join(clean_lines) if clean_lines else text.strip()
+    content = _remove_patterns(content, TAIL_ARTIFACT_RES)
+    content = WHITESPACE_RE.sub(' ', content)
+    return content.strip()
+
+
+def clean_actions(text):
+    """Очищает actions от технического мусора"""
+    if _is_empty(text):
+        return ''
+
+    text = ACTIONS_HEADER_RE.sub('', text)
+    action_lines = []
+
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line or ACTIONS_TECHNICAL_RE.search(line):
+            continue
+        if line.startswith(ACTIONS_BULLETS) or (len(line) > 15 and ACTIONS_CONTENT_RE.search(line)):
+            action_lines.append(line)
+
+    if action_lines:
+        content = '\n'.join(action_lines)
+    else:
+        content = _remove_patterns(text.strip(), ACTIONS_FALLBACK_RES)
+
+    content = _remove_patterns(content, TAIL_ARTIFACT_RES)
+    content = INLINE_WHITESPACE_RE.sub(' ', content)
+    content = BLANK_LINES_RE.sub('\n', content)
+    return content.strip()
+
+
+def parse_userinfo_text(text):
+    """Парсинг userinfo из текста"""
+    res = {field: '' for field in USERINFO_FIELDS}
+
+    for pattern in USER_ID_RES:
+        valid_matches = [m for m in pattern.findall(text) if m.lower() not in USER_ID_STOPWORDS]
+        if valid_matches:
+            res['user_id'] = valid_matches[0]
+            break
+
+    combined_lower = text.lower()
+    res['country'] = COUNTRY_AUTOMATON.first(combined_lower)
+
+    for pattern in SESSION_LENGTH_RES:
+        match = pattern.search(text)
+        if match:
+            res['session_length'] = match.group(1)
+            break
+
+    event_match = EVENT_TOTAL_RE.search(text)
+    if event_match:
+        res['event_total'] = event_match.group(1)
+
+    res['device_type'] = DEVICE_AUTOMATON.first(combined_lower)
+    return res
+
+
+# === Пакетный API: очистка целой колонки ===
+# Удобная обертка, а не векторизованный путь: это цикл по колонке с построчными функциями
+# выше, и по скорости он равен построчному вызову. Ускорение дают только предкомпилированные
+# альтернации. Строки pandas (object dtype) методы .str тоже обходят поэлементно; вариант
+# split -> explode -> str.contains -> groupby-join дает те же результаты, но по замерам на
+# эталонном корпусе (benchmarks/ocr_cleaners.py) медленнее примерно в 1.6 раза.
+
+SERIES_CLEANERS = {
+    'summary': clean_summary,
+    'sentiment': clean_sentiment,
+    'actions': clean_actions,
+}
+
+
+def clean_series(texts: pd.Series, field: str) -> pd.Series:
+    """Очистка колонки (обертка над clean_summary / clean_sentiment / clean_actions по field)"""
+    cleaner = SERIES_CLEANERS[field]
+    return pd.Series([cleaner(t) for t in texts], index=texts.index, dtype=object)
+
+
+def parse_userinfo_series(texts: pd.Series) -> pd.DataFrame:
+    """parse_userinfo_text для колонки (обертка, построчно): DataFrame с колонками userinfo"""
+    parsed = [parse_userinfo_text(t) if isinstance(t, str) else parse_userinfo_text('') for t in texts]
+    return pd.DataFrame(parsed, index=texts.index, columns=USERINFO_FIELDS)